@@ -0,0 +1,154 @@
+"""
+    Measures the memory used to open an email with big attachments and then save them, against a fake GMail that needs no network.
+
+    The email is opened twice, the way it used to be, in the "raw" format with the attachments inside it,
+    and the way it is now, in the "full" format with the attachments downloaded on their own when they are saved.
+    The peak is measured with tracemalloc for every step, so the steps can be compared with each other.
+    The responses of the fake GMail are made before measuring, since they are the same for both ways.
+    Attachments are downloaded from a local HTTP server, which writes responses that were made before measuring too.
+
+    Usage: python benchmarks/attachment_memory.py [--attachments 3] [--megabytes 100]
+"""
+
+import argparse
+import base64
+import email.message
+import http.server
+import os
+import sys
+import tempfile
+import threading
+import tracemalloc
+import types
+
+import google.auth.credentials
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+MEGABYTE = 1024 * 1024
+
+def make_attachments(count: int, size: int) -> dict:
+    # the same block repeated keeps making the attachments fast, and compressing them is not measured
+    block = os.urandom(MEGABYTE)
+
+    return {f'attachment-{index}.bin': (block * (size // MEGABYTE + 1))[:size] for index in range(count)}
+
+def make_raw_message_data(attachments: dict) -> dict:
+    message = email.message.EmailMessage()
+    message['From'] = 'sender@example.com'
+    message['Subject'] = 'Big attachments'
+    message.set_content('See the attachments')
+
+    for filename, payload in attachments.items():
+        message.add_attachment(payload, maintype='application', subtype='octet-stream', filename=filename)
+
+    return {'id': 'raw', 'threadId': 'raw', 'labelIds': ['INBOX'], 'raw': base64.urlsafe_b64encode(message.as_bytes()).decode()}
+
+def make_full_message_data(attachments: dict) -> dict:
+    return {
+        'id': 'full',
+        'threadId': 'full',
+        'labelIds': ['INBOX'],
+        'payload': {
+            'mimeType': 'multipart/mixed',
+            'headers': [
+                {'name': 'From', 'value': 'sender@example.com'},
+                {'name': 'Subject', 'value': 'Big attachments'},
+                {'name': 'Content-Type', 'value': 'multipart/mixed; boundary="boundary"'},
+            ],
+            'parts': [
+                {
+                    'mimeType': 'text/plain',
+                    'headers': [{'name': 'Content-Type', 'value': 'text/plain; charset="UTF-8"'}],
+                    'body': {'data': base64.urlsafe_b64encode(b'See the attachments').decode()},
+                },
+            ] + [
+                {
+                    'mimeType': 'application/octet-stream',
+                    'filename': filename,
+                    'headers': [
+                        {'name': 'Content-Type', 'value': 'application/octet-stream'},
+                        {'name': 'Content-Disposition', 'value': f'attachment; filename="{filename}"'},
+                    ],
+                    'body': {'attachmentId': filename, 'size': len(payload)},
+                }
+                for filename, payload in attachments.items()
+            ],
+        },
+    }
+
+class AttachmentHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = self.server.responses[self.path.split('?')[0].rsplit('/', 1)[-1]]
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def make_fake_client(message_data: dict, attachments: dict):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), AttachmentHandler)
+    server.responses = {
+        filename: b'{\n  "size": %d,\n  "data": "%s"\n}\n' % (len(payload), base64.urlsafe_b64encode(payload))
+        for filename, payload in attachments.items()
+    }
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def get_message(userId, id, format):
+        return types.SimpleNamespace(execute=lambda: dict(message_data))
+
+    def get_attachment(userId, messageId, id):
+        return types.SimpleNamespace(uri=f'http://127.0.0.1:{server.server_address[1]}/attachments/{id}?alt=json')
+
+    return types.SimpleNamespace(service=types.SimpleNamespace(
+        credentials=google.auth.credentials.AnonymousCredentials(),
+        messages_service=types.SimpleNamespace(get=get_message),
+        attachments_service=types.SimpleNamespace(get=get_attachment),
+    ))
+
+def measure(description: str, function):
+    tracemalloc.start()
+
+    try:
+        result = function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    print(f'{description:<45} peak {peak / MEGABYTE:8.1f} MB')
+
+    return result
+
+def save_every_attachment(message, directory: str) -> None:
+    for attachment in message.attachments:
+        terminal_gmail_client.write_attachment_to_file(attachment, os.path.join(directory, attachment.filename))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--attachments', type=int, default=3)
+    parser.add_argument('--megabytes', type=int, default=100)
+    arguments = parser.parse_args()
+
+    attachments = make_attachments(arguments.attachments, arguments.megabytes * MEGABYTE)
+
+    print(f'{arguments.attachments} attachments of {arguments.megabytes} MB\n')
+
+    with tempfile.TemporaryDirectory() as directory:
+        terminal_gmail_client.CACHE_DIRECTORY = directory
+
+        full_client = make_fake_client(make_full_message_data(attachments), attachments)
+        full_message = measure('"full" format: open the email', lambda: terminal_gmail_client.get_full_message(full_client, 'full'))
+        measure('"full" format: save every attachment', lambda: save_every_attachment(full_message, directory))
+
+        raw_message_data = make_raw_message_data(attachments)
+        raw_message = measure('"raw" format: open the email', lambda: terminal_gmail_client.make_full_message(None, raw_message_data))
+        measure('"raw" format: save every attachment', lambda: save_every_attachment(raw_message, directory))
+
+if __name__ == '__main__':
+    main()
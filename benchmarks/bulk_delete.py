@@ -0,0 +1,133 @@
+"""
+    Measures how fast the trash is emptied against a local mock of the GMail batchDelete endpoint that injects rate limits and server errors.
+
+    Messages are deleted one request per message like empty_trash used to, with batchDelete one request at a time,
+    and with batchDelete several requests at a time, the way empty_trash does now.
+
+    Usage: python benchmarks/bulk_delete.py [--messages 20000] [--latency-ms 100] [--error-rate 0.1]
+"""
+
+import argparse
+import http.server
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import googleapiclient.http
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+# deleting one message per request is so slow that only this many are deleted, and the rate is compared
+SERIAL_MESSAGES = 100
+
+# the number of batchDelete requests sent at a time, like IO_MAXIMUM_CONCURRENT_OPERATIONS
+PARALLEL_REQUESTS = 8
+
+class MockBatchDeleteHandler(http.server.BaseHTTPRequestHandler):
+    """
+        Answers batchDelete after a delay that grows with the number of ids, failing some requests with 429 or 503.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        gmail_ids = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['ids']
+
+        time.sleep(self.server.latency_seconds + len(gmail_ids) * 0.00002)
+
+        with self.server.lock:
+            self.server.requests += 1
+            status = self.server.rng.choices((204, 429, 503), (1 - self.server.error_rate, self.server.error_rate / 2, self.server.error_rate / 2))[0]
+
+            if status == 204:
+                self.server.deleted += len(gmail_ids)
+            else:
+                self.server.errors += 1
+
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+def make_client(base_url: str):
+    def batch_delete(userId, body):
+        return googleapiclient.http.HttpRequest(
+            googleapiclient.http.build_http(),
+            lambda response, content: None,
+            f'{base_url}/batchDelete',
+            method='POST',
+            body=json.dumps(body),
+            headers={'content-type': 'application/json'},
+        )
+
+    return types.SimpleNamespace(service=types.SimpleNamespace(messages_service=types.SimpleNamespace(batchDelete=batch_delete)))
+
+def restart_io_loop(concurrent_operations: int) -> None:
+    """
+        Makes the next background operation start a new IO loop with this many slots.
+    """
+
+    if terminal_gmail_client.io_loop is not None:
+        terminal_gmail_client.io_loop.call_soon_threadsafe(terminal_gmail_client.io_loop.stop)
+
+    terminal_gmail_client.io_loop = None
+    terminal_gmail_client.IO_MAXIMUM_CONCURRENT_OPERATIONS = concurrent_operations
+
+def measure(description: str, server, client, message_count: int, batch_size: int, concurrent_operations: int) -> None:
+    restart_io_loop(concurrent_operations)
+    terminal_gmail_client.BULK_OPERATION_BATCH_SIZE = batch_size
+
+    server.requests = server.errors = server.deleted = 0
+
+    gmail_ids = [f'{index:08x}' for index in range(message_count)]
+    started_at = time.perf_counter()
+
+    terminal_gmail_client.run_bulk_operation(gmail_ids, lambda batch: terminal_gmail_client.delete_messages(client, batch), 'deleted')
+
+    seconds = time.perf_counter() - started_at
+
+    print(
+        f'{description:<38} {server.deleted:>6} msgs in {seconds:6.1f} s  {server.deleted / seconds:8.0f} msgs/sec  '
+        f'{server.requests:>5} requests, {server.errors} rate limited or failed'
+    )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--latency-ms', type=float, default=100)
+    parser.add_argument('--error-rate', type=float, default=0.1)
+    arguments = parser.parse_args()
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MockBatchDeleteHandler)
+    server.latency_seconds = arguments.latency_ms / 1000
+    server.error_rate = arguments.error_rate
+    server.rng = random.Random(0)
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = make_client(f'http://127.0.0.1:{server.server_address[1]}')
+
+    print(f'{arguments.latency_ms:.0f} ms per request, {arguments.error_rate:.0%} of requests answered with 429 or 503\n')
+
+    # the progress of every batch is not printed
+    terminal_gmail_client.print = lambda *args: None
+
+    with tempfile.TemporaryDirectory() as directory:
+        terminal_gmail_client.CACHE_DIRECTORY = directory
+
+        measure('one request per message', server, client, SERIAL_MESSAGES, 1, 1)
+        measure('batchDelete, one request at a time', server, client, arguments.messages, 1000, 1)
+        measure(f'batchDelete, {PARALLEL_REQUESTS} requests at a time', server, client, arguments.messages, 1000, PARALLEL_REQUESTS)
+
+    restart_io_loop(1)
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
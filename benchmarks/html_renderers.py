@@ -0,0 +1,104 @@
+"""
+    Compares the HTML renderers on newsletters of growing size, and on a newsletter split into more and more segments.
+
+    The HTML of an email is split into segments at its images, like display_html_email does, and the segments are rendered:
+    - in-process with the built in renderer,
+    - with w3m, one process for all the segments,
+    - and with w3m the way it used to be run, writing every segment to a file in the working directory and starting one process per segment.
+    When w3m is not installed, a script that copies its input with cat stands in for it, which measures the cost of the processes alone.
+
+    Usage: python benchmarks/html_renderers.py [--repeat 5]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+from marketing_emails import make_corpus, make_marketing_email
+
+# the newsletter split into more and more segments has this many products, and this many images in every run
+SEGMENTS_PRODUCTS = 40
+SEGMENTS_IMAGES = (0, 2, 5, 10, 20, 40)
+
+def split_into_segments(html: str) -> list:
+    return terminal_gmail_client.html_img_tag_regex.split(html)[::2]
+
+def render_w3m_per_segment(html_segments: list) -> list:
+    rendered_segments = []
+
+    for html_segment in html_segments:
+        with tempfile.NamedTemporaryFile('w', suffix='.html', dir=os.getcwd(), delete=False) as f:
+            f.write(html_segment)
+
+        try:
+            rendered_segments.append(subprocess.run(['w3m', '-dump', '-o', 'color=true', f.name], stdout=subprocess.PIPE).stdout.decode('utf8', 'replace'))
+        finally:
+            os.remove(f.name)
+
+    return rendered_segments
+
+def measure(render, html_segments: list, repeat: int) -> float:
+    timings = []
+
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        render(html_segments)
+        timings.append((time.perf_counter() - started_at) * 1000)
+
+    return statistics.median(timings)
+
+def print_timings(description: str, html: str, repeat: int) -> None:
+    html_segments = split_into_segments(html)
+
+    builtin_milliseconds = measure(lambda segments: terminal_gmail_client.render_html_segments_builtin(segments, width=100), html_segments, repeat)
+    w3m_milliseconds = measure(terminal_gmail_client.render_html_segments_w3m, html_segments, repeat)
+    w3m_per_segment_milliseconds = measure(render_w3m_per_segment, html_segments, repeat)
+
+    print(
+        f'  {description:<26} {len(html) / 1024:6.0f} KB {len(html_segments):>4} segments   '
+        f'built in {builtin_milliseconds:8.1f} ms   w3m {w3m_milliseconds:8.1f} ms   w3m per segment {w3m_per_segment_milliseconds:8.1f} ms'
+    )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        w3m_description = 'w3m'
+
+        if not shutil.which('w3m'):
+            w3m_description = 'w3m stand-in (cat)'
+            stand_in_filepath = os.path.join(directory, 'w3m')
+
+            with open(stand_in_filepath, 'w') as f:
+                # the old way of running w3m passes a file, the new one pipes the HTML in
+                f.write('#!/bin/sh\nfor last; do :; done\nif [ -f "$last" ]; then exec cat "$last"; fi\nexec cat\n')
+
+            os.chmod(stand_in_filepath, 0o755)
+            os.environ['PATH'] = f'{directory}{os.pathsep}{os.environ["PATH"]}'
+
+        print(f'Built in renderer against {w3m_description}, median of {arguments.repeat} runs\n')
+        print('By message size')
+
+        for description, html in make_corpus():
+            print_timings(description, html, arguments.repeat)
+
+        print(f'\nBy segment count, {SEGMENTS_PRODUCTS} products')
+
+        rng = random.Random(0)
+
+        for images in SEGMENTS_IMAGES:
+            print_timings(f'{images} images', make_marketing_email(rng, SEGMENTS_PRODUCTS, images), arguments.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+    Measures the wall clock time display_html_email takes to render newsletters with more and more images.
+
+    It is compared with the way HTML emails used to be rendered:
+    - every image tag was replaced in the whole document one at a time,
+    - every image tag was parsed on its own to read its source,
+    - and every piece of text between images was rendered on its own, which with w3m meant one process per piece.
+    The old code parsed image tags with BeautifulSoup, which is not a dependency anymore, so html.parser stands in for it.
+    When w3m is not installed, a script that copies its input with cat stands in for it, which measures the cost of the processes alone.
+    Images are not downloaded or shown, only the HTML is rendered.
+
+    Usage: python benchmarks/html_rendering.py [--repeat 5]
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+from html.parser import HTMLParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+from marketing_emails import make_corpus
+
+class ImageSourceParser(HTMLParser):
+    def handle_starttag(self, tag, attrs):
+        if tag == 'img':
+            self.src = dict(attrs).get('src')
+
+def render_like_before(html: str, seperator: str = '~$%$~[[', sentinel: str = '*&^%$#@!') -> None:
+    images = []
+
+    for image_tag_match in terminal_gmail_client.html_img_tag_regex.finditer(html):
+        image_tag = image_tag_match.group(0)
+
+        try:
+            image_index = images.index(image_tag)
+        except ValueError:
+            image_index = len(images)
+            images.append(image_tag)
+
+        html = html.replace(image_tag, f'{seperator}{sentinel}-{image_index}{seperator}')
+
+    for image in images:
+        parser = ImageSourceParser()
+        parser.feed(image)
+
+    for html_chunk in html.split(seperator):
+        if not html_chunk.startswith(sentinel):
+            terminal_gmail_client.write_output(''.join(terminal_gmail_client.render_html_segments([html_chunk])))
+
+def render_now(html: str) -> None:
+    terminal_gmail_client.display_html_email(types.SimpleNamespace(html=html, attachments=[]), {})
+
+def measure(function, html: str, repeat: int) -> float:
+    timings = []
+
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function(html)
+        timings.append((time.perf_counter() - started_at) * 1000)
+
+    return statistics.median(timings)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    arguments = parser.parse_args()
+
+    # only the rendering is measured
+    terminal_gmail_client.download_images_in_parallel = lambda indices_and_image_urls, images: None
+    terminal_gmail_client.display_if_image = lambda image_file_path: False
+    terminal_gmail_client.write_output = lambda text: None
+
+    with tempfile.TemporaryDirectory() as directory:
+        w3m_description = 'w3m'
+
+        if not shutil.which('w3m'):
+            w3m_description = 'w3m stand-in (cat)'
+            stand_in_filepath = os.path.join(directory, 'w3m')
+
+            with open(stand_in_filepath, 'w') as f:
+                f.write('#!/bin/sh\nexec cat\n')
+
+            os.chmod(stand_in_filepath, 0o755)
+            os.environ['PATH'] = f'{directory}{os.pathsep}{os.environ["PATH"]}'
+
+        for renderer, description in (('builtin', 'built in'), ('w3m', w3m_description)):
+            terminal_gmail_client.HTML_RENDERER = renderer
+
+            print(f'{description} renderer, median of {arguments.repeat} runs')
+
+            for email_description, html in make_corpus():
+                before_milliseconds = measure(render_like_before, html, arguments.repeat)
+                now_milliseconds = measure(render_now, html, arguments.repeat)
+
+                print(f'  {email_description:<26} {len(html) / 1024:6.0f} KB   before {before_milliseconds:8.1f} ms   now {now_milliseconds:8.1f} ms   {before_milliseconds / now_milliseconds:5.1f}x')
+
+            print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+    Measures how long printing a plain text email takes as the number of inline image tags in it grows.
+
+    It is compared with the way inline images used to be found:
+    - the body was rewritten with one str.replace per image tag to put every tag on a line of its own,
+    - every line was matched against two regexes,
+    - and every tag looked for its attachment by going through all the attachments.
+    Images are not decoded or shown, and nothing is printed, only finding the text and the attachments is measured.
+
+    Usage: python benchmarks/inline_images.py [--repeat 5]
+"""
+
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+TAG_COUNTS = (100, 200, 400, 800)
+PARAGRAPH = 'Thanks for the photos from the weekend, here are a few more from my side. ' * 3
+
+inline_image_regex_gmail = re.compile(r"\[?image: .*\]?")
+inline_image_regex_outlook = re.compile(r"\[?cid:.*\]?")
+
+class Message:
+    """
+        A message with only what printing inline images needs, which can be weakly referenced like the real one.
+    """
+
+    def __init__(self, text: str, attachments: list):
+        self.text = text
+        self.attachments = attachments
+
+def make_message(tag_count: int) -> Message:
+    """
+        Makes a message with a paragraph before every tag, GMail and Outlook tags taking turns, and an attachment for every tag.
+    """
+
+    attachments = [types.SimpleNamespace(filename=f'photo-{index}.jpg', content_id=f'<image{index}@example.com>') for index in range(tag_count)]
+    paragraphs = []
+
+    for index in range(tag_count):
+        tag = f'[image: photo-{index}.jpg]' if index % 2 else f'[cid:image{index}@example.com]'
+        paragraphs.append(f'{PARAGRAPH}\n{tag}\n')
+
+    return Message('\n'.join(paragraphs), attachments)
+
+def find_attachment_like_before(attachment_identifier: str, attachments: list, use_cid: bool = False):
+    for attachment in attachments:
+        if (attachment.content_id[1:-1] if use_cid else attachment.filename) == attachment_identifier:
+            return attachment
+
+    return None
+
+def print_like_before(message: Message) -> None:
+    message_content = message.text
+    image_tags = inline_image_regex_gmail.findall(message_content) + inline_image_regex_outlook.findall(message_content)
+
+    for image_tag in image_tags:
+        if image_tag.startswith('['):
+            message_content = message_content.replace(image_tag, f'\n{image_tag}\n')
+        else:
+            message_content = message_content.replace(image_tag, f'\n[{image_tag}]\n')
+
+    for line in message_content.split('\n'):
+        if inline_image_regex_gmail.findall(line):
+            if 'cid:' in line:
+                attachment_filename = line[12: line.rfind('@')]
+            else:
+                attachment_filename = line[8:-1]
+
+            find_attachment_like_before(attachment_filename, message.attachments)
+        elif inline_image_regex_outlook.findall(line):
+            find_attachment_like_before(line[5:-1], message.attachments, use_cid=True)
+        else:
+            terminal_gmail_client.print(line)
+
+def print_now(message: Message) -> None:
+    for text, attachment_identifier, use_cid in terminal_gmail_client.iter_text_and_inline_images(message.text):
+        if text:
+            for line in text.split('\n'):
+                terminal_gmail_client.print(line)
+
+        if attachment_identifier is not None:
+            terminal_gmail_client.get_attachment_index(message).get((use_cid, attachment_identifier))
+
+def measure(function, tag_count: int, repeat: int) -> float:
+    timings = []
+
+    for _ in range(repeat):
+        # the attachment index is built once per message, which is part of what is measured
+        message = make_message(tag_count)
+
+        started_at = time.perf_counter()
+        function(message)
+        timings.append((time.perf_counter() - started_at) * 1000)
+
+    return statistics.median(timings)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    arguments = parser.parse_args()
+
+    terminal_gmail_client.print = lambda text: None
+
+    print(f'Median of {arguments.repeat} runs, and the time per tag, which stays the same when the time grows linearly')
+
+    for tag_count in TAG_COUNTS:
+        before_milliseconds = measure(print_like_before, tag_count, arguments.repeat)
+        now_milliseconds = measure(print_now, tag_count, arguments.repeat)
+
+        print(
+            f'  {tag_count:>4} tags {len(make_message(tag_count).text) / 1024:5.0f} KB   '
+            f'before {before_milliseconds:8.1f} ms ({before_milliseconds * 1000 / tag_count:6.1f} µs per tag)   '
+            f'now {now_milliseconds:6.2f} ms ({now_milliseconds * 1000 / tag_count:5.1f} µs per tag)   '
+            f'{before_milliseconds / now_milliseconds:6.1f}x'
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+    Makes synthetic HTML marketing emails for the rendering benchmarks.
+    They are laid out like real newsletters: nested tables, inline styles, a logo, a picture for every product, buttons, lists and tracking pixels.
+"""
+
+import random
+
+WORDS = (
+    'new season sale free shipping members only exclusive offer limited time discover collection style comfort '
+    'quality handmade organic fresh favourite save today tomorrow weekend deal bundle gift perfect everyday'
+).split()
+
+def make_sentence(rng: random.Random, word_count: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(word_count)).capitalize() + '.'
+
+def make_product(rng: random.Random, index: int, with_image: bool) -> str:
+    image = (
+        f'<img src="https://cdn.example.com/products/{index}.jpg" width="280" height="280" alt="Product {index}" '
+        'style="display:block;border:0;outline:none;text-decoration:none">'
+        if with_image else ''
+    )
+
+    return (
+        '<tr><td style="padding:16px 24px;font-family:Helvetica,Arial,sans-serif">'
+        '<table role="presentation" width="100%" cellpadding="0" cellspacing="0"><tr>'
+        f'<td width="50%" valign="top">{image}</td>'
+        '<td width="50%" valign="top" style="padding-left:16px">'
+        f'<h2 style="margin:0 0 8px;font-size:20px;color:#222">{make_sentence(rng, 4)}</h2>'
+        f'<p style="margin:0 0 8px;font-size:14px;line-height:20px;color:#555">{make_sentence(rng, 25)} <strong>{make_sentence(rng, 3)}</strong></p>'
+        f'<ul><li>{make_sentence(rng, 5)}</li><li>{make_sentence(rng, 6)}</li><li><em>{make_sentence(rng, 4)}</em></li></ul>'
+        f'<p style="font-size:18px;font-weight:bold">${rng.randint(5, 300)}.{rng.randint(0, 99):02d}</p>'
+        f'<a href="https://shop.example.com/products/{index}?utm_source=newsletter&amp;utm_medium=email" '
+        'style="background:#e4572e;color:#fff;padding:10px 18px;border-radius:4px;text-decoration:none">Shop now</a>'
+        '</td></tr></table></td></tr>'
+    )
+
+def make_marketing_email(rng: random.Random, products: int, images: int) -> str:
+    """
+        Makes a newsletter with this many products, and this many images including the logo and a tracking pixel.
+    """
+
+    # the logo and the tracking pixel are the first two images
+    product_images = max(images - 2, 0)
+
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><style>@media only screen and (max-width:600px){.column{width:100%!important}}</style></head>'
+        '<body style="margin:0;padding:0;background:#f4f4f4">'
+        '<table role="presentation" width="100%" cellpadding="0" cellspacing="0" style="background:#f4f4f4"><tr><td align="center">'
+        '<table role="presentation" width="600" cellpadding="0" cellspacing="0" style="background:#ffffff">'
+        + ('<tr><td align="center" style="padding:24px"><img src="https://cdn.example.com/logo.png" width="160" alt="Shop"></td></tr>' if images else '')
+        + f'<tr><td style="padding:0 24px"><h1 style="font-size:28px">{make_sentence(rng, 5)}</h1><p>{make_sentence(rng, 40)}</p></td></tr>'
+        + ''.join(make_product(rng, index, index < product_images) for index in range(products))
+        + '<tr><td style="padding:24px;font-size:12px;color:#999">'
+        f'<p>{make_sentence(rng, 30)}</p>'
+        '<p><a href="https://shop.example.com/preferences">Preferences</a> | <a href="https://shop.example.com/unsubscribe">Unsubscribe</a></p>'
+        + ('<img src="https://track.example.com/open.gif" width="1" height="1" alt="">' if images > 1 else '')
+        + '</td></tr></table></td></tr></table></body></html>'
+    )
+
+def make_corpus(seed: int = 0) -> list:
+    """
+        Makes (description, html) tuples for newsletters from a short announcement to a long catalogue with 60 images.
+    """
+
+    rng = random.Random(seed)
+
+    return [
+        (f'{products} products, {images} images', make_marketing_email(rng, products, images))
+        for products, images in ((3, 0), (5, 7), (10, 12), (20, 22), (40, 42), (60, 62))
+    ]
@@ -0,0 +1,121 @@
+"""
+    Indexes a synthetic corpus of emails in the local full text search index, and measures how long searches take.
+
+    The emails are made of words picked with a Zipf like distribution, so some words are in most emails and some in very few,
+    and the queries mix common words, rare words, sender names and several words at once.
+
+    Usage: python benchmarks/search_index.py [--messages 100000] [--queries 500]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+VOCABULARY_SIZE = 20000
+BODY_WORDS = 150
+INDEX_BATCH_SIZE = 1000
+
+def make_vocabulary(rng: random.Random) -> list:
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+
+    return [''.join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(VOCABULARY_SIZE)]
+
+def make_messages(count: int, rng: random.Random, vocabulary: list, senders: list) -> list:
+    # the nth most common word is picked about 1/n as often as the most common one
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+    messages = []
+
+    for index in range(count):
+        words = rng.choices(vocabulary, weights, k=BODY_WORDS + 6)
+
+        messages.append(types.SimpleNamespace(
+            gmail_id=f'{index:08x}',
+            from_=rng.choice(senders),
+            to=[rng.choice(senders)],
+            cc=[],
+            subject=' '.join(words[:6]),
+            text=' '.join(words[6:]),
+            html_text='',
+        ))
+
+    return messages
+
+def make_queries(count: int, rng: random.Random, vocabulary: list, senders: list) -> list:
+    """
+        Makes (kind of query, query) tuples, the same number of every kind.
+    """
+
+    kinds = {
+        'common word': lambda: rng.choice(vocabulary[:50]),
+        'rare word': lambda: rng.choice(vocabulary[5000:]),
+        'sender name': lambda: rng.choice(senders).split('@')[0],
+        'two words': lambda: ' '.join(rng.sample(vocabulary[:2000], 2)),
+    }
+
+    return [(kind, make_query()) for _ in range(count // len(kinds)) for kind, make_query in kinds.items()]
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    arguments = parser.parse_args()
+
+    rng = random.Random(0)
+    vocabulary = make_vocabulary(rng)
+    senders = [f'{rng.choice(vocabulary)}.{rng.choice(vocabulary)}@example.com' for _ in range(2000)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        terminal_gmail_client.CACHE_DIRECTORY = directory
+
+        if not terminal_gmail_client.get_message_cache() or not terminal_gmail_client.is_search_index_available:
+            sys.exit('Searching locally needs SQLite with FTS5 support')
+
+        messages = make_messages(arguments.messages, rng, vocabulary, senders)
+
+        started_at = time.perf_counter()
+
+        for batch_start in range(0, len(messages), INDEX_BATCH_SIZE):
+            batch = messages[batch_start: batch_start + INDEX_BATCH_SIZE]
+
+            terminal_gmail_client.cache_messages_data(
+                ({'id': message.gmail_id, 'labelIds': ['INBOX'], 'internalDate': '0'} for message in batch),
+                'metadata'
+            )
+            terminal_gmail_client.index_messages(batch)
+
+        index_seconds = time.perf_counter() - started_at
+
+        print(f'Indexed {len(messages)} messages in {index_seconds:.1f} s ({len(messages) / index_seconds:.0f} msgs/sec)')
+        print(f'Database size {os.path.getsize(os.path.join(directory, terminal_gmail_client.MESSAGE_CACHE_FILENAME)) / 1024 / 1024:.0f} MB\n')
+
+        latencies = {}
+        results = 0
+
+        for kind, query in make_queries(arguments.queries, rng, vocabulary, senders):
+            started_at = time.perf_counter()
+            results += len(terminal_gmail_client.search_local_index(query))
+            latencies.setdefault(kind, []).append((time.perf_counter() - started_at) * 1000)
+
+        all_latencies = [latency for kind_latencies in latencies.values() for latency in kind_latencies]
+
+        print(f'{len(all_latencies)} queries, {results / len(all_latencies):.1f} results on average')
+
+        for kind, kind_latencies in [*latencies.items(), ('all queries', all_latencies)]:
+            print(f'{kind:<12} p50 {percentile(kind_latencies, 0.5):7.2f} ms   p95 {percentile(kind_latencies, 0.95):7.2f} ms   mean {statistics.mean(kind_latencies):7.2f} ms')
+
+if __name__ == '__main__':
+    main()
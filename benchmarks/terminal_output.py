@@ -0,0 +1,112 @@
+"""
+    Measures how many lines per second print writes, to a pipe and to a pseudo terminal.
+
+    A child process prints the lines of a long message, and the parent reads them as fast as it can like a terminal or a pager would.
+    It is compared with the way lines used to be printed, one termcolor.cprint call per line.
+    termcolor is not a dependency anymore, so when it is not installed a function that colors and prints every line the same way stands in for it.
+
+    Usage: python benchmarks/terminal_output.py [--lines 200000] [--repeat 3]
+"""
+
+import argparse
+import os
+import pty
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LINE = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna.'
+
+def print_like_before(text: str) -> None:
+    # termcolor only colors output that goes to a terminal
+    if sys.stdout.isatty():
+        text = f'\x1b[47m\x1b[30m{text}\x1b[0m'
+
+    print(text)
+
+def write_lines(way: str, line_count: int) -> None:
+    """
+        Prints the lines in the child process and writes how long it took to stderr.
+    """
+
+    import terminal_gmail_client
+
+    if way == 'now':
+        print_line = terminal_gmail_client.print
+    else:
+        try:
+            from termcolor import cprint
+            print_line = lambda text: cprint(text, 'black', 'on_white')
+        except ImportError:
+            print_line = print_like_before
+
+    started_at = time.perf_counter()
+
+    for index in range(line_count):
+        print_line(f'{index:>8} {LINE}')
+
+    terminal_gmail_client.flush_output()
+    sys.stdout.flush()
+
+    sys.stderr.write(f'{time.perf_counter() - started_at}\n')
+
+def drain(file_descriptor: int) -> None:
+    try:
+        while os.read(file_descriptor, 1024 * 1024):
+            pass
+    except OSError:
+        # reading the pseudo terminal fails once the child has closed it
+        pass
+
+def run_child(way: str, line_count: int, to_pty: bool) -> float:
+    command = [sys.executable, os.path.abspath(__file__), '--child', way, '--lines', str(line_count)]
+
+    if to_pty:
+        parent_fd, child_fd = pty.openpty()
+    else:
+        parent_fd, child_fd = os.pipe()
+
+    child = subprocess.Popen(command, stdout=child_fd, stderr=subprocess.PIPE)
+    os.close(child_fd)
+
+    reader = threading.Thread(target=drain, args=(parent_fd,))
+    reader.start()
+
+    seconds = float(child.communicate()[1])
+
+    reader.join()
+    os.close(parent_fd)
+
+    return seconds
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', choices=('before', 'now'), help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.child:
+        write_lines(arguments.child, arguments.lines)
+        return
+
+    print(f'{arguments.lines} lines of {len(LINE) + 9} characters, median of {arguments.repeat} runs')
+
+    for to_pty, description in ((False, 'pipe'), (True, 'pseudo terminal')):
+        lines_per_second = {}
+
+        for way in ('before', 'now'):
+            seconds = statistics.median(run_child(way, arguments.lines, to_pty) for _ in range(arguments.repeat))
+            lines_per_second[way] = arguments.lines / seconds
+
+        print(
+            f'  {description:<16} before {lines_per_second["before"]:10.0f} lines/sec   now {lines_per_second["now"]:10.0f} lines/sec   '
+            f'{lines_per_second["now"] / lines_per_second["before"]:5.1f}x'
+        )
+
+if __name__ == '__main__':
+    main()
@@ -1,42 +1,128 @@
-import google_workspace
+from __future__ import annotations
+import time
+startup_started_at = time.perf_counter()
 import re
-import editor
 from typing import Iterable
+from typing import Callable
+from typing import Iterator
 import sys
-from termcolor import cprint
 import os
 import errno
 import tempfile
 import subprocess
-from PIL import Image
-from PIL import UnidentifiedImageError
-import uuid
 import shutil
 import io
 import datetime
 from typing import Optional
 import base64
-import requests
-from bs4 import BeautifulSoup
 from urllib.parse import urlparse
-import urllib3
+from urllib.parse import unquote_to_bytes
 import concurrent.futures
+import sqlite3
+import json
+import threading
+import collections
+import functools
+import hashlib
+import email.utils
+import email.message
+import email.policy
+import email.generator
+import mimetypes
+import secrets
+import itertools
+from html import unescape
+from html.parser import HTMLParser
+import weakref
+import struct
+import binascii
+import bisect
+import builtins
+import atexit
+import asyncio
+import types
+import importlib
 
 ##############################################################################################################################################
 
 # CONFIG
 
 # email options
+# number of new emails shown before checking for newer ones, searches are not limited unless the user asks for it
 MAXIMUM_RETURNED_EMAILS_FROM_SEARCH = 10
 
+# emails of the same conversation are shown together, oldest first, and marking one marks the whole conversation
+SHOW_EMAILS_AS_CONVERSATIONS = False
+
+# quoted history in replies, like long reply chains, is collapsed into one line when it was already shown in an earlier email
+COLLAPSE_SHOWN_QUOTED_HISTORY = True
+
 # set terminal size
 SHOULD_SET_TERMINAL_SIZE = False
 TERMINAL_ROWS = 32
 TERMINAL_COLS = 64
 
-# set number of characters at which an email is considered long
+# set number of characters at which an email or attachment is considered long and shown one screen at a time
 LONG_PRINTED_STRING_MINIMUM_LENGTH = 5000
 
+# local cache of messages that were already downloaded from GMail
+CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'terminal_gmail_client')
+MESSAGE_CACHE_FILENAME = 'messages.sqlite3'
+
+# the GMail login is saved in the current directory, in a file with this name and .session added
+GMAIL_SESSION_NAME = 'my-gmail'
+
+# only ask GMail for changes since the last run when reading new emails
+USE_INCREMENTAL_SYNC = True
+
+# attachments and images are kept in the cache so they are not downloaded again, the least recently used are removed first
+ATTACHMENT_CACHE_MAXIMUM_BYTES = 500 * 1024 * 1024
+
+# attachments left out of their messages are downloaded from GMail as a stream, which fails if it stalls for this long
+ATTACHMENT_DOWNLOAD_CONNECT_TIMEOUT_SECONDS = 10
+ATTACHMENT_DOWNLOAD_READ_TIMEOUT_SECONDS = 60
+
+# remote images in HTML emails are downloaded with a shared connection pool and cached according to their HTTP headers
+REMOTE_IMAGE_CONNECTIONS_PER_HOST = 8
+REMOTE_IMAGE_CONNECT_TIMEOUT_SECONDS = 5
+REMOTE_IMAGE_READ_TIMEOUT_SECONDS = 30
+
+# number of results shown when searching the emails in the local cache
+LOCAL_SEARCH_MAXIMUM_RESULTS = 20
+
+# HTML emails are rendered in-process with 'builtin', or with 'w3m' if it is installed
+HTML_RENDERER = 'builtin'
+
+# images are drawn in-process with 'builtin', or with 'viu' if it is installed
+IMAGE_RENDERER = 'builtin'
+IMAGE_MAXIMUM_ANIMATION_FRAMES = 200
+
+# choose which attachments of an email to download before saving them all at the same time
+DOWNLOAD_ATTACHMENTS_IN_PARALLEL = True
+
+# number of GMail requests, downloads, and attachment writes that can run at the same time
+IO_MAXIMUM_CONCURRENT_OPERATIONS = 8
+
+# number of messages to download in one batch request
+MESSAGE_BATCH_SIZE = 50
+
+# download the next messages in the background while the current one is shown, set depth to 0 to disable
+READ_AHEAD_DEPTH = 2
+READ_AHEAD_MAXIMUM_BYTES = 25 * 1024 * 1024
+
+# operations on many messages at once, like emptying the trash
+BULK_OPERATION_BATCH_SIZE = 1000
+BULK_OPERATION_MAXIMUM_RETRIES = 6
+
+# written emails are saved to an outbox in the cache and sent in the background, so they are not lost if sending fails
+OUTBOX_MAXIMUM_CONCURRENT_SENDS = 2
+OUTBOX_MAXIMUM_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY_SECONDS = 30
+
+# emails bigger than this are uploaded from disk in chunks, and the upload continues where it stopped if it is interrupted
+OUTBOX_RESUMABLE_UPLOAD_MINIMUM_BYTES = 5 * 1024 * 1024
+OUTBOX_UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+
 # seperator when printing to the terminal
 print_line_seperator = '\n------------------------------------------------------------\n'
 
@@ -51,11 +137,149 @@ if SHOULD_SET_TERMINAL_SIZE and TERMINAL_ROWS and TERMINAL_COLS:
 
 EMAIL_VALIDATION_REGEX = re.compile(r'([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(\.[A-Z|a-z]{2,})+')
 
+ANSI_RESET = '\x1b[0m'
+ANSI_BOLD = '\x1b[1m'
+ANSI_ITALIC = '\x1b[3m'
+ANSI_UNDERLINE = '\x1b[4m'
+ANSI_BLUE = '\x1b[34m'
+
+# black text on a white background
+ANSI_PRINT_STYLE = '\x1b[47m\x1b[30m'
+
+ansi_escape_regex = re.compile(r'\x1b\[[0-9;]*m')
+
+# output is collected and written in large pieces, everything is written before waiting for input
+# and output that is waiting, like progress messages, is written after at most OUTPUT_FLUSH_INTERVAL_SECONDS
+OUTPUT_BUFFER_MAXIMUM_CHARACTERS = 64 * 1024
+OUTPUT_FLUSH_INTERVAL_SECONDS = 0.1
+
+should_color_output = sys.stdout.isatty() and not os.environ.get('NO_COLOR')
+output_buffer = []
+output_buffer_length = 0
+output_lock = threading.RLock()
+output_flusher_thread = None
+
+def write_output(text: str) -> None:
+    """
+        Adds text to the output buffer and writes the buffer to the terminal once it is big enough.
+        Colors are left out when the output is not a terminal.
+    """
+
+    global output_buffer_length, output_flusher_thread
+
+    if not should_color_output:
+        text = ansi_escape_regex.sub('', text)
+
+    with output_lock:
+        output_buffer.append(text)
+        output_buffer_length += len(text)
+
+        if output_buffer_length >= OUTPUT_BUFFER_MAXIMUM_CHARACTERS:
+            flush_output()
+
+        if output_flusher_thread is None:
+            output_flusher_thread = threading.Thread(target=flush_output_periodically, daemon=True)
+            output_flusher_thread.start()
+
+def flush_output_periodically() -> None:
+    """
+        Writes the output buffer every OUTPUT_FLUSH_INTERVAL_SECONDS if there is anything in it.
+    """
+
+    while True:
+        time.sleep(OUTPUT_FLUSH_INTERVAL_SECONDS)
+
+        if output_buffer:
+            flush_output()
+
+def flush_output() -> None:
+    """
+        Writes everything in the output buffer to the terminal.
+    """
+
+    global output_buffer_length
+
+    with output_lock:
+        if output_buffer:
+            sys.stdout.write(''.join(output_buffer))
+            output_buffer.clear()
+            output_buffer_length = 0
+
+        sys.stdout.flush()
+
 # pretty print
 def pprint(text) -> None:
-    cprint(text, "black", "on_white")
+    if should_color_output:
+        write_output(f'{ANSI_PRINT_STYLE}{text}{ANSI_RESET}\n')
+    else:
+        write_output(f'{text}\n')
+
+def flushed_input(*args) -> str:
+    """
+        Writes everything printed so far before waiting for input.
+    """
+
+    flush_output()
+
+    return builtins.input(*args)
 
 print = pprint
+input = flushed_input
+
+atexit.register(flush_output)
+
+##############################################################################################################################################
+
+# LAZY IMPORT FUNCTIONS
+
+# time taken by every part of starting up, printed with --profile-startup
+startup_timings = []
+
+def record_startup_timing(phase: str, started_at: float) -> None:
+    """
+        Remembers how long a part of starting up took.
+    """
+
+    startup_timings.append((phase, time.perf_counter() - started_at))
+
+class LazyModule(types.ModuleType):
+    """
+        Stands in for a module that is only imported the first time one of its attributes is used.
+        Submodules that the package does not import itself are imported the same way.
+    """
+
+    def _load(self) -> types.ModuleType:
+        module_name = self.__name__
+
+        if module_name in sys.modules:
+            return sys.modules[module_name]
+
+        started_at = time.perf_counter()
+        module = importlib.import_module(module_name)
+        record_startup_timing(f'import {module_name}', started_at)
+
+        return module
+
+    def __getattr__(self, name):
+        module = self._load()
+
+        try:
+            return getattr(module, name)
+        except AttributeError:
+            return importlib.import_module(f'{self.__name__}.{name}')
+
+# these take most of the time it takes to start, and are not needed before the menu is shown
+google_workspace = LazyModule('google_workspace')
+googleapiclient = LazyModule('googleapiclient')
+google_auth_httplib2 = LazyModule('google_auth_httplib2')
+google_auth_requests = LazyModule('google.auth.transport.requests')
+google_auth_exceptions = LazyModule('google.auth.exceptions')
+editor = LazyModule('editor')
+Image = LazyModule('PIL.Image')
+requests = LazyModule('requests')
+urllib3 = LazyModule('urllib3')
+
+record_startup_timing('import standard library modules', startup_started_at)
 
 ##############################################################################################################################################
 
@@ -115,6 +339,7 @@ def ask_for_non_blank_user_input(prompt: str, use_editor: bool = False) -> str:
         print(prompt)
 
         if use_editor:
+            flush_output()
             user_input = editor.edit().decode('utf8')
         else:
             user_input = input().strip()
@@ -184,6 +409,7 @@ def gather_to_cc_bcc_email_recipients(actual_recipients: list, actual_cc: list,
 def add_attachments() -> list:
     """
         Add attachments to an email by putting their filepaths into a list.
+        They are read from disk a chunk at a time when the email is written to the outbox.
     """
     
     attachments = []
@@ -225,9 +451,10 @@ def accept_any_input(prompt: str, blank_is_none: bool = False) -> Optional[str]:
 def accept_any_input_blank_is_none(prompt: str) -> Optional[str]:
     return accept_any_input(prompt, True)
     
-def ask_for_integer_input(prompt: str, maximum: int, minimum: int = 0, maximum_on_blank: bool = True) -> int:
+def ask_for_integer_input(prompt: str, maximum: Optional[int], minimum: int = 0, maximum_on_blank: bool = True) -> Optional[int]:
     """
         Gets user input from the terminal and checks if it is an integer in the correct range.
+        A maximum of None means there is no upper bound, so a blank answer returns None.
     """
 
     while True:
@@ -248,7 +475,7 @@ def ask_for_integer_input(prompt: str, maximum: int, minimum: int = 0, maximum_o
             print(f'Value must be at least {minimum}')
             continue
              
-        if user_input > maximum:
+        if maximum is not None and user_input > maximum:
             print(f'Value must be at most {maximum}')
             continue
             
@@ -444,354 +671,3572 @@ def connect() -> google_workspace.gmail.GmailClient:
     """
         Connects to the GMail API via OAUTH.
     """
+
+    # the saved token is refreshed here when it has expired
+    started_at = time.perf_counter()
     service = google_workspace.service.GoogleService(
         api="gmail",
-        session="my-gmail",
+        session=GMAIL_SESSION_NAME,
         client_secrets="client_secret.json"
     )
+    record_startup_timing('connect: load the session and refresh the token', started_at)
 
+    # only opens the browser if there is no saved session yet
+    started_at = time.perf_counter()
     service.local_oauth()
+    record_startup_timing('connect: authorize with OAuth', started_at)
 
-    client = google_workspace.gmail.GmailClient(service=service)
-    print(f'Logged in to GMail as {client.email_address}')
-    return client
+    # messages are downloaded on worker threads as well, so every request needs its own connection
+    service.make_thread_safe()
 
-gmail_client = connect()
+    client = google_workspace.gmail.GmailClient(service=service)
 
-##############################################################################################################################################
+    started_at = time.perf_counter()
+    client.email_address
+    record_startup_timing('connect: look up the email address', started_at)
 
-# EMAIL READING / WRITING FUNCTIONS
+    return client
 
-textchars = bytearray({7,8,9,10,12,13,27} | set(range(0x20, 0x100)) - {0x7f})
-is_binary_string = lambda bytes: bool(bytes.translate(None, textchars))
-inline_image_regex_gmail = re.compile(r"\[?image: .*\]?")
-inline_image_regex_outlook = re.compile(r"\[?cid:.*\]?")
-html_img_tag_regex = re.compile(r'<img[^>]*src="([^"]+)"[^>]*>')
+gmail_client_future = None
+gmail_client_lock = threading.Lock()
+has_printed_email_address = False
 
-def make_sure_images_are_on_seperate_lines(message_content) -> str:
+def start_connecting() -> concurrent.futures.Future:
     """
-        Puts breaklines around inline images in email text.
+        Starts connecting to GMail in the background, so the menu can be shown while it happens.
     """
-    
-    image_tags = inline_image_regex_gmail.findall(message_content) + inline_image_regex_outlook.findall(message_content)
-
-    for image_tag in image_tags:
-        if image_tag.startswith('['):
-            message_content = message_content.replace(image_tag, f'\n{image_tag}\n')
-        else:
-            message_content = message_content.replace(image_tag, f'\n[{image_tag}]\n')
-            
-    return message_content
-
-def download_images_in_parallel(indices_and_image_urls, images):
-    def download_image(index_and_image_url):
-        index, img_url = index_and_image_url
-
-        try:
-            r = requests.get(img_url, allow_redirects=True)
-            filepath = str(uuid.uuid4())
-
-            with open(filepath, 'wb') as f:
-                f.write(r.content)
 
-            images[index] = filepath
-        except (requests.exceptions.InvalidURL, requests.exceptions.ConnectionError, urllib3.exceptions.MaxRetryError, urllib3.exceptions.NameResolutionError):
-            images[index] = None
+    global gmail_client_future
 
-    with concurrent.futures.ThreadPoolExecutor() as exector: 
-        exector.map(download_image, indices_and_image_urls)
+    with gmail_client_lock:
+        if gmail_client_future is None:
+            gmail_client_future = submit_io(connect)
 
+    return gmail_client_future
 
-def display_html_email(message, downloaded_attachment_location_map, seperator='~$%$~[[', sentinel='*&^%$#@!') -> None:
+def is_gmail_session_saved() -> bool:
     """
-        Prints HTML email and optionally downloads inline images
+        Checks if there is a saved GMail login, so connecting will not need the user to sign in in the browser.
     """
-    
-    html = message.html
-    image_tag_indexes = [(i.start(), i.end()) for i in re.finditer(html_img_tag_regex, html)]
-    images = []
-    cid_indexes = []
-    indices_and_image_urls = []
-    attachment_filepaths = set()
-    sentinel_prefix_length = len(sentinel) + 1
-    ask_to_save_inline_images = False
-    last_domain_accessed = ''
-
-    for (start, end) in image_tag_indexes:
-        image_tag = message.html[start: end]
 
-        try:
-            image_index = images.index(image_tag)
-        except ValueError:
-            image_index = len(images)
-            images.append(image_tag)
+    return os.path.exists(f'{GMAIL_SESSION_NAME}.session')
 
-        html = html.replace(image_tag, f'{seperator}{sentinel}-{image_index}{seperator}')
+def get_gmail_client() -> google_workspace.gmail.GmailClient:
+    """
+        Gets the connection to GMail, connecting first if that has not happened yet.
+    """
 
-    for index, image in enumerate(images):
-        soup = BeautifulSoup(image, 'html.parser')
-        img_src = soup.find_all('img')[0]['src']
+    global has_printed_email_address
 
-        if img_src.startswith('cid'):
-            cid = ':'.join(img_src.split(':')[1:]).strip()
-            filename, filepath = download_attachment(cid, message.attachments, use_cid=True)
+    client = start_connecting().result()
 
-            if filename and filepath:
-                downloaded_attachment_location_map[filename] = filepath
-                attachment_filepaths.add(filepath)
-            
-            images[index] = filepath
-            cid_indexes.append(index)
-                
-        elif img_src.startswith('data:'):
-            # base64 encoded: decode and save as file
+    if not has_printed_email_address:
+        has_printed_email_address = True
+        print(f'Logged in to GMail as {client.email_address}')
 
-            base_64_string = img_src.split(',')[1:].strip()
-            decoded_img_data = base64.b64decode(base_64_string)
-            filepath = str(uuid.uuid4())
+    return client
 
-            with open(filepath, 'wb') as f:
-                f.write(decoded_img_data)
+def new_authorized_http(client):
+    """
+        Makes a new connection to GMail with the credentials of the client.
+        make_thread_safe only gives single requests their own connection, so batch requests and uploads running on the IO threads need one of these.
+    """
 
-            images[index] = filepath
-        else:
-            # probably points to URL
+    return google_auth_httplib2.AuthorizedHttp(client.service.credentials, http=googleapiclient.http.build_http())
 
-            domain = urlparse(img_src).netloc
+def print_startup_profile() -> None:
+    """
+        Prints how long every part of starting up took, including the imports that are put off until they are needed.
+    """
 
-            if domain:
-                last_domain_accessed = domain
-            else:
-                img_src = f'https://{last_domain_accessed}{img_src}'
+    started_at = time.perf_counter()
+    get_gmail_client()
+    record_startup_timing('wait for the connection after the menu was shown', started_at)
 
-            indices_and_image_urls.append(
-                   (index, img_src)
-            )
-   
-    download_images_in_parallel(indices_and_image_urls, images)
+    # import the modules that are only needed later, so their cost shows up as well
+    for lazy_module in (Image, editor, requests, urllib3, googleapiclient):
+        lazy_module._load()
 
-    temp_html_filepath = 'temp_html.html'
+    print('\nStartup profile:')
 
-    for html_chunk in html.split(seperator):
-        if html_chunk.startswith(sentinel):
-            image_index = int(html_chunk[sentinel_prefix_length:])
+    for phase, seconds in startup_timings:
+        print(f' {seconds * 1000:8.1f} ms  {phase}')
 
-            image_to_display = images[image_index]
-            
-            if not image_to_display:
-                continue
+##############################################################################################################################################
 
-            is_image = display_if_image(image_to_display)
+# IO CORE FUNCTIONS
 
-            if is_image and (image_index not in cid_indexes):
-                ask_to_save_inline_images = True
-        else:
-            with open(temp_html_filepath, 'w') as f:
-                f.write(html_chunk)
-                f.flush()
+# GMail API requests, HTTP downloads and attachment writes run on an asyncio event loop in a background thread,
+# sharing IO_MAXIMUM_CONCURRENT_OPERATIONS slots, so the prompts are never blocked by work that can wait
+io_loop = None
+io_executor = None
+io_semaphore = None
+io_loop_lock = threading.Lock()
 
-            subprocess.run(['w3m', '-dump', '-o', 'color=true', temp_html_filepath])
+# set when the user stopped waiting for operations at exit, which can still be blocked in a request or waiting to retry one
+is_io_abandoned = False
 
-    inline_images = [image for image in (set(images) - attachment_filepaths) if image]
+def get_io_loop() -> asyncio.AbstractEventLoop:
+    """
+        Gets the event loop that runs network and disk operations, starting it on a background thread the first time.
+    """
 
-    if ask_to_save_inline_images:
-        should_download_inline_images = ask_for_user_input('Do you want to download inline images? (Y or N)', ('Y', 'N'))
+    global io_loop, io_executor, io_semaphore
 
-        if should_download_inline_images == 'Y':
-            for index, image in enumerate(inline_images):
-                if not display_if_image(image):
-                    os.remove(image)
-                    continue
+    with io_loop_lock:
+        if io_loop is None:
+            io_loop = asyncio.new_event_loop()
 
-                should_download = ask_for_user_input(f'Do you want to (D)ownload or (S)kip the above image?', ('D', 'S'))
+            # the blocking GMail and HTTP clients run on the default executor, one thread per slot
+            io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=IO_MAXIMUM_CONCURRENT_OPERATIONS, thread_name_prefix='io')
+            io_loop.set_default_executor(io_executor)
+            io_semaphore = asyncio.Semaphore(IO_MAXIMUM_CONCURRENT_OPERATIONS)
 
-                default_download_location = f'inline-image-{index}'
+            threading.Thread(target=io_loop.run_forever, name='io-loop', daemon=True).start()
 
-                # download attachment
-                if should_download == 'D':
-                    requested_filepath = get_valid_filepath(f'Please enter the path you want to download this file to. Press Enter for {default_download_location}')
+    return io_loop
 
-                    requested_filepath = requested_filepath if requested_filepath else default_download_location
+async def run_blocking_io(function: Callable, *args):
+    """
+        Runs a blocking function on the executor of the event loop once one of the slots is free.
+    """
 
-                    shutil.move(image, requested_filepath)
-                else:
-                    os.remove(image)
+    async with io_semaphore:
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args))
 
-        else:
-            for image in inline_images:
-                os.remove(image)
+def submit_io(function: Callable, *args) -> concurrent.futures.Future:
+    """
+        Runs a blocking network or disk operation in the background and returns a future for its result.
+        Cancelling the future before the operation starts means it never runs.
+        Operations running in the background must not wait for other operations, or they could wait for a slot forever.
+    """
 
-    os.remove(temp_html_filepath)
+    return asyncio.run_coroutine_threadsafe(run_blocking_io(function, *args), get_io_loop())
 
-def is_filename_an_image(attachment_file_path) -> bool:
+def run_io(function: Callable, *args):
     """
-        Checks if a filepath points to an image.
+        Runs a blocking network or disk operation in the background and waits for its result.
     """
-    
-    try:
-        image = Image.open(attachment_file_path)
 
-        if image.size == (1, 1):
-            return False
+    future = submit_io(function, *args)
 
-        return True
-    except UnidentifiedImageError:
-        return False
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
 
-def is_attachment_an_image(attachment) -> bool:
+def cancel_io(futures: Iterable) -> None:
     """
-        Checks if an attachment file is an image.
+        Cancels operations that have not finished yet.
     """
-    
-    try:
-        image = Image.open(
-            io.BytesIO(
-                attachment.payload
-            )
-        )
 
-        if image.size == (1, 1):
-            return False
+    for future in futures:
+        future.cancel()
 
-        return True
-    except UnidentifiedImageError:
-        return False
-    
-def display_if_image(image_file_path) -> bool:
+async def wait_for_io_tasks() -> None:
     """
-        Prints a file to the terminal if it is an image.
+        Waits for every operation that is still running on the event loop.
     """
-    
-    if not is_filename_an_image(image_file_path):
-        return False
-        
-    try:
-        subprocess.call(
-            f'~/.cargo/bin/viu "{image_file_path}"',
-            shell=True
-        )
-    except KeyboardInterrupt:
-        pass
 
-    return True
-        
-def display_first_image_attachment_you_can_find(attachments) -> tuple:
-    """
-        Displays the first image found in the attachments.
-        This is used when a malformed image tag is found in the message text.
-    """
-    
-    for attachment in attachments:
-        if is_attachment_an_image(attachment):
-            return display_attachment(attachment)
-            
-    return None, None
-        
-def display_inline_image(attachment_identifier, attachments, use_cid=False) -> tuple:
+    # finished operations can start new ones, like the next email in the outbox
+    while True:
+        io_tasks = asyncio.all_tasks() - {asyncio.current_task()}
+
+        if not io_tasks:
+            return
+
+        await asyncio.wait(io_tasks)
+
+def cancel_io_tasks() -> None:
     """
-        Prints an image to the terminal identified by an inline image tag in the email.
+        Cancels every operation on the event loop, this has to run on the event loop.
     """
-    
-    if use_cid:
-        for attachment in attachments:
-            if attachment.content_id[1:-1] == attachment_identifier:
-                return display_attachment(attachment)
-    else:
-        for attachment in attachments:
-            if attachment.filename == attachment_identifier:
-                return display_attachment(attachment)
-                
-    return display_first_image_attachment_you_can_find(attachments)
 
-def download_attachment(attachment_identifier, attachments, use_cid=False) -> tuple:
+    for io_task in asyncio.all_tasks():
+        io_task.cancel()
+
+def shutdown_io() -> None:
     """
-        Download an attachment and return the filepath
+        Lets operations that are still running, like marking an email as read, finish before the program exits.
+        Pressing Control + C cancels them instead, and operations already running on the executor are abandoned, see exit_abandoning_io.
     """
 
-    matched_attachment = None
+    global is_io_abandoned
 
-    if use_cid:
-        for attachment in attachments:
-            if attachment.content_id[1:-1] == attachment_identifier:
-                matched_attachment = attachment
-                break
-    else:
-        for attachment in attachments:
-            if attachment.filename == attachment_identifier:
-                matched_attachment = attachment
-                break
+    if io_loop is None or not io_loop.is_running():
+        return
 
-    if matched_attachment:
-        filepath = str(uuid.uuid4())
-        attachment.download(filepath)
+    try:
+        asyncio.run_coroutine_threadsafe(wait_for_io_tasks(), io_loop).result()
+    except KeyboardInterrupt:
+        io_loop.call_soon_threadsafe(cancel_io_tasks)
+        io_executor.shutdown(wait=False, cancel_futures=True)
+        is_io_abandoned = True
 
-        return matched_attachment.filename, filepath
-    else:
-        return None, None
+    io_loop.call_soon_threadsafe(io_loop.stop)
 
-def display_attachment(attachment, downloaded_attachment_location_map=None) -> tuple:
+def exit_abandoning_io() -> None:
     """
-        Prints an image to the terminal identified by an inline image tag in the email.
+        Exits right away if operations were abandoned by shutdown_io.
+        Python waits for the threads of the executor before exiting, and they can be blocked in a request or sleeping before a retry for a minute.
     """
-    
-    if downloaded_attachment_location_map and attachment.filename in downloaded_attachment_location_map:
-        filepath = downloaded_attachment_location_map[attachment.filename]
-    else:
-        filepath = str(uuid.uuid4())
-        attachment.download(filepath)
 
-    return filepath, display_if_image(filepath)
-    
-def read_new_messages() -> None:
-    """
-        Read messages that have not been read yet.
-    """
-   
-    message_ids_encountered = set()
+    if is_io_abandoned:
+        flush_output()
+        os._exit(130)
 
-    while True:
-        message_ids_encountered_this_batch = read_messages(gmail_client.get_messages(seen=False, limit=MAXIMUM_RETURNED_EMAILS_FROM_SEARCH), message_ids_encountered)
+##############################################################################################################################################
 
-        if not message_ids_encountered_this_batch:
-            return
+# MESSAGE CACHE FUNCTIONS
 
-        message_ids_encountered = message_ids_encountered.union(set(message_ids_encountered_this_batch))
+# headers printed for every message in read_messages
+MESSAGE_LIST_HEADERS = ['Date', 'From', 'To', 'Cc', 'Bcc', 'Subject']
 
-def empty_trash() -> None:
+message_cache_connection = None
+message_cache_lock = threading.RLock()
+
+# the full text search index needs SQLite to be compiled with FTS5
+is_search_index_available = True
+
+def get_message_cache() -> sqlite3.Connection:
     """
-        Deletes all messages from the trash
+        Opens the local SQLite message cache, creating it if it does not exist yet.
     """
-   
-    message_ids_encountered = set()
-    messages_deleted = 0
 
-    while True:
-        messages = gmail_client.get_messages(
-            label_name='trash', 
-            include_spam_and_trash=True, 
-            limit=MAXIMUM_RETURNED_EMAILS_FROM_SEARCH
-        )
+    global message_cache_connection
+    global is_search_index_available
 
-        message_ids_encountered_this_batch = delete_messages(messages, message_ids_encountered)
+    with message_cache_lock:
+        if message_cache_connection is None:
+            os.makedirs(CACHE_DIRECTORY, exist_ok=True)
 
-        if not message_ids_encountered_this_batch:
-            break
+            message_cache_connection = sqlite3.connect(
+                os.path.join(CACHE_DIRECTORY, MESSAGE_CACHE_FILENAME),
+                check_same_thread=False
+            )
 
-        messages_deleted += len(message_ids_encountered_this_batch)
+            message_cache_connection.execute(
+                'CREATE TABLE IF NOT EXISTS messages ('
+                'gmail_id TEXT PRIMARY KEY, '
+                'thread_id TEXT, '
+                'history_id TEXT, '
+                'label_ids TEXT, '
+                'internal_date INTEGER, '
+                'metadata TEXT, '
+                'message_data TEXT)'
+            )
 
-        print(f'{messages_deleted} messages deleted')
+            message_cache_connection.execute(
+                'CREATE TABLE IF NOT EXISTS sync_state ('
+                'key TEXT PRIMARY KEY, '
+                'value TEXT)'
+            )
 
-        message_ids_encountered = message_ids_encountered.union(set(message_ids_encountered_this_batch))
+            message_cache_connection.execute(
+                'CREATE TABLE IF NOT EXISTS http_cache ('
+                'url TEXT PRIMARY KEY, '
+                'etag TEXT, '
+                'last_modified TEXT, '
+                'expires_at REAL, '
+                'filepath TEXT)'
+            )
 
-    print('trash emptied')
+            message_cache_connection.execute(
+                'CREATE TABLE IF NOT EXISTS outbox ('
+                'outbox_id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'filepath TEXT, '
+                'thread_id TEXT, '
+                'recipients TEXT, '
+                'subject TEXT, '
+                'status TEXT, '
+                'attempts INTEGER, '
+                'last_error TEXT, '
+                'next_attempt_at REAL, '
+                'upload_uri TEXT, '
+                'uploaded_bytes INTEGER)'
+            )
 
-def mark_read(message: google_workspace.gmail.message.Message) -> None:
-    """
-        Marks message as read if it is currently marked as unread.
+            message_cache_connection.execute(
+                'CREATE TABLE IF NOT EXISTS attachments ('
+                'gmail_id TEXT, '
+                'attachment_index INTEGER, '
+                'content_hash TEXT, '
+                'PRIMARY KEY (gmail_id, attachment_index))'
+            )
+
+            # outboxes created before uploads could be resumed
+            for column in ('upload_uri TEXT', 'uploaded_bytes INTEGER'):
+                try:
+                    message_cache_connection.execute(f'ALTER TABLE outbox ADD COLUMN {column}')
+                except sqlite3.OperationalError:
+                    pass
+
+            # rows share their rowid with the messages table
+            try:
+                message_cache_connection.execute(
+                    'CREATE VIRTUAL TABLE IF NOT EXISTS message_search_index USING fts5('
+                    'sender, '
+                    'recipients, '
+                    'subject, '
+                    'body)'
+                )
+            except sqlite3.OperationalError:
+                is_search_index_available = False
+
+            message_cache_connection.commit()
+
+    return message_cache_connection
+
+def get_cached_messages_data(gmail_ids: list, allow_metadata: bool = False) -> dict:
+    """
+        Looks up messages in the local cache and returns their raw API data keyed by gmail_id.
+        With allow_metadata, messages that only have their headers cached are returned in the "metadata" format.
+    """
+
+    if not gmail_ids:
+        return {}
+
+    placeholders = ', '.join('?' * len(gmail_ids))
+    data_column = 'COALESCE(message_data, metadata)' if allow_metadata else 'message_data'
+
+    with message_cache_lock:
+        rows = get_message_cache().execute(
+            f'SELECT gmail_id, label_ids, {data_column} FROM messages WHERE {data_column} IS NOT NULL AND gmail_id IN ({placeholders})',
+            list(gmail_ids)
+        ).fetchall()
+
+    cached_messages_data = {}
+
+    for gmail_id, label_ids, message_data in rows:
+        message_data = json.loads(message_data)
+
+        # labels are stored seperately because they are the only part of a message that can change
+        message_data['labelIds'] = json.loads(label_ids)
+
+        cached_messages_data[gmail_id] = message_data
+
+    return cached_messages_data
+
+def get_cached_label_ids(gmail_ids: list) -> dict:
+    """
+        Looks up only the labels of messages in the local cache, keyed by gmail_id.
+    """
+
+    placeholders = ', '.join('?' * len(gmail_ids))
+
+    with message_cache_lock:
+        rows = get_message_cache().execute(
+            f'SELECT gmail_id, label_ids FROM messages WHERE label_ids IS NOT NULL AND gmail_id IN ({placeholders})',
+            list(gmail_ids)
+        ).fetchall()
+
+    return {gmail_id: json.loads(label_ids) for gmail_id, label_ids in rows}
+
+def cache_messages_data(messages_data: Iterable, data_column: str = 'message_data') -> None:
+    """
+        Saves raw API message data to the local cache.
+        Use data_column='metadata' for messages downloaded in the "metadata" format.
+    """
+
+    rows = [
+        (
+            message_data['id'],
+            message_data.get('threadId'),
+            message_data.get('historyId'),
+            json.dumps(message_data.get('labelIds', [])),
+            int(message_data.get('internalDate', 0)),
+            json.dumps(message_data),
+        )
+        for message_data in messages_data
+    ]
+
+    with message_cache_lock:
+        connection = get_message_cache()
+
+        connection.executemany(
+            f'INSERT INTO messages (gmail_id, thread_id, history_id, label_ids, internal_date, {data_column}) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(gmail_id) DO UPDATE SET '
+            'thread_id = excluded.thread_id, '
+            'history_id = excluded.history_id, '
+            'label_ids = excluded.label_ids, '
+            'internal_date = excluded.internal_date, '
+            f'{data_column} = excluded.{data_column}',
+            rows
+        )
+
+        connection.commit()
+
+def update_cached_label_ids_in_bulk(gmail_ids: Iterable, add_label_ids: list, remove_label_ids: list) -> None:
+    """
+        Applies a label change made with one batch request to every cached message it affected.
+    """
+
+    with message_cache_lock:
+        connection = get_message_cache()
+
+        for gmail_id in gmail_ids:
+            row = connection.execute('SELECT label_ids FROM messages WHERE gmail_id = ?', (gmail_id,)).fetchone()
+
+            if not row or row[0] is None:
+                continue
+
+            label_ids = [label_id for label_id in json.loads(row[0]) if label_id not in remove_label_ids]
+            label_ids += [label_id for label_id in add_label_ids if label_id not in label_ids]
+
+            connection.execute('UPDATE messages SET label_ids = ? WHERE gmail_id = ?', (json.dumps(label_ids), gmail_id))
+
+        connection.commit()
+
+def update_cached_label_ids(modify_response: dict) -> None:
+    """
+        Invalidates the cached labels of a message using the response of a call that changed them.
+    """
+
+    if not modify_response or 'labelIds' not in modify_response:
+        return
+
+    with message_cache_lock:
+        connection = get_message_cache()
+
+        connection.execute(
+            'UPDATE messages SET label_ids = ? WHERE gmail_id = ?',
+            (json.dumps(modify_response['labelIds']), modify_response['id'])
+        )
+
+        connection.commit()
+
+def forget_cached_messages(gmail_ids: Iterable) -> None:
+    """
+        Removes messages from the local cache.
+    """
+
+    rows = [(gmail_id,) for gmail_id in gmail_ids]
+
+    with message_cache_lock:
+        connection = get_message_cache()
+
+        if is_search_index_available:
+            connection.executemany('DELETE FROM message_search_index WHERE rowid IN (SELECT rowid FROM messages WHERE gmail_id = ?)', rows)
+
+        connection.executemany('DELETE FROM messages WHERE gmail_id = ?', rows)
+        connection.executemany('DELETE FROM attachments WHERE gmail_id = ?', rows)
+        connection.commit()
+
+def index_messages(messages: Iterable) -> None:
+    """
+        Adds cached messages to the local full text search index, replacing what was indexed for them before.
+        Messages that only have their headers downloaded are indexed without their text.
+    """
+
+    if not is_search_index_available:
+        return
+
+    with message_cache_lock:
+        connection = get_message_cache()
+
+        for message in messages:
+            row = connection.execute('SELECT rowid FROM messages WHERE gmail_id = ?', (message.gmail_id,)).fetchone()
+
+            if not row:
+                continue
+
+            if isinstance(message, LazyMessage):
+                body = ''
+            else:
+                body = f'{message.text}\n{message.html_text}'
+
+            connection.execute(
+                'INSERT OR REPLACE INTO message_search_index (rowid, sender, recipients, subject, body) VALUES (?, ?, ?, ?, ?)',
+                (row[0], message.from_ or '', ', '.join(message.to + message.cc), message.subject, body)
+            )
+
+        connection.commit()
+
+def search_local_index(query: str, limit: int = LOCAL_SEARCH_MAXIMUM_RESULTS) -> list:
+    """
+        Searches the local full text search index for messages containing every word of the query, best matches first.
+        Returns (gmail_id, sender, subject, snippet) tuples.
+    """
+
+    # quote every word so punctuation in the query is not read as FTS5 syntax
+    match_expression = ' '.join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+    with message_cache_lock:
+        return get_message_cache().execute(
+            'SELECT messages.gmail_id, message_search_index.sender, message_search_index.subject, '
+            "snippet(message_search_index, -1, '*', '*', '...', 16) "
+            'FROM message_search_index JOIN messages ON messages.rowid = message_search_index.rowid '
+            'WHERE message_search_index MATCH ? '
+            'ORDER BY bm25(message_search_index) '
+            'LIMIT ?',
+            (match_expression, limit)
+        ).fetchall()
+
+def get_sync_checkpoint() -> Optional[str]:
+    """
+        Gets the GMail history id the local cache was last synced to.
+    """
+
+    with message_cache_lock:
+        row = get_message_cache().execute('SELECT value FROM sync_state WHERE key = ?', ('history_id',)).fetchone()
+
+    return row[0] if row else None
+
+def set_sync_checkpoint(history_id: str) -> None:
+    """
+        Saves the GMail history id the local cache is synced to.
+    """
+
+    with message_cache_lock:
+        connection = get_message_cache()
+        connection.execute('INSERT OR REPLACE INTO sync_state VALUES (?, ?)', ('history_id', str(history_id)))
+        connection.commit()
+
+def list_message_ids(client, query: str, label_ids: Optional[list] = None, include_spam_and_trash: bool = False, limit: Optional[int] = None) -> Iterable:
+    """
+        Lists the ids of messages matching a search one page at a time without downloading the messages themselves.
+    """
+
+    page_token = None
+    ids_listed = 0
+
+    while True:
+        list_kwargs = {
+            'userId': 'me',
+            'q': query,
+            'includeSpamTrash': include_spam_and_trash,
+            'pageToken': page_token,
+        }
+
+        if label_ids:
+            list_kwargs['labelIds'] = label_ids
+
+        list_kwargs['maxResults'] = min(limit - ids_listed, 500) if limit else 500
+
+        data = run_io(client.service.messages_service.list(**list_kwargs).execute)
+
+        page = [message['id'] for message in data.get('messages', [])]
+
+        if limit:
+            page = page[:limit - ids_listed]
+
+        ids_listed += len(page)
+
+        if page:
+            yield page
+
+        page_token = data.get('nextPageToken')
+
+        if not page_token or (limit and ids_listed >= limit):
+            return
+
+def execute_batch(client, batch) -> None:
+    """
+        Sends a batch request on the IO threads over a connection of its own, since batch requests cannot share the client's.
+    """
+
+    http = new_authorized_http(client)
+
+    try:
+        run_io(functools.partial(batch.execute, http=http))
+    finally:
+        http.close()
+
+def fetch_messages_data(client, gmail_ids: list, **get_kwargs) -> list:
+    """
+        Downloads messages from GMail using batch requests, in the format given by the keyword arguments for messages.get.
+        Messages that no longer exist are left out and removed from the local cache.
+    """
+
+    messages_data = []
+    deleted_gmail_ids = []
+
+    def collect_response(gmail_id, response, exception):
+        if exception:
+            # one message deleted since it was listed should not stop the others from being shown
+            if isinstance(exception, googleapiclient.errors.HttpError) and exception.resp.status == 404:
+                deleted_gmail_ids.append(gmail_id)
+                return
+
+            raise exception
+
+        messages_data.append(response)
+
+    for batch_start in range(0, len(gmail_ids), MESSAGE_BATCH_SIZE):
+        batch = client.service.new_batch_http_request(callback=collect_response)
+
+        for gmail_id in gmail_ids[batch_start: batch_start + MESSAGE_BATCH_SIZE]:
+            batch.add(client.service.messages_service.get(userId='me', id=gmail_id, **get_kwargs), request_id=gmail_id)
+
+        execute_batch(client, batch)
+
+    forget_cached_messages(deleted_gmail_ids)
+
+    return messages_data
+
+def fetch_messages_metadata(client, gmail_ids: list) -> list:
+    """
+        Downloads only the headers shown in the message list from GMail using batch requests in the "metadata" format.
+    """
+
+    return fetch_messages_data(client, gmail_ids, format='metadata', metadataHeaders=MESSAGE_LIST_HEADERS)
+
+def refresh_cached_label_ids(client, gmail_ids: list) -> None:
+    """
+        Brings the cached labels of messages up to date before they are shown, since they could have been changed from another device.
+        Applies the changes made since the last sync when there is a checkpoint, otherwise downloads only the labels of the messages in the "minimal" format.
+    """
+
+    checkpoint = get_sync_checkpoint()
+
+    if checkpoint:
+        try:
+            apply_history_since_checkpoint(client, checkpoint)
+            return
+        except googleapiclient.errors.HttpError as error:
+            if error.resp.status != 404:
+                raise
+
+    for message_data in fetch_messages_data(client, gmail_ids, format='minimal'):
+        update_cached_label_ids(message_data)
+
+# attachments left out of a cached message have their GMail attachment id in this header instead of a body
+GMAIL_ATTACHMENT_ID_HEADER = 'X-Gmail-Attachment-Id'
+
+def make_full_message(client, message_data: dict) -> google_workspace.gmail.message.Message:
+    """
+        Makes a message from its raw API data, and gives each attachment the key it is cached under in the attachment cache.
+    """
+
+    message = google_workspace.gmail.message.Message(client, message_data)
+
+    # the attachments of a message never change, so their position identifies them across reopens
+    for attachment_index, attachment in enumerate(message.attachments):
+        attachment.cache_key = (message.gmail_id, attachment_index)
+        attachment.gmail_client = client
+
+    return message
+
+def fetch_attachment_data(client, gmail_id: str, attachment_id: str) -> str:
+    """
+        Downloads the body of an attachment that was left out of a message in the "full" format, encoded in URL safe base64.
+    """
+
+    return client.service.attachments_service.get(userId='me', messageId=gmail_id, id=attachment_id).execute()['data']
+
+def make_mime_part(client, gmail_id: str, part_data: dict) -> email.message.Message:
+    """
+        Rebuilds a part of a message in the "full" format as a MIME part.
+        Attachments GMail left out are kept out, with only their attachment id in the GMAIL_ATTACHMENT_ID_HEADER header.
+    """
+
+    mime_part = email.message.Message()
+
+    for header in part_data.get('headers', []):
+        # bodies are encoded again below
+        if header['name'].lower() != 'content-transfer-encoding':
+            mime_part[header['name']] = header['value']
+
+    if 'Content-Type' not in mime_part:
+        mime_part['Content-Type'] = part_data.get('mimeType', 'text/plain')
+
+    if mime_part.get_content_maintype() == 'multipart':
+        mime_part.set_payload([make_mime_part(client, gmail_id, child_part_data) for child_part_data in part_data.get('parts', [])])
+        return mime_part
+
+    body = part_data.get('body', {})
+    attachment_id = body.get('attachmentId')
+    is_message_text = not mime_part.get('Content-Disposition') and mime_part.get_content_type() in ('text/plain', 'text/html')
+
+    if attachment_id and not is_message_text:
+        mime_part[GMAIL_ATTACHMENT_ID_HEADER] = attachment_id
+        mime_part.set_payload('')
+        return mime_part
+
+    # very long texts are left out like attachments, but they are shown as soon as the message is opened
+    encoded_body = fetch_attachment_data(client, gmail_id, attachment_id) if attachment_id else body.get('data', '')
+
+    mime_part['Content-Transfer-Encoding'] = 'base64'
+    mime_part.set_payload(base64.encodebytes(base64.urlsafe_b64decode(encoded_body + '=' * (-len(encoded_body) % 4))).decode('ascii'))
+
+    return mime_part
+
+def make_raw_message_data(client, message_data: dict) -> dict:
+    """
+        Turns a message downloaded in the "full" format, where GMail leaves out the bodies of attachments, into the "raw" format.
+        Only the headers and texts of the message are kept and cached, attachments are downloaded when they are opened or saved.
+    """
+
+    mime_message = make_mime_part(client, message_data['id'], message_data.pop('payload'))
+    message_data['raw'] = base64.urlsafe_b64encode(mime_message.as_bytes()).decode('ascii')
+
+    return message_data
+
+def download_full_message_data(client, gmail_id: str) -> dict:
+    """
+        Downloads a message in the "full" format and turns it into the "raw" format.
+    """
+
+    return make_raw_message_data(client, client.service.messages_service.get(userId='me', id=gmail_id, format='full').execute())
+
+def fetch_threads(client, thread_ids: list) -> dict:
+    """
+        Downloads every message of every thread, oldest first, using batch requests in the "full" format.
+        Returns the messages keyed by thread_id, and saves them with their current labels to the local cache.
+    """
+
+    threads_data = {}
+
+    def collect_response(request_id, response, exception):
+        if exception:
+            # threads deleted since they were listed are left out
+            if isinstance(exception, googleapiclient.errors.HttpError) and exception.resp.status == 404:
+                return
+
+            raise exception
+
+        # this runs on the IO threads, where very long texts left out of the response are downloaded
+        threads_data[response['id']] = [make_raw_message_data(client, message_data) for message_data in response.get('messages', [])]
+
+    for batch_start in range(0, len(thread_ids), MESSAGE_BATCH_SIZE):
+        batch = client.service.new_batch_http_request(callback=collect_response)
+
+        for thread_id in thread_ids[batch_start: batch_start + MESSAGE_BATCH_SIZE]:
+            batch.add(client.service.threads_service.get(userId='me', id=thread_id, format='full'))
+
+        execute_batch(client, batch)
+
+    cache_messages_data(itertools.chain.from_iterable(threads_data.values()))
+
+    threads = {
+        thread_id: [make_full_message(client, message_data) for message_data in thread_messages_data]
+        for thread_id, thread_messages_data in threads_data.items()
+    }
+
+    index_messages(itertools.chain.from_iterable(threads.values()))
+
+    return threads
+
+def get_full_message(client, gmail_id: str) -> google_workspace.gmail.message.Message:
+    """
+        Gets a message including its body and attachments from the local cache, downloading it if it is not cached yet.
+    """
+
+    messages_data = get_cached_messages_data([gmail_id])
+
+    if gmail_id in messages_data:
+        message_data = messages_data[gmail_id]
+    else:
+        message_data = download_full_message_data(client, gmail_id)
+        cache_messages_data([message_data])
+
+        message = make_full_message(client, message_data)
+        index_messages([message])
+
+        return message
+
+    return make_full_message(client, message_data)
+
+class LazyMessage:
+    """
+        A message that only has the headers printed in the message list.
+        The body and attachments are downloaded the first time anything else is accessed.
+    """
+
+    def __init__(self, client, message_metadata: dict):
+        self._full_message = None
+        self._full_message_future = None
+
+        # this does not subclass BaseMessage, so google_workspace does not have to be imported before the menu is shown
+        google_workspace.gmail.message.BaseMessage.__init__(self, client, message_metadata)
+
+        headers = {
+            header['name'].lower(): header['value']
+            for header in message_metadata.get('payload', {}).get('headers', [])
+        }
+
+        self.subject = google_workspace.gmail.utils.decode(headers.get('subject')) or ''
+        self.to = google_workspace.gmail.utils.get_email_addresses(headers.get('to')) or []
+        self.cc = google_workspace.gmail.utils.get_email_addresses(headers.get('cc')) or []
+        self.bcc = google_workspace.gmail.utils.get_email_addresses(headers.get('bcc')) or []
+        self.raw_from, self.raw_from_name, self.from_, self.from_name = google_workspace.gmail.utils.get_from_info(headers.get('from'))
+        self.date = google_workspace.gmail.utils.parse_date(headers.get('date'))
+
+    def __getattr__(self, name):
+        # only called for attributes that are not set from the headers
+        if name.startswith('__') or name.startswith('_full_message'):
+            raise AttributeError(name)
+
+        # changing labels only needs the id, so it does not download the full message
+        if name in ('add_labels', 'remove_labels', 'mark_read', 'mark_unread', 'delete', 'trash', 'untrash'):
+            return types.MethodType(getattr(google_workspace.gmail.message.BaseMessage, name), self)
+
+        return getattr(self.get_full_message(), name)
+
+    def prefetch(self) -> Optional[concurrent.futures.Future]:
+        """
+            Starts downloading the full message in the background and returns the future for it, if it was not started before.
+        """
+
+        if self._full_message is None and self._full_message_future is None:
+            self._full_message_future = submit_io(get_full_message, self.gmail_client, self.gmail_id)
+            return self._full_message_future
+
+    def get_full_message(self) -> google_workspace.gmail.message.Message:
+        if self._full_message is None and self._full_message_future is not None:
+            try:
+                self._full_message = self._full_message_future.result()
+            except (Exception, concurrent.futures.CancelledError):
+                # download it again below
+                pass
+
+        if self._full_message is None:
+            self._full_message = get_full_message(self.gmail_client, self.gmail_id)
+
+        return self._full_message
+
+def read_ahead(messages: Iterable, depth: int = READ_AHEAD_DEPTH, maximum_bytes: int = READ_AHEAD_MAXIMUM_BYTES) -> Iterable:
+    """
+        Yields messages while the current one and the next depth messages are downloaded in the background.
+        Stops downloading ahead once the estimated size of the messages waiting to be shown reaches maximum_bytes.
+        Downloads that have not started yet are cancelled when the caller stops iterating.
+    """
+
+    if not depth:
+        yield from messages
+        return
+
+    messages = iter(messages)
+    upcoming_messages = collections.deque()
+    prefetch_futures = []
+
+    try:
+        while True:
+            for message in messages:
+                upcoming_messages.append(message)
+
+                if len(upcoming_messages) > depth:
+                    break
+
+            if not upcoming_messages:
+                return
+
+            bytes_ahead = 0
+
+            for message in upcoming_messages:
+                bytes_ahead += int(message.message_data.get('sizeEstimate', 0))
+
+                if bytes_ahead > maximum_bytes:
+                    break
+
+                if isinstance(message, LazyMessage):
+                    prefetch_future = message.prefetch()
+
+                    if prefetch_future:
+                        prefetch_futures.append(prefetch_future)
+
+            yield upcoming_messages.popleft()
+    finally:
+        cancel_io(prefetch_futures)
+
+def get_messages_by_id(client, gmail_ids: list, are_labels_current: bool = False) -> list:
+    """
+        Gets the messages for a page of the message list, preferring complete messages from the local cache.
+        Messages that are not cached only have their headers downloaded, all of them in one batch request.
+        The labels of cached messages are refreshed first, unless are_labels_current says the cache was just synced.
+    """
+
+    messages_data = get_cached_messages_data(gmail_ids, allow_metadata=True)
+
+    if messages_data and not are_labels_current:
+        refresh_cached_label_ids(client, list(messages_data))
+
+        label_ids_cached = get_cached_label_ids(list(messages_data))
+
+        for gmail_id, message_data in list(messages_data.items()):
+            # messages deleted from another device are forgotten by the refresh
+            if gmail_id in label_ids_cached:
+                message_data['labelIds'] = label_ids_cached[gmail_id]
+            else:
+                del messages_data[gmail_id]
+
+    missing_gmail_ids = [gmail_id for gmail_id in gmail_ids if gmail_id not in messages_data]
+
+    if missing_gmail_ids:
+        fetched_messages_metadata = fetch_messages_metadata(client, missing_gmail_ids)
+        cache_messages_data(fetched_messages_metadata, 'metadata')
+        index_messages(LazyMessage(client, message_metadata) for message_metadata in fetched_messages_metadata)
+
+        for message_metadata in fetched_messages_metadata:
+            messages_data[message_metadata['id']] = message_metadata
+
+    messages = []
+
+    for gmail_id in gmail_ids:
+        if gmail_id not in messages_data:
+            continue
+
+        message_data = messages_data[gmail_id]
+
+        if 'raw' in message_data:
+            messages.append(make_full_message(client, message_data))
+        else:
+            messages.append(LazyMessage(client, message_data))
+
+    return messages
+
+def get_cached_messages(client, seen: Optional[bool] = None, from_: Optional[str] = None, to: Optional[list] = None, subject: Optional[str] = None, after: Optional[datetime.date] = None, before: Optional[datetime.date] = None, label_name: Optional[str] = None, label_ids: Optional[list] = None, include_spam_and_trash: bool = False, limit: Optional[int] = None) -> Iterable:
+    """
+        Drop-in replacement for client.get_messages that only downloads messages which are not in the local cache yet.
+        Only the message ids are listed from GMail, everything else comes from the cache when possible.
+        Bodies and attachments of messages that are not cached are only downloaded when they are accessed.
+    """
+
+    query = google_workspace.gmail.utils.gmail_query_maker(seen, from_, to, subject, after, before, label_name)
+    label_ids = google_workspace.gmail.utils.get_proper_label_ids(label_ids)
+
+    for page in list_message_ids(client, query, label_ids, include_spam_and_trash, limit):
+        for batch_start in range(0, len(page), MESSAGE_BATCH_SIZE):
+            yield from get_messages_by_id(client, page[batch_start: batch_start + MESSAGE_BATCH_SIZE])
+
+def download_history_changes(client, checkpoint: str) -> tuple:
+    """
+        Downloads every change made to the mailbox since the checkpoint, and the history id to use as the next checkpoint.
+    """
+
+    history = client.get_history(checkpoint)
+
+    # the history downloads its next pages while it is iterated, so all of them are downloaded here
+    return list(history), history.history_id
+
+def apply_history_since_checkpoint(client, checkpoint: str) -> None:
+    """
+        Applies every change made to the mailbox since the checkpoint to the local cache.
+        Only the ids and labels of changed messages are downloaded here, not the messages themselves.
+        Raises googleapiclient.errors.HttpError with status 404 if the checkpoint has expired.
+    """
+
+    changes, history_id = run_io(download_history_changes, client, checkpoint)
+    deleted_gmail_ids = []
+
+    with message_cache_lock:
+        connection = get_message_cache()
+
+        for change in changes:
+            if change.message_deleted:
+                deleted_gmail_ids.append(change.gmail_id)
+            else:
+                # remember new messages without downloading them, they are downloaded when they are read
+                connection.execute(
+                    'INSERT INTO messages (gmail_id, thread_id, label_ids) VALUES (?, ?, ?) '
+                    'ON CONFLICT(gmail_id) DO UPDATE SET label_ids = excluded.label_ids',
+                    (change.gmail_id, change.thread_id, json.dumps(change.label_ids))
+                )
+
+        connection.commit()
+
+    forget_cached_messages(deleted_gmail_ids)
+
+    set_sync_checkpoint(history_id)
+
+def resync_unread_messages(client) -> None:
+    """
+        Rebuilds the unread state of the local cache from a full listing of the unread message ids.
+    """
+
+    # take the checkpoint before listing so nothing that changes during the listing is missed next time
+    history_id = run_io(client.service.users_service.getProfile(userId='me').execute)['historyId']
+
+    # a dict keeps the newest first order of the listing
+    unread_gmail_ids = {}
+
+    for page in list_message_ids(client, google_workspace.gmail.utils.gmail_query_maker(seen=False)):
+        unread_gmail_ids.update(dict.fromkeys(page))
+
+    with message_cache_lock:
+        connection = get_message_cache()
+
+        rows = connection.execute('SELECT gmail_id, label_ids FROM messages WHERE label_ids IS NOT NULL').fetchall()
+        gmail_ids_cached = set()
+
+        for gmail_id, label_ids in rows:
+            gmail_ids_cached.add(gmail_id)
+            label_ids = json.loads(label_ids)
+
+            if gmail_id in unread_gmail_ids and 'UNREAD' not in label_ids:
+                label_ids.append('UNREAD')
+            elif gmail_id not in unread_gmail_ids and 'UNREAD' in label_ids:
+                label_ids.remove('UNREAD')
+            else:
+                continue
+
+            connection.execute('UPDATE messages SET label_ids = ? WHERE gmail_id = ?', (json.dumps(label_ids), gmail_id))
+
+        connection.executemany(
+            'INSERT INTO messages (gmail_id, label_ids) VALUES (?, ?)',
+            [(gmail_id, json.dumps(['UNREAD'])) for gmail_id in unread_gmail_ids if gmail_id not in gmail_ids_cached]
+        )
+
+        connection.commit()
+
+    set_sync_checkpoint(history_id)
+
+def sync_unread_messages(client) -> None:
+    """
+        Brings the local cache up to date with GMail by asking only for changes since the last sync.
+        Falls back to a full resync when there is no checkpoint yet or GMail has expired it.
+    """
+
+    checkpoint = get_sync_checkpoint()
+
+    if checkpoint:
+        try:
+            apply_history_since_checkpoint(client, checkpoint)
+            return
+        except googleapiclient.errors.HttpError as error:
+            if error.resp.status != 404:
+                raise
+
+    resync_unread_messages(client)
+
+def get_unread_messages_from_cache(client, message_ids_to_skip: Iterable = tuple(), limit: Optional[int] = None) -> list:
+    """
+        Gets unread messages from the local cache after a sync, downloading the headers of the ones that are not cached yet.
+        Messages that were discovered but not downloaded yet are considered the newest.
+    """
+
+    with message_cache_lock:
+        rows = get_message_cache().execute(
+            'SELECT gmail_id, label_ids FROM messages WHERE label_ids LIKE ? '
+            'ORDER BY internal_date IS NOT NULL, internal_date DESC, rowid',
+            ('%"UNREAD"%',)
+        ).fetchall()
+
+    gmail_ids = []
+
+    for gmail_id, label_ids in rows:
+        if limit and len(gmail_ids) >= limit:
+            break
+
+        if gmail_id in message_ids_to_skip:
+            continue
+
+        label_ids = json.loads(label_ids)
+
+        # same as searching with include_spam_and_trash=False
+        if 'SPAM' in label_ids or 'TRASH' in label_ids:
+            continue
+
+        gmail_ids.append(gmail_id)
+
+    # the labels were brought up to date by the sync this follows
+    messages = get_messages_by_id(client, gmail_ids, are_labels_current=True)
+
+    return sorted(messages, key=lambda message: int(message.message_data.get('internalDate', 0)), reverse=True)
+
+##############################################################################################################################################
+
+# BULK OPERATION FUNCTIONS
+
+def run_bulk_operation(gmail_ids: Iterable, operation: Callable[[list], int], past_tense: str) -> int:
+    """
+        Applies an operation to batches of up to BULK_OPERATION_BATCH_SIZE message ids in the background, several batches at a time.
+        Prints the number of messages processed so far and the throughput after every batch.
+    """
+
+    gmail_ids = list(gmail_ids)
+    messages_processed = 0
+    started_at = time.monotonic()
+
+    futures = [
+        submit_io(operation, gmail_ids[batch_start: batch_start + BULK_OPERATION_BATCH_SIZE])
+        for batch_start in range(0, len(gmail_ids), BULK_OPERATION_BATCH_SIZE)
+    ]
+
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            messages_processed += future.result()
+            messages_per_second = messages_processed / max(time.monotonic() - started_at, 0.001)
+
+            print(f'{messages_processed} of {len(gmail_ids)} messages {past_tense} ({messages_per_second:.0f} msgs/sec)')
+    except BaseException:
+        cancel_io(futures)
+        raise
+
+    return messages_processed
+
+def delete_messages(client, gmail_ids: list) -> int:
+    """
+        Permanently deletes up to BULK_OPERATION_BATCH_SIZE messages in one request.
+        Rate limits and server errors are retried with exponential backoff.
+    """
+
+    client.service.messages_service.batchDelete(
+        userId='me',
+        body={'ids': gmail_ids}
+    ).execute(num_retries=BULK_OPERATION_MAXIMUM_RETRIES)
+
+    forget_cached_messages(gmail_ids)
+
+    return len(gmail_ids)
+
+def modify_messages(client, add_label_ids: list, remove_label_ids: list, gmail_ids: list) -> int:
+    """
+        Adds and removes labels on up to BULK_OPERATION_BATCH_SIZE messages in one request.
+        Rate limits and server errors are retried with exponential backoff.
+    """
+
+    client.service.messages_service.batchModify(
+        userId='me',
+        body={
+            'ids': gmail_ids,
+            'addLabelIds': add_label_ids,
+            'removeLabelIds': remove_label_ids,
+        }
+    ).execute(num_retries=BULK_OPERATION_MAXIMUM_RETRIES)
+
+    update_cached_label_ids_in_bulk(gmail_ids, add_label_ids, remove_label_ids)
+
+    return len(gmail_ids)
+
+##############################################################################################################################################
+
+# OUTBOX FUNCTIONS
+
+# attachments are base64 encoded into the outbox this many bytes at a time, a whole number of 57 byte lines
+OUTBOX_ATTACHMENT_READ_BYTES = 57 * 16 * 1024
+
+# ids of the outbox emails that are being sent right now
+outbox_ids_sending = set()
+outbox_lock = threading.Lock()
+
+def get_outbox_directory() -> str:
+    """
+        Gets the directory emails waiting to be sent are saved in, creating it if it does not exist yet.
+    """
+
+    outbox_directory = os.path.join(CACHE_DIRECTORY, 'outbox')
+    os.makedirs(outbox_directory, exist_ok=True)
+
+    return outbox_directory
+
+def compose_email(to: list, cc: list, bcc: list, subject: str, text: str, in_reply_to: Optional[str] = None) -> email.message.EmailMessage:
+    """
+        Builds an RFC 822 email without attachments, they are added when it is written to the outbox.
+    """
+
+    message = email.message.EmailMessage()
+
+    for header, email_addresses in (('To', to), ('Cc', cc), ('Bcc', bcc)):
+        if email_addresses:
+            message[header] = ', '.join(email_addresses)
+
+    message['Subject'] = subject
+    message['Date'] = email.utils.formatdate(localtime=True)
+    message['Message-ID'] = email.utils.make_msgid()
+
+    if in_reply_to:
+        message['In-Reply-To'] = in_reply_to
+        message['References'] = in_reply_to
+
+    message.set_content(text)
+
+    return message
+
+def write_email_file(f, message: email.message.EmailMessage, attachments: Iterable) -> None:
+    """
+        Writes an email with the attachments at the given filepaths to a file.
+        The attachments are read and encoded a chunk at a time, so they never have to be in memory as a whole.
+    """
+
+    attachments = list(attachments)
+
+    if not attachments:
+        email.generator.BytesGenerator(f, policy=email.policy.SMTP).flatten(message)
+        return
+
+    boundary = f'==============={secrets.token_hex(16)}=='
+
+    # the headers of the email, with the text moved into the first part
+    container = email.message.EmailMessage()
+    text_part = email.message.EmailMessage()
+
+    for header, value in message.items():
+        if not header.lower().startswith('content-') and header.lower() != 'mime-version':
+            container[header] = value
+
+    container['MIME-Version'] = '1.0'
+    container['Content-Type'] = f'multipart/mixed; boundary="{boundary}"'
+    text_part.set_content(message.get_content())
+    del text_part['MIME-Version']
+
+    # the body of the container is written below, part by part
+    f.write(b''.join(email.policy.SMTP.fold_binary(header, value) for header, value in container.items()) + b'\r\n')
+    f.write(f'--{boundary}\r\n'.encode('ascii'))
+    f.write(text_part.as_bytes(policy=email.policy.SMTP))
+
+    for filepath in attachments:
+        content_type, _ = mimetypes.guess_type(filepath)
+
+        attachment_part = email.message.EmailMessage()
+        attachment_part['Content-Type'] = content_type or 'application/octet-stream'
+        attachment_part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(filepath))
+        attachment_part['Content-Transfer-Encoding'] = 'base64'
+
+        f.write(f'\r\n--{boundary}\r\n'.encode('ascii'))
+        f.write(attachment_part.as_bytes(policy=email.policy.SMTP))
+
+        with open(filepath, 'rb') as attachment_file:
+            while chunk := attachment_file.read(OUTBOX_ATTACHMENT_READ_BYTES):
+                f.write(base64.encodebytes(chunk).replace(b'\n', b'\r\n'))
+
+    f.write(f'\r\n--{boundary}--\r\n'.encode('ascii'))
+
+def queue_email(message: email.message.EmailMessage, attachments: Iterable = tuple(), thread_id: Optional[str] = None) -> int:
+    """
+        Saves an email with the attachments at the given filepaths to the outbox and starts sending it in the background.
+        The email is written to disk before this returns, so it is sent the next time the program runs if it is closed first.
+    """
+
+    filepath = os.path.join(get_outbox_directory(), f'{secrets.token_hex(16)}.eml')
+
+    # the row is added before the file, so every file in the outbox belongs to a row even if the program stops while writing it
+    with message_cache_lock:
+        connection = get_message_cache()
+
+        outbox_id = connection.execute(
+            'INSERT INTO outbox (filepath, thread_id, recipients, subject, status, attempts, next_attempt_at, uploaded_bytes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (filepath, thread_id, message.get('To') or message.get('Cc') or message.get('Bcc'), message['Subject'], 'writing', 0, 0, 0)
+        ).lastrowid
+
+        connection.commit()
+
+    file_descriptor, temporary_filepath = tempfile.mkstemp(dir=get_outbox_directory(), suffix='.partial')
+
+    try:
+        with os.fdopen(file_descriptor, 'wb') as f:
+            write_email_file(f, message, attachments)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temporary_filepath, filepath)
+    except BaseException:
+        try:
+            os.remove(temporary_filepath)
+        except FileNotFoundError:
+            pass
+
+        with message_cache_lock:
+            connection = get_message_cache()
+            connection.execute('DELETE FROM outbox WHERE outbox_id = ?', (outbox_id,))
+            connection.commit()
+
+        raise
+
+    with message_cache_lock:
+        connection = get_message_cache()
+        connection.execute('UPDATE outbox SET status = ? WHERE outbox_id = ?', ('queued', outbox_id))
+        connection.commit()
+
+    print(f'Email "{message["Subject"]}" added to the outbox')
+
+    drain_outbox()
+
+    return outbox_id
+
+def get_upload_progress(http, upload_uri: str, size: int) -> tuple:
+    """
+        Asks GMail how much of a resumable upload it has received, with an empty request for the range "bytes */size".
+        Returns the number of bytes received, and the response of the upload if it already finished.
+    """
+
+    response, content = http.request(upload_uri, 'PUT', headers={'Content-Length': '0', 'Content-Range': f'bytes */{size}'})
+
+    if response.status in (200, 201):
+        return size, json.loads(content)
+
+    if response.status == 308:
+        # the range is missing when nothing was received yet
+        received_range = response.get('range')
+        return (int(received_range.rsplit('-', 1)[1]) + 1 if received_range else 0), None
+
+    raise googleapiclient.errors.HttpError(response, content, uri=upload_uri)
+
+def upload_outbox_email(client, outbox_id: int, filepath: str, thread_id: Optional[str], upload_uri: Optional[str]) -> dict:
+    """
+        Sends a big email saved in the outbox with a resumable upload, OUTBOX_UPLOAD_CHUNK_BYTES at a time straight from the file.
+        The upload session is saved after every chunk, so an upload that was interrupted continues from the last chunk GMail received.
+    """
+
+    http = new_authorized_http(client)
+
+    try:
+        request = client.service.messages_service.send(
+            userId='me',
+            body={'threadId': thread_id} if thread_id else {},
+            media_body=googleapiclient.http.MediaFileUpload(filepath, mimetype='message/rfc822', chunksize=OUTBOX_UPLOAD_CHUNK_BYTES, resumable=True)
+        )
+
+        if upload_uri:
+            try:
+                uploaded_bytes, response = get_upload_progress(http, upload_uri, os.path.getsize(filepath))
+            except googleapiclient.errors.HttpError as error:
+                # upload sessions expire after a week, the upload starts over
+                if error.resp.status not in (404, 410):
+                    raise
+
+                save_outbox_upload_progress(outbox_id, None, 0)
+            else:
+                if response is not None:
+                    return response
+
+                # the next chunk starts where GMail stopped receiving
+                request.resumable_uri = upload_uri
+                request.resumable_progress = uploaded_bytes
+
+        response = None
+
+        while response is None:
+            upload_status, response = request.next_chunk(http=http, num_retries=BULK_OPERATION_MAXIMUM_RETRIES)
+
+            if upload_status:
+                save_outbox_upload_progress(outbox_id, request.resumable_uri, upload_status.resumable_progress)
+
+        return response
+    finally:
+        http.close()
+
+def save_outbox_upload_progress(outbox_id: int, upload_uri: Optional[str], uploaded_bytes: int) -> None:
+    """
+        Remembers how far the upload of an email in the outbox got.
+    """
+
+    with message_cache_lock:
+        connection = get_message_cache()
+        connection.execute('UPDATE outbox SET upload_uri = ?, uploaded_bytes = ? WHERE outbox_id = ?', (upload_uri, uploaded_bytes, outbox_id))
+        connection.commit()
+
+def send_outbox_email(client, outbox_id: int, filepath: str, thread_id: Optional[str], upload_uri: Optional[str]) -> dict:
+    """
+        Sends an email saved in the outbox, with a resumable upload if it is at least OUTBOX_RESUMABLE_UPLOAD_MINIMUM_BYTES.
+        Rate limits and server errors are retried with exponential backoff.
+    """
+
+    if os.path.getsize(filepath) >= OUTBOX_RESUMABLE_UPLOAD_MINIMUM_BYTES:
+        return upload_outbox_email(client, outbox_id, filepath, thread_id, upload_uri)
+
+    with open(filepath, 'rb') as f:
+        body = {'raw': base64.urlsafe_b64encode(f.read()).decode('ascii')}
+
+    if thread_id:
+        body['threadId'] = thread_id
+
+    return client.service.messages_service.send(
+        userId='me',
+        body=body
+    ).execute(num_retries=BULK_OPERATION_MAXIMUM_RETRIES)
+
+def clean_outbox() -> None:
+    """
+        Removes what the program left behind if it stopped while adding an email to the outbox or after sending one:
+        rows of emails that were not completely written, and files that do not belong to a row.
+    """
+
+    outbox_directory = get_outbox_directory()
+
+    with message_cache_lock:
+        connection = get_message_cache()
+        connection.execute('DELETE FROM outbox WHERE status = ?', ('writing',))
+        connection.commit()
+
+        outbox_filepaths = {filepath for filepath, in connection.execute('SELECT filepath FROM outbox')}
+
+    for filename in os.listdir(outbox_directory):
+        filepath = os.path.join(outbox_directory, filename)
+
+        if filepath not in outbox_filepaths:
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                pass
+
+def drain_outbox() -> None:
+    """
+        Starts sending the emails in the outbox that are due, at most OUTBOX_MAXIMUM_CONCURRENT_SENDS at a time.
+        Runs again every time one of them is sent or fails.
+    """
+
+    client_future = start_connecting()
+
+    if not client_future.done():
+        client_future.add_done_callback(lambda _: drain_outbox())
+        return
+
+    # the error is shown when the connection is used from the menu
+    if client_future.cancelled() or client_future.exception():
+        return
+
+    with outbox_lock, message_cache_lock:
+        rows = get_message_cache().execute(
+            'SELECT outbox_id, filepath, thread_id, upload_uri, subject FROM outbox WHERE status = ? AND next_attempt_at <= ? ORDER BY outbox_id',
+            ('queued', time.time())
+        ).fetchall()
+
+        for outbox_id, filepath, thread_id, upload_uri, subject in rows:
+            if len(outbox_ids_sending) >= OUTBOX_MAXIMUM_CONCURRENT_SENDS:
+                break
+
+            if outbox_id in outbox_ids_sending:
+                continue
+
+            outbox_ids_sending.add(outbox_id)
+
+            submit_io(send_outbox_email, client_future.result(), outbox_id, filepath, thread_id, upload_uri).add_done_callback(
+                functools.partial(finish_outbox_send, outbox_id, filepath, subject)
+            )
+
+def finish_outbox_send(outbox_id: int, filepath: str, subject: str, future: concurrent.futures.Future) -> None:
+    """
+        Removes a sent email from the outbox, or schedules it to be sent again if sending failed.
+        Emails that fail OUTBOX_MAXIMUM_ATTEMPTS times stay in the outbox until the user retries them.
+    """
+
+    with outbox_lock:
+        outbox_ids_sending.discard(outbox_id)
+
+    # the program is closing, the email stays queued for the next time
+    if future.cancelled():
+        return
+
+    try:
+        future.result()
+    except Exception as e:
+        with message_cache_lock:
+            connection = get_message_cache()
+
+            attempts = connection.execute('SELECT attempts FROM outbox WHERE outbox_id = ?', (outbox_id,)).fetchone()[0] + 1
+            retry_delay = OUTBOX_RETRY_DELAY_SECONDS * 2 ** (attempts - 1)
+            status = 'queued' if attempts < OUTBOX_MAXIMUM_ATTEMPTS else 'failed'
+
+            connection.execute(
+                'UPDATE outbox SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ? WHERE outbox_id = ?',
+                (status, attempts, str(e), time.time() + retry_delay, outbox_id)
+            )
+
+            connection.commit()
+
+        if status == 'failed':
+            print(f'Could not send email "{subject}": {e}\nIt was kept in the outbox, open the outbox to try again.')
+        else:
+            print(f'Could not send email "{subject}", trying again in {retry_delay} seconds: {e}')
+
+            retry_timer = threading.Timer(retry_delay, drain_outbox)
+            retry_timer.daemon = True
+            retry_timer.start()
+    else:
+        with message_cache_lock:
+            connection = get_message_cache()
+            connection.execute('DELETE FROM outbox WHERE outbox_id = ?', (outbox_id,))
+            connection.commit()
+
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+
+        print(f'Email "{subject}" sent')
+
+    drain_outbox()
+
+def get_outbox_emails() -> list:
+    """
+        Gets the id, filepath, recipients, subject, status, number of attempts, last error and bytes uploaded of every email in the outbox.
+    """
+
+    with message_cache_lock:
+        return get_message_cache().execute(
+            'SELECT outbox_id, filepath, recipients, subject, status, attempts, last_error, uploaded_bytes FROM outbox WHERE status != ? ORDER BY outbox_id',
+            ('writing',)
+        ).fetchall()
+
+def show_outbox() -> None:
+    """
+        Shows the emails waiting to be sent and lets the user try sending the ones that failed again.
+    """
+
+    outbox_emails = get_outbox_emails()
+
+    if not outbox_emails:
+        print('The outbox is empty')
+        return
+
+    for outbox_id, filepath, recipients, subject, status, attempts, last_error, uploaded_bytes in outbox_emails:
+        if outbox_id in outbox_ids_sending:
+            status = 'sending'
+
+        print(f'\nTo: {recipients}\nSubject: {subject}\nStatus: {status} ({attempts} failed attempts)')
+
+        if uploaded_bytes:
+            print(f'Uploaded: {uploaded_bytes // (1024 * 1024)} of {os.path.getsize(filepath) // (1024 * 1024)} MB')
+
+        if last_error:
+            print(f'Last error: {last_error}')
+
+    if not any(outbox_email[4] == 'failed' for outbox_email in outbox_emails):
+        return
+
+    if ask_for_user_input('\nDo you want to try sending the failed emails again? (Y or N)', ('Y', 'N')) == 'Y':
+        with message_cache_lock:
+            connection = get_message_cache()
+            connection.execute('UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = 0 WHERE status = ?', ('queued', 'failed'))
+            connection.commit()
+
+        drain_outbox()
+
+def print_outbox_summary() -> None:
+    """
+        Tells the user about emails that are still in the outbox when the program exits.
+    """
+
+    if not os.path.isdir(os.path.join(CACHE_DIRECTORY, 'outbox')):
+        return
+
+    statuses = collections.Counter(outbox_email[4] for outbox_email in get_outbox_emails())
+
+    if statuses['queued']:
+        print(f'{statuses["queued"]} emails are still in the outbox, they will be sent the next time you run the program')
+
+    if statuses['failed']:
+        print(f'{statuses["failed"]} emails could not be sent, open the outbox to try again')
+
+##############################################################################################################################################
+
+# ATTACHMENT CACHE FUNCTIONS
+
+# attachments are decoded this many characters at a time when they are saved
+ATTACHMENT_CHUNK_SIZE = 1024 * 1024
+
+# once the cache grows past ATTACHMENT_CACHE_MAXIMUM_BYTES it is shrunk to this fraction of it, so it is not shrunk again on the next write
+ATTACHMENT_CACHE_EVICTION_TARGET_RATIO = 0.9
+
+base64_ignored_characters_regex = re.compile(r'[^A-Za-z0-9+/]')
+
+# running total of the bytes in the attachment cache, None until the directory is first measured
+attachment_cache_bytes = None
+attachment_cache_lock = threading.Lock()
+
+def get_attachment_cache_directory() -> str:
+    """
+        Gets the directory attachments and images are cached in, creating it if it does not exist yet.
+    """
+
+    attachment_cache_directory = os.path.join(CACHE_DIRECTORY, 'attachments')
+    os.makedirs(attachment_cache_directory, exist_ok=True)
+
+    return attachment_cache_directory
+
+def evict_from_attachment_cache(maximum_bytes: int = ATTACHMENT_CACHE_MAXIMUM_BYTES) -> int:
+    """
+        Removes the least recently used files from the attachment cache until it fits in maximum_bytes.
+        Returns the number of bytes left in the cache.
+    """
+
+    attachment_cache_directory = get_attachment_cache_directory()
+    cached_files = []
+
+    for entry in os.scandir(attachment_cache_directory):
+        if entry.is_file():
+            file_stat = entry.stat()
+            cached_files.append((file_stat.st_mtime, file_stat.st_size, entry.path))
+
+    total_bytes = sum(file_size for _, file_size, _ in cached_files)
+
+    for _, file_size, filepath in sorted(cached_files):
+        if total_bytes <= maximum_bytes:
+            break
+
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+
+        total_bytes -= file_size
+
+    return total_bytes
+
+def record_attachment_cache_write(bytes_written: int) -> None:
+    """
+        Adds a new file to the running total of the attachment cache size.
+        The directory is only measured the first time, and when the total crosses ATTACHMENT_CACHE_MAXIMUM_BYTES.
+    """
+
+    global attachment_cache_bytes
+
+    with attachment_cache_lock:
+        if attachment_cache_bytes is None:
+            attachment_cache_bytes = evict_from_attachment_cache()
+            return
+
+        attachment_cache_bytes += bytes_written
+
+        if attachment_cache_bytes > ATTACHMENT_CACHE_MAXIMUM_BYTES:
+            attachment_cache_bytes = evict_from_attachment_cache(int(ATTACHMENT_CACHE_MAXIMUM_BYTES * ATTACHMENT_CACHE_EVICTION_TARGET_RATIO))
+
+def write_file_atomically(filepath: str, payload: bytes) -> None:
+    """
+        Writes a file in the attachment cache through a temporary file, so a half written file is never used.
+    """
+
+    file_descriptor, temporary_filepath = tempfile.mkstemp(dir=get_attachment_cache_directory(), suffix='.partial')
+
+    with os.fdopen(file_descriptor, 'wb') as f:
+        f.write(payload)
+
+    os.replace(temporary_filepath, filepath)
+
+def cache_payload(payload: bytes) -> str:
+    """
+        Stores a payload in the attachment cache under the hash of its content and returns the filepath.
+        Identical payloads, like the same logo in many newsletters, are only stored once.
+    """
+
+    filepath = os.path.join(get_attachment_cache_directory(), hashlib.sha256(payload).hexdigest())
+
+    if os.path.exists(filepath):
+        # the modification time is used to find the least recently used files
+        os.utime(filepath)
+        return filepath
+
+    write_file_atomically(filepath, payload)
+
+    record_attachment_cache_write(len(payload))
+
+    return filepath
+
+def is_gmail_attachment(attachment) -> bool:
+    """
+        Checks if an attachment was left out of its message and has to be downloaded from GMail on its own.
+    """
+
+    return GMAIL_ATTACHMENT_ID_HEADER in attachment._part
+
+def iter_json_string_field(chunks: Iterable[bytes], field: str) -> Iterable[bytes]:
+    """
+        Finds a string field of a JSON object that arrives a chunk at a time, and yields its value a chunk at a time as it arrives.
+        Only works for fields whose values can not have quotes or escapes in them, like base64.
+    """
+
+    key = f'"{field}"'.encode()
+    chunks = iter(chunks)
+    buffer = b''
+
+    for chunk in chunks:
+        buffer += chunk
+        key_index = buffer.find(key)
+
+        if key_index == -1:
+            # the key could be split between this chunk and the next one
+            buffer = buffer[-len(key):]
+            continue
+
+        value_start = buffer.find(b'"', key_index + len(key))
+
+        if value_start != -1:
+            break
+    else:
+        raise ValueError(f'The response has no "{field}" field')
+
+    for chunk in itertools.chain([buffer[value_start + 1:]], chunks):
+        value_end = chunk.find(b'"')
+
+        if value_end != -1:
+            yield chunk[:value_end]
+            return
+
+        yield chunk
+
+    raise ValueError(f'The "{field}" field of the response was cut off')
+
+def decode_base64_chunks(encoded_chunks: Iterable[bytes]) -> Iterable[bytes]:
+    """
+        Decodes URL safe base64 that arrives a chunk at a time, a chunk at a time.
+    """
+
+    remainder = b''
+
+    for encoded_chunk in encoded_chunks:
+        encoded_chunk = remainder + encoded_chunk
+
+        # base64 is decoded in groups of 4 characters
+        decodable_length = len(encoded_chunk) // 4 * 4
+        remainder = encoded_chunk[decodable_length:]
+
+        if decodable_length:
+            yield base64.urlsafe_b64decode(encoded_chunk[:decodable_length])
+
+    if remainder:
+        yield base64.urlsafe_b64decode(remainder + b'=' * (-len(remainder) % 4))
+
+def iter_gmail_attachment_chunks(attachment, attachment_id: str, chunk_size: int) -> Iterable[bytes]:
+    """
+        Downloads an attachment that was left out of its message, decoding it a chunk at a time as it arrives.
+        The JSON response is read as a stream instead of being parsed as a whole, so neither the response nor the attachment is ever in memory.
+    """
+
+    client = attachment.gmail_client
+    request = client.service.attachments_service.get(userId='me', messageId=attachment.cache_key[0], id=attachment_id)
+
+    # every download has its own session, like every upload has its own Http
+    session = google_auth_requests.AuthorizedSession(client.service.credentials)
+
+    try:
+        with session.get(
+            request.uri,
+            stream=True,
+            timeout=(ATTACHMENT_DOWNLOAD_CONNECT_TIMEOUT_SECONDS, ATTACHMENT_DOWNLOAD_READ_TIMEOUT_SECONDS)
+        ) as response:
+            response.raise_for_status()
+
+            yield from decode_base64_chunks(iter_json_string_field(response.iter_content(chunk_size), 'data'))
+    finally:
+        session.close()
+
+def iter_attachment_chunks(attachment, chunk_size: int = ATTACHMENT_CHUNK_SIZE) -> Iterable[bytes]:
+    """
+        Decodes an attachment a chunk at a time, so its whole decoded payload never has to be in memory.
+    """
+
+    part = attachment._part
+
+    # get_payload() copies the whole payload to check it for undecodable bytes, so the payload is read directly
+    encoded_payload = part._payload
+
+    attachment_id = part.get(GMAIL_ATTACHMENT_ID_HEADER)
+
+    if attachment_id:
+        yield from iter_gmail_attachment_chunks(attachment, attachment_id, chunk_size)
+        return
+
+    # attached emails and other multipart attachments can only be decoded as a whole
+    if not isinstance(encoded_payload, str):
+        yield attachment.payload or b''
+        return
+
+    content_transfer_encoding = str(part.get('Content-Transfer-Encoding', '')).strip().lower()
+    leftover = ''
+
+    for start in range(0, len(encoded_payload), chunk_size):
+        encoded_chunk = encoded_payload[start: start + chunk_size]
+        is_last_chunk = start + chunk_size >= len(encoded_payload)
+
+        if content_transfer_encoding == 'base64':
+            # base64 is decoded in groups of 4 characters, the rest is kept for the next chunk
+            encoded_chunk = leftover + base64_ignored_characters_regex.sub('', encoded_chunk)
+            usable_length = len(encoded_chunk) // 4 * 4
+            leftover = encoded_chunk[usable_length:]
+
+            yield binascii.a2b_base64(encoded_chunk[:usable_length])
+
+            # a single character left over does not hold a whole byte
+            if is_last_chunk and len(leftover) > 1:
+                yield binascii.a2b_base64(leftover + '=' * (-len(leftover) % 4))
+        elif content_transfer_encoding == 'quoted-printable':
+            # escapes and soft line breaks can be split between chunks, so only whole lines are decoded
+            encoded_chunk = leftover + encoded_chunk
+            usable_length = len(encoded_chunk) if is_last_chunk else encoded_chunk.rfind('\n') + 1
+            leftover = encoded_chunk[usable_length:]
+
+            yield binascii.a2b_qp(encoded_chunk[:usable_length].encode('ascii', 'replace'))
+        else:
+            yield encoded_chunk.encode('utf8', 'surrogateescape')
+
+def write_attachment_to_file(attachment, filepath: str) -> None:
+    """
+        Writes an attachment to a file a chunk at a time.
+    """
+
+    try:
+        with open(filepath, 'wb') as f:
+            for chunk in iter_attachment_chunks(attachment):
+                f.write(chunk)
+    except BaseException:
+        # an attachment cut off part way through, because its download failed, is not left behind
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+
+        raise
+
+def get_cached_attachment_filepath(cache_key: tuple) -> Optional[str]:
+    """
+        Looks up where an attachment was cached by the gmail_id of its message and its position in it.
+        Returns None if it was never cached or has been evicted since.
+    """
+
+    with message_cache_lock:
+        row = get_message_cache().execute(
+            'SELECT content_hash FROM attachments WHERE gmail_id = ? AND attachment_index = ?',
+            cache_key
+        ).fetchone()
+
+    if not row:
+        return None
+
+    filepath = os.path.join(get_attachment_cache_directory(), row[0])
+
+    try:
+        # the modification time is used to find the least recently used files
+        os.utime(filepath)
+    except FileNotFoundError:
+        return None
+
+    return filepath
+
+def cache_attachment(attachment) -> str:
+    """
+        Stores an attachment in the attachment cache and returns the filepath.
+        The attachment is decoded and hashed a chunk at a time, straight into the cache.
+        Attachments that were cached before are found by their message and position, without decoding them again.
+    """
+
+    cache_key = getattr(attachment, 'cache_key', None)
+
+    if cache_key:
+        filepath = get_cached_attachment_filepath(cache_key)
+
+        if filepath:
+            return filepath
+
+    attachment_hash = hashlib.sha256()
+    file_descriptor, temporary_filepath = tempfile.mkstemp(dir=get_attachment_cache_directory(), suffix='.partial')
+    bytes_written = 0
+
+    with os.fdopen(file_descriptor, 'wb') as f:
+        for chunk in iter_attachment_chunks(attachment):
+            attachment_hash.update(chunk)
+            f.write(chunk)
+            bytes_written += len(chunk)
+
+    filepath = os.path.join(get_attachment_cache_directory(), attachment_hash.hexdigest())
+
+    if os.path.exists(filepath):
+        os.remove(temporary_filepath)
+        os.utime(filepath)
+    else:
+        os.replace(temporary_filepath, filepath)
+        record_attachment_cache_write(bytes_written)
+
+    if cache_key:
+        with message_cache_lock:
+            connection = get_message_cache()
+
+            connection.execute(
+                'INSERT OR REPLACE INTO attachments (gmail_id, attachment_index, content_hash) VALUES (?, ?, ?)',
+                (*cache_key, attachment_hash.hexdigest())
+            )
+
+            connection.commit()
+
+    return filepath
+
+##############################################################################################################################################
+
+# HTTP FUNCTIONS
+
+http_session = None
+http_session_lock = threading.Lock()
+
+def get_http_session() -> requests.Session:
+    """
+        Gets the HTTP session shared by every remote image download, so connections to the same host are reused.
+    """
+
+    global http_session
+
+    with http_session_lock:
+        if http_session is None:
+            http_session = requests.Session()
+
+            # pool_block keeps the number of connections per host at the limit instead of opening extra ones
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=REMOTE_IMAGE_CONNECTIONS_PER_HOST,
+                pool_block=True
+            )
+
+            http_session.mount('http://', adapter)
+            http_session.mount('https://', adapter)
+
+    return http_session
+
+def get_http_cache_lifetime(headers) -> Optional[float]:
+    """
+        Gets how many seconds a response can be used without asking the server again, or None if it must not be cached.
+    """
+
+    cache_control = [directive.strip().lower() for directive in headers.get('Cache-Control', '').split(',')]
+
+    if 'no-store' in cache_control:
+        return None
+
+    if 'no-cache' in cache_control:
+        return 0
+
+    for directive in cache_control:
+        if directive.startswith('max-age='):
+            try:
+                return max(int(directive[len('max-age='):]), 0)
+            except ValueError:
+                return 0
+
+    if headers.get('Expires'):
+        try:
+            expires = email.utils.parsedate_to_datetime(headers['Expires'])
+            return max(expires.timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return 0
+
+    return 0
+
+def download_remote_file(url: str) -> Optional[str]:
+    """
+        Downloads a file over HTTP into the attachment cache and returns its filepath, or None if it could not be downloaded.
+        Fresh responses are served from the cache without a request and stale ones are revalidated with ETag and Last-Modified.
+    """
+
+    with message_cache_lock:
+        cached_response = get_message_cache().execute(
+            'SELECT etag, last_modified, expires_at, filepath FROM http_cache WHERE url = ?',
+            (url,)
+        ).fetchone()
+
+    request_headers = {}
+
+    # the file itself might have been evicted from the attachment cache
+    if cached_response and os.path.exists(cached_response[3]):
+        etag, last_modified, expires_at, filepath = cached_response
+
+        if expires_at > time.time():
+            os.utime(filepath)
+            return filepath
+
+        if etag:
+            request_headers['If-None-Match'] = etag
+
+        if last_modified:
+            request_headers['If-Modified-Since'] = last_modified
+    else:
+        cached_response = None
+
+    response = get_http_session().get(
+        url,
+        headers=request_headers,
+        allow_redirects=True,
+        timeout=(REMOTE_IMAGE_CONNECT_TIMEOUT_SECONDS, REMOTE_IMAGE_READ_TIMEOUT_SECONDS)
+    )
+
+    cache_lifetime = get_http_cache_lifetime(response.headers)
+
+    if response.status_code == 304 and cached_response:
+        filepath = cached_response[3]
+        os.utime(filepath)
+    elif response.ok:
+        filepath = cache_payload(response.content)
+    else:
+        return None
+
+    with message_cache_lock:
+        connection = get_message_cache()
+
+        if cache_lifetime is None:
+            connection.execute('DELETE FROM http_cache WHERE url = ?', (url,))
+        else:
+            connection.execute(
+                'INSERT OR REPLACE INTO http_cache VALUES (?, ?, ?, ?, ?)',
+                (
+                    url,
+                    response.headers.get('ETag') or (cached_response and cached_response[0]),
+                    response.headers.get('Last-Modified') or (cached_response and cached_response[1]),
+                    time.time() + cache_lifetime,
+                    filepath,
+                )
+            )
+
+        connection.commit()
+
+    return filepath
+
+##############################################################################################################################################
+
+# HTML RENDERING FUNCTIONS
+
+HTML_VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+HTML_HIDDEN_TAGS = {'head', 'script', 'style', 'title', 'noscript', 'template'}
+HTML_BLOCK_TAGS = {
+    'address', 'article', 'aside', 'body', 'center', 'dd', 'div', 'dl', 'dt', 'fieldset', 'figure', 'footer', 'form',
+    'header', 'html', 'main', 'nav', 'section', 'tbody', 'thead', 'tfoot',
+}
+HTML_PARAGRAPH_TAGS = {'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+# opening one of these tags closes an unclosed tag of the same kind, like browsers do
+HTML_SELF_CLOSING_SIBLING_TAGS = {'li', 'p', 'td', 'th', 'tr', 'option', 'dt', 'dd'}
+
+HTML_INLINE_TAG_STYLES = {
+    'b': ANSI_BOLD,
+    'strong': ANSI_BOLD,
+    'i': ANSI_ITALIC,
+    'em': ANSI_ITALIC,
+    'cite': ANSI_ITALIC,
+    'u': ANSI_UNDERLINE,
+    'ins': ANSI_UNDERLINE,
+    'h1': ANSI_BOLD,
+    'h2': ANSI_BOLD,
+    'h3': ANSI_BOLD,
+    'h4': ANSI_BOLD,
+    'h5': ANSI_BOLD,
+    'h6': ANSI_BOLD,
+    'th': ANSI_BOLD,
+}
+
+class HTMLTreeBuilder(HTMLParser):
+    """
+        Parses HTML into a tree of {'tag', 'attrs', 'children'} dicts with strings for text, forgiving unclosed and stray tags.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+
+        self.root = {'tag': 'root', 'attrs': {}, 'children': []}
+        self.open_nodes = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HTML_SELF_CLOSING_SIBLING_TAGS:
+            for index in range(len(self.open_nodes) - 1, 0, -1):
+                open_tag = self.open_nodes[index]['tag']
+
+                if open_tag == tag:
+                    del self.open_nodes[index:]
+                    break
+
+                # do not close a list item or cell of an outer list or table
+                if open_tag in ('ul', 'ol', 'table'):
+                    break
+
+        node = {'tag': tag, 'attrs': dict(attrs), 'children': []}
+        self.open_nodes[-1]['children'].append(node)
+
+        if tag not in HTML_VOID_TAGS:
+            self.open_nodes.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        self.open_nodes[-1]['children'].append({'tag': tag, 'attrs': dict(attrs), 'children': []})
+
+    def handle_endtag(self, tag):
+        for index in range(len(self.open_nodes) - 1, 0, -1):
+            if self.open_nodes[index]['tag'] == tag:
+                del self.open_nodes[index:]
+                return
+
+    def handle_data(self, data):
+        self.open_nodes[-1]['children'].append(data)
+
+def parse_html_tree(html: str) -> dict:
+    """
+        Parses HTML into a tree that render_html_node can render.
+    """
+
+    tree_builder = HTMLTreeBuilder()
+    tree_builder.feed(html)
+    tree_builder.close()
+
+    return tree_builder.root
+
+def get_node_text(node) -> str:
+    """
+        Gets all the text inside an HTML node.
+    """
+
+    texts = []
+
+    # an explicit stack instead of recursion, so deeply nested HTML does not hit the recursion limit
+    nodes_to_visit = [node]
+
+    while nodes_to_visit:
+        node = nodes_to_visit.pop()
+
+        if isinstance(node, str):
+            texts.append(node)
+        elif node['tag'] not in HTML_HIDDEN_TAGS:
+            nodes_to_visit.extend(reversed(node['children']))
+
+    return ''.join(texts)
+
+def get_visible_length(text: str) -> int:
+    """
+        Gets the number of characters text takes up in the terminal, ignoring color codes.
+    """
+
+    return len(ansi_escape_regex.sub('', text))
+
+def get_css_styles(style_attribute: str) -> str:
+    """
+        Gets the ANSI codes for the bold, italic, and underline declarations of an inline CSS style attribute.
+    """
+
+    ansi_codes = ''
+    style_attribute = style_attribute.replace(' ', '').lower()
+
+    if 'font-weight:bold' in style_attribute or re.search(r'font-weight:[6-9]00', style_attribute):
+        ansi_codes += ANSI_BOLD
+
+    if 'font-style:italic' in style_attribute:
+        ansi_codes += ANSI_ITALIC
+
+    if 'text-decoration:underline' in style_attribute:
+        ansi_codes += ANSI_UNDERLINE
+
+    return ansi_codes
+
+def wrap_styled_words(styled_words: list, width: int) -> list:
+    """
+        Wraps words made of (text, ANSI codes) fragments into lines no wider than width.
+        Words longer than the width get a line of their own.
+    """
+
+    lines = []
+    line = ''
+    line_length = 0
+
+    for word in styled_words:
+        word_length = sum(len(text) for text, _ in word)
+        styled_word = ''.join(f'{ansi_codes}{text}{ANSI_RESET}' if ansi_codes else text for text, ansi_codes in word)
+
+        if line_length and line_length + 1 + word_length > width:
+            lines.append(line)
+            line = ''
+            line_length = 0
+
+        if line_length:
+            line += ' '
+            line_length += 1
+
+        line += styled_word
+        line_length += word_length
+
+    if line_length:
+        lines.append(line)
+
+    return lines
+
+def render_html_node(node: dict, width: int, links: list, ansi_codes: str = '') -> list:
+    """
+        Renders the children of an HTML node to lines of terminal text no wider than width, where possible.
+        The URLs of links are appended to links and referenced by number in the text.
+    """
+
+    # nested blocks are rendered by generators on an explicit stack instead of recursive calls, so deeply nested HTML does not hit the recursion limit
+    renderers = [render_html_block(node, width, links, ansi_codes)]
+    rendered_lines = None
+
+    while True:
+        try:
+            block_to_render = renderers[-1].send(rendered_lines)
+        except StopIteration as stop:
+            renderers.pop()
+            rendered_lines = stop.value
+
+            if not renderers:
+                return rendered_lines
+        else:
+            block_node, block_width, block_ansi_codes = block_to_render
+            renderers.append(render_html_block(block_node, block_width, links, block_ansi_codes))
+            rendered_lines = None
+
+def render_html_block(node: dict, width: int, links: list, ansi_codes: str) -> Iterator[tuple]:
+    """
+        Renders the children of an HTML node like render_html_node, returning the lines when it stops.
+        Nested blocks are yielded as (node, width, ANSI codes) and their lines have to be sent back.
+    """
+
+    lines = []
+    styled_words = []
+    word = []
+
+    def flush_words():
+        nonlocal styled_words, word
+
+        if word:
+            styled_words.append(word)
+
+        lines.extend(wrap_styled_words(styled_words, width))
+
+        styled_words = []
+        word = []
+
+    def add_text(text, text_ansi_codes):
+        nonlocal word
+
+        for piece in re.split(r'(\s+)', text):
+            if not piece:
+                continue
+
+            if piece.isspace():
+                if word:
+                    styled_words.append(word)
+                    word = []
+            else:
+                word.append((piece, text_ansi_codes))
+
+    def add_block(block_lines, blank_lines_around=False):
+        flush_words()
+
+        if blank_lines_around and lines and lines[-1]:
+            lines.append('')
+
+        lines.extend(block_lines)
+
+        if blank_lines_around and block_lines:
+            lines.append('')
+
+    # inline tags are walked with a stack of (children left, ANSI codes, href of the link they are in) instead of recursion too
+    inline_nodes = [(iter(node['children']), ansi_codes, None)]
+
+    while inline_nodes:
+        children, current_ansi_codes, href = inline_nodes[-1]
+        child = next(children, None)
+
+        if child is None:
+            inline_nodes.pop()
+
+            if href is not None and not href.startswith('#'):
+                links.append(href)
+                word.append((f'[{len(links)}]', ANSI_BLUE))
+
+            continue
+
+        if isinstance(child, str):
+            add_text(child, current_ansi_codes)
+            continue
+
+        tag = child['tag']
+
+        if tag in HTML_HIDDEN_TAGS:
+            continue
+
+        child_ansi_codes = current_ansi_codes + HTML_INLINE_TAG_STYLES.get(tag, '') + get_css_styles(child['attrs'].get('style') or '')
+
+        if tag == 'br':
+            flush_words()
+        elif tag == 'hr':
+            add_block(['─' * width])
+        elif tag == 'img':
+            alt_text = (child['attrs'].get('alt') or '').strip()
+
+            if alt_text:
+                add_text(f'[{alt_text}]', current_ansi_codes)
+        elif tag == 'a' and child['attrs'].get('href'):
+            inline_nodes.append((iter(child['children']), child_ansi_codes + ANSI_UNDERLINE + ANSI_BLUE, child['attrs']['href'].strip()))
+        elif tag in ('ul', 'ol'):
+            list_lines = []
+
+            for item_number, item in enumerate((item for item in child['children'] if isinstance(item, dict) and item['tag'] == 'li'), 1):
+                marker = f'{item_number}. ' if tag == 'ol' else '• '
+                item_lines = (yield item, max(width - len(marker), 1), child_ansi_codes) or ['']
+
+                list_lines.append(marker + item_lines[0])
+                list_lines += [' ' * len(marker) + item_line for item_line in item_lines[1:]]
+
+            add_block(list_lines, True)
+        elif tag == 'table':
+            add_block((yield from render_html_table(child, width, child_ansi_codes)), True)
+        elif tag == 'pre':
+            flush_words()
+
+            for pre_line in get_node_text(child).strip('\n').split('\n'):
+                lines.append(f'{child_ansi_codes}{pre_line}{ANSI_RESET}' if child_ansi_codes else pre_line)
+        elif tag == 'blockquote':
+            quote_lines = yield child, max(width - 2, 1), child_ansi_codes
+            add_block(['│ ' + quote_line for quote_line in quote_lines], True)
+        elif tag in HTML_PARAGRAPH_TAGS:
+            add_block((yield child, width, child_ansi_codes), True)
+        elif tag in HTML_BLOCK_TAGS or tag == 'li' or tag == 'tr':
+            add_block((yield child, width, child_ansi_codes))
+        else:
+            # inline tags like span and font, and tags we do not know
+            inline_nodes.append((iter(child['children']), child_ansi_codes, None))
+
+    flush_words()
+
+    # collapse runs of blank lines
+    return [line for index, line in enumerate(lines) if line or (index and lines[index - 1])]
+
+def render_html_table(table: dict, width: int, ansi_codes: str) -> Iterator[tuple]:
+    """
+        Renders an HTML table to lines of terminal text, yielding its cells like render_html_block yields nested blocks.
+        Tables that only use one cell per row for layout are rendered as plain blocks of text.
+    """
+
+    rows = []
+    nodes_to_visit = list(table['children'])
+
+    # rows can be inside thead, tbody, and tfoot, but not inside nested tables
+    while nodes_to_visit:
+        node = nodes_to_visit.pop(0)
+
+        if isinstance(node, str) or node['tag'] == 'table':
+            continue
+
+        if node['tag'] == 'tr':
+            rows.append([cell for cell in node['children'] if isinstance(cell, dict) and cell['tag'] in ('td', 'th')])
+        else:
+            nodes_to_visit = list(node['children']) + nodes_to_visit
+
+    rows_with_content = [[cell for cell in row if get_node_text(cell).strip() or cell['children']] for row in rows]
+
+    lines = []
+
+    if all(len(row) <= 1 for row in rows_with_content):
+        for row in rows_with_content:
+            for cell in row:
+                lines += yield cell, width, ansi_codes + HTML_INLINE_TAG_STYLES.get(cell['tag'], '')
+
+        return lines
+
+    column_count = max(len(row) for row in rows)
+    column_seperator = ' │ '
+    column_width = max((width - len(column_seperator) * (column_count - 1)) // column_count, 1)
+
+    rendered_rows = []
+
+    for row in rows:
+        rendered_row = []
+
+        for cell in row:
+            rendered_row.append((yield cell, column_width, ansi_codes + HTML_INLINE_TAG_STYLES.get(cell['tag'], '')))
+
+        rendered_rows.append(rendered_row)
+
+    # shrink columns to their content
+    column_widths = [1] * column_count
+
+    for rendered_row in rendered_rows:
+        for column_index, cell_lines in enumerate(rendered_row):
+            for cell_line in cell_lines:
+                column_widths[column_index] = max(column_widths[column_index], min(get_visible_length(cell_line), column_width))
+
+    for rendered_row in rendered_rows:
+        rendered_row = rendered_row + [[]] * (column_count - len(rendered_row))
+
+        for line_index in range(max(len(cell_lines) for cell_lines in rendered_row)):
+            cells = []
+
+            for column_index, cell_lines in enumerate(rendered_row):
+                cell_line = cell_lines[line_index] if line_index < len(cell_lines) else ''
+                cells.append(cell_line + ' ' * (column_widths[column_index] - get_visible_length(cell_line)))
+
+            lines.append(column_seperator.join(cells).rstrip())
+
+    return lines
+
+def render_html_segments_builtin(html_segments: list, width: Optional[int] = None) -> list:
+    """
+        Renders pieces of HTML to terminal text in-process, keeping the pieces seperate.
+        Links are numbered across all the pieces and listed after the last one.
+    """
+
+    width = width or shutil.get_terminal_size().columns
+    links = []
+    rendered_segments = []
+
+    for html_segment in html_segments:
+        segment_lines = render_html_node(parse_html_tree(html_segment), width, links)
+
+        while segment_lines and not segment_lines[-1]:
+            segment_lines.pop()
+
+        rendered_segments.append(''.join(f'{line}\n' for line in segment_lines))
+
+    if links:
+        rendered_segments[-1] += '\nLinks:\n' + ''.join(f'[{index}] {link}\n' for index, link in enumerate(links, 1))
+
+    return rendered_segments
+
+def render_html_segments_w3m(html_segments: list) -> list:
+    """
+        Renders pieces of HTML to terminal text with a single w3m process, keeping the pieces seperate.
+    """
+
+    w3m_command = ['w3m', '-dump', '-T', 'text/html', '-I', 'UTF-8', '-O', 'UTF-8', '-o', 'color=true']
+    segment_break = f'segment-break-{secrets.token_hex(8)}'
+
+    completed_process = subprocess.run(
+        w3m_command,
+        input=f'<br>{segment_break}<br>'.join(html_segments).encode('utf8'),
+        stdout=subprocess.PIPE
+    )
+
+    rendered_segments = completed_process.stdout.decode('utf8', 'replace').split(segment_break)
+
+    if len(rendered_segments) == len(html_segments):
+        return rendered_segments
+
+    # w3m dropped a break, e.g. because it ended up inside a script or comment, so render every piece on its own
+    return [
+        subprocess.run(w3m_command, input=html_segment.encode('utf8'), stdout=subprocess.PIPE).stdout.decode('utf8', 'replace')
+        for html_segment in html_segments
+    ]
+
+def render_html_segments(html_segments: list) -> list:
+    """
+        Renders pieces of HTML to terminal text with the configured renderer.
+        The built in renderer is used when w3m is not installed.
+    """
+
+    if HTML_RENDERER == 'w3m' and shutil.which('w3m'):
+        return render_html_segments_w3m(html_segments)
+
+    return render_html_segments_builtin(html_segments)
+
+##############################################################################################################################################
+
+# QUOTED HISTORY FUNCTIONS
+
+# a quoted block is collapsed when at least this much of its text was already shown
+QUOTED_BLOCK_SHOWN_RATIO = 0.9
+
+# the line before quoted history, like "On Mon, Jan 1, 2024 at 9:00 AM Someone <someone@example.com> wrote:"
+quote_attribution_end_regex = re.compile(r'(wrote|a écrit|schrieb|escribió|ha scritto|schreef)\s*:\s*$', re.IGNORECASE)
+quote_attribution_start_regex = re.compile(r'^\s*(On|Le|Am|El|Il|Op)\s')
+
+# Outlook puts the history below a line like this, or below a block of From:, Sent: and Subject: headers
+outlook_separator_regex = re.compile(r'^\s*(-{2,}\s*Original Message\s*-{2,}|_{10,})\s*$', re.IGNORECASE)
+outlook_header_regex = re.compile(r'^\s*(From|Sent|Date|To|Cc|Subject):\s', re.IGNORECASE)
+
+quote_marker_regex = re.compile(r'^[ \t]*(>[ \t]?)+', re.MULTILINE)
+blank_line_regex = re.compile(r'\n[ \t]*\n')
+whitespace_regex = re.compile(r'\s+')
+
+# quoted text is compared a phrase at a time
+phrase_end_regex = re.compile(r'(?<=[.!?,;:])\s+')
+
+HTML_QUOTE_CLASSES = {'gmail_quote', 'yahoo_quoted', 'moz-cite-prefix'}
+
+# Outlook does not wrap the history, everything after one of these is quoted
+HTML_OUTLOOK_QUOTE_IDS = {'divRplyFwdMsg', 'appendonsend', 'stopSpelling'}
+
+HTML_PARAGRAPH_BREAK_TAGS = HTML_BLOCK_TAGS | HTML_PARAGRAPH_TAGS | {'blockquote', 'li', 'tr', 'hr', 'pre'}
+
+def get_html_shown_text(node) -> str:
+    """
+        Gets the text of an HTML node with a blank line between blocks and a line break for every br, like it is shown.
+    """
+
+    blocks = ['']
+
+    # None marks the end of a block on the stack
+    nodes_to_visit = [node]
+
+    while nodes_to_visit:
+        node = nodes_to_visit.pop()
+
+        if node is None:
+            blocks.append('')
+        elif isinstance(node, str):
+            blocks[-1] += node
+        elif node['tag'] == 'br':
+            blocks[-1] += '\n'
+        elif node['tag'] not in HTML_HIDDEN_TAGS:
+            if node['tag'] in HTML_PARAGRAPH_BREAK_TAGS:
+                blocks.append('')
+                nodes_to_visit.append(None)
+
+            nodes_to_visit.extend(reversed(node['children']))
+
+    return '\n\n'.join(blocks)
+
+def remove_quote_headers(text: str) -> str:
+    """
+        Removes the "On ... wrote:" and Outlook header lines from quoted history, they are never shown by the email that was quoted.
+    """
+
+    kept_lines = []
+
+    for line in text.split('\n'):
+        if quote_attribution_end_regex.search(line):
+            # the attribution can be wrapped onto a second line
+            if kept_lines and not quote_attribution_start_regex.match(line) and quote_attribution_start_regex.match(kept_lines[-1]):
+                kept_lines.pop()
+
+            continue
+
+        if outlook_separator_regex.match(line) or outlook_header_regex.match(line):
+            continue
+
+        kept_lines.append(line)
+
+    return '\n'.join(kept_lines)
+
+def iter_phrase_hashes(text: str) -> Iterable[tuple]:
+    """
+        Splits text into phrases and yields the hash and length of each one.
+        Phrases match even when they were quoted with >, wrapped differently, or had their paragraphs joined.
+    """
+
+    text = remove_quote_headers(quote_marker_regex.sub('', text))
+
+    for paragraph in blank_line_regex.split(text):
+        for phrase in phrase_end_regex.split(whitespace_regex.sub(' ', paragraph).strip().casefold()):
+            if phrase:
+                yield hashlib.sha256(phrase.encode('utf8')).digest(), len(phrase)
+
+def add_shown_text(text: str, shown_text_hashes: set) -> None:
+    shown_text_hashes.update(phrase_hash for phrase_hash, _ in iter_phrase_hashes(text))
+
+def was_shown(text: str, shown_text_hashes: set) -> bool:
+    """
+        Checks if nearly all of the text of a quoted block was already shown.
+    """
+
+    total_length = 0
+    shown_length = 0
+
+    for phrase_hash, phrase_length in iter_phrase_hashes(text):
+        total_length += phrase_length
+
+        if phrase_hash in shown_text_hashes:
+            shown_length += phrase_length
+
+    return bool(total_length) and shown_length >= total_length * QUOTED_BLOCK_SHOWN_RATIO
+
+def split_quoted_text(text: str) -> list:
+    """
+        Splits a plain text email into (text, is_quoted) pieces.
+        Lines quoted with >, the "On ... wrote:" line before them, and everything after an Outlook reply header are quoted.
+    """
+
+    lines = text.split('\n')
+    is_quoted = [False] * len(lines)
+
+    for index, line in enumerate(lines):
+        if outlook_separator_regex.match(line) or (
+            line.lstrip().lower().startswith('from:')
+            and sum(bool(outlook_header_regex.match(next_line)) for next_line in lines[index + 1: index + 5]) >= 2
+        ):
+            is_quoted[index:] = [True] * (len(lines) - index)
+            break
+
+        is_quoted[index] = line.lstrip().startswith('>')
+
+    for index in range(1, len(lines)):
+        if not is_quoted[index] or is_quoted[index - 1]:
+            continue
+
+        # the attribution line before a quote, with blank lines in between
+        attribution_index = index - 1
+
+        while attribution_index > 0 and not lines[attribution_index].strip():
+            attribution_index -= 1
+
+        if not quote_attribution_end_regex.search(lines[attribution_index]):
+            continue
+
+        # the attribution can be wrapped onto a second line
+        if (
+            attribution_index > 0
+            and not quote_attribution_start_regex.match(lines[attribution_index])
+            and quote_attribution_start_regex.match(lines[attribution_index - 1])
+        ):
+            attribution_index -= 1
+
+        is_quoted[attribution_index: index] = [True] * (index - attribution_index)
+
+    pieces = []
+
+    for quoted, piece_lines in itertools.groupby(zip(lines, is_quoted), key=lambda line_and_is_quoted: line_and_is_quoted[1]):
+        pieces.append(('\n'.join(line for line, _ in piece_lines), quoted))
+
+    return pieces
+
+def collapse_shown_quoted_text(text: str, shown_text_hashes: set) -> str:
+    """
+        Replaces the quoted blocks of a plain text email that were already shown with a note, and remembers the text that is left as shown.
+    """
+
+    pieces = []
+
+    for piece, is_quoted in split_quoted_text(text):
+        if is_quoted and was_shown(piece, shown_text_hashes):
+            line_count = piece.count('\n') + 1
+            pieces.append(f'[{line_count} lines of quoted history already shown]')
+            continue
+
+        add_shown_text(piece, shown_text_hashes)
+        pieces.append(piece)
+
+    return '\n'.join(pieces)
+
+class QuotedHTMLFinder(HTMLParser):
+    """
+        Finds where the quoted history is in HTML, like Gmail quote divs, cited blockquotes and Outlook reply headers.
+    """
+
+    def __init__(self, html: str):
+        super().__init__(convert_charrefs=True)
+
+        self.html = html
+        self.line_offsets = [0] + [match.end() for match in re.finditer('\n', html)]
+        self.open_tags = []
+        self.quote_depth = None
+        self.quote_start = None
+        self.quoted_spans = []
+
+    def get_offset(self) -> int:
+        line, column = self.getpos()
+        return self.line_offsets[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HTML_VOID_TAGS and tag != 'hr':
+            return
+
+        attrs = dict(attrs)
+
+        if self.quote_depth is None:
+            classes = set((attrs.get('class') or '').split())
+
+            if attrs.get('id') in HTML_OUTLOOK_QUOTE_IDS:
+                self.quoted_spans.append((self.get_offset(), len(self.html)))
+                self.quote_depth = -1
+            elif classes & HTML_QUOTE_CLASSES or (tag == 'blockquote' and attrs.get('type') == 'cite'):
+                self.quote_start = self.get_offset()
+                self.quote_depth = len(self.open_tags)
+
+        if tag not in HTML_VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in self.open_tags:
+            return
+
+        # unclosed tags inside are closed too
+        while self.open_tags.pop() != tag:
+            pass
+
+        if self.quote_depth is not None and self.quote_depth >= 0 and len(self.open_tags) <= self.quote_depth:
+            self.quoted_spans.append((self.quote_start, self.html.find('>', self.get_offset()) + 1))
+            self.quote_depth = None
+
+    def close(self):
+        super().close()
+
+        if self.quote_depth is not None and self.quote_depth >= 0:
+            self.quoted_spans.append((self.quote_start, len(self.html)))
+
+def collapse_shown_quoted_html(html: str, shown_text_hashes: set) -> str:
+    """
+        Replaces the quoted blocks of an HTML email that were already shown with a note, and remembers the text that is left as shown.
+        Images in collapsed blocks are not downloaded.
+    """
+
+    quoted_html_finder = QuotedHTMLFinder(html)
+    quoted_html_finder.feed(html)
+    quoted_html_finder.close()
+
+    html_pieces = []
+    piece_start = 0
+
+    for quote_start, quote_end in quoted_html_finder.quoted_spans:
+        if was_shown(get_html_shown_text(parse_html_tree(html[quote_start: quote_end])), shown_text_hashes):
+            html_pieces.append(html[piece_start: quote_start])
+            html_pieces.append('<p><i>[quoted history already shown]</i></p>')
+            piece_start = quote_end
+
+    html_pieces.append(html[piece_start:])
+    html = ''.join(html_pieces)
+
+    add_shown_text(get_html_shown_text(parse_html_tree(html)), shown_text_hashes)
+
+    return html
+
+##############################################################################################################################################
+
+# IMAGE RENDERING FUNCTIONS
+
+sha256_hex_regex = re.compile(r'[0-9a-f]{64}')
+
+def get_file_hash(filepath: str) -> str:
+    """
+        Gets the sha256 hash of a file.
+        Files in the attachment cache are already named after their hash, so they are not read again.
+    """
+
+    filename = os.path.basename(filepath)
+
+    if sha256_hex_regex.fullmatch(filename) and os.path.dirname(os.path.abspath(filepath)) == os.path.abspath(get_attachment_cache_directory()):
+        return filename
+
+    file_hash = hashlib.sha256()
+
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+def render_image_frame(frame: Image.Image, columns: int, rows: int) -> str:
+    """
+        Renders an image to terminal text with truecolor half blocks, two pixels per character.
+    """
+
+    pixel_width, pixel_height = frame.size
+
+    # a character is about twice as high as it is wide and holds two pixels on top of each other
+    scale = min(columns / pixel_width, rows * 2 / pixel_height, 1)
+    target_width = max(round(pixel_width * scale), 1)
+    target_height = max(round(pixel_height * scale), 2)
+    target_height += target_height % 2
+
+    pixels = frame.convert('RGBA').resize((target_width, target_height), Image.Resampling.BILINEAR).load()
+    lines = []
+
+    for y in range(0, target_height, 2):
+        line = []
+
+        for x in range(target_width):
+            top_red, top_green, top_blue, top_alpha = pixels[x, y]
+            bottom_red, bottom_green, bottom_blue, bottom_alpha = pixels[x, y + 1]
+
+            # transparent pixels show the background of the terminal
+            if top_alpha < 128 and bottom_alpha < 128:
+                line.append(f'{ANSI_RESET} ')
+            elif bottom_alpha < 128:
+                line.append(f'{ANSI_RESET}\x1b[38;2;{top_red};{top_green};{top_blue}m▀')
+            elif top_alpha < 128:
+                line.append(f'{ANSI_RESET}\x1b[38;2;{bottom_red};{bottom_green};{bottom_blue}m▄')
+            else:
+                line.append(f'\x1b[38;2;{top_red};{top_green};{top_blue};48;2;{bottom_red};{bottom_green};{bottom_blue}m▀')
+
+        lines.append(''.join(line) + ANSI_RESET)
+
+    return '\n'.join(lines) + '\n'
+
+def render_image(image_file_path: str, columns: int, rows: int) -> Optional[dict]:
+    """
+        Decodes an image once and renders every frame of it to terminal text.
+        Returns None if the file is not an image.
+    """
+
+    try:
+        image = Image.open(image_file_path)
+    except (Image.UnidentifiedImageError, OSError):
+        return None
+
+    with image:
+        if image.size == (1, 1):
+            return None
+
+        # lets JPEG decode a smaller image straight away instead of scaling down the full size one
+        image.draft('RGB', (columns, rows * 2))
+
+        frames = []
+        durations = []
+
+        try:
+            for frame_index in range(min(getattr(image, 'n_frames', 1), IMAGE_MAXIMUM_ANIMATION_FRAMES)):
+                image.seek(frame_index)
+                frames.append(render_image_frame(image, columns, rows))
+                durations.append(image.info.get('duration') or 100)
+        except (OSError, EOFError):
+            # truncated images still show the frames that could be decoded
+            if not frames:
+                return None
+
+    return {'frames': frames, 'durations': durations}
+
+def get_rendered_image(image_file_path: str) -> Optional[dict]:
+    """
+        Gets an image rendered for the current terminal size, from the attachment cache if it was rendered before.
+        Returns None if the file is not an image.
+    """
+
+    columns, rows = shutil.get_terminal_size()
+
+    # leave a line for the prompt under the image
+    rows = max(rows - 1, 1)
+
+    rendered_image_filepath = os.path.join(get_attachment_cache_directory(), f'{get_file_hash(image_file_path)}.{columns}x{rows}.json')
+
+    try:
+        with open(rendered_image_filepath) as f:
+            rendered_image = json.load(f)
+
+        os.utime(rendered_image_filepath)
+
+        return rendered_image or None
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    rendered_image = render_image(image_file_path, columns, rows)
+
+    # files that are not images are remembered as well, so they are not decoded again
+    rendered_image_json = json.dumps(rendered_image or {}).encode('utf8')
+    write_file_atomically(rendered_image_filepath, rendered_image_json)
+
+    record_attachment_cache_write(len(rendered_image_json))
+
+    return rendered_image
+
+def print_rendered_image(rendered_image: dict) -> None:
+    """
+        Prints a rendered image to the terminal.
+        Animations loop until Control + C is pressed.
+    """
+
+    frames = rendered_image['frames']
+
+    write_output(frames[0])
+
+    # animations would never end when the output is not a terminal
+    if len(frames) == 1 or not should_color_output:
+        return
+
+    frame_height = frames[0].count('\n')
+    durations = rendered_image['durations']
+
+    try:
+        for frame_index in itertools.cycle(range(len(frames))):
+            time.sleep(durations[frame_index] / 1000)
+
+            # move back up and draw the next frame over the last one
+            write_output(f'\x1b[{frame_height}F{frames[(frame_index + 1) % len(frames)]}')
+            flush_output()
+    except KeyboardInterrupt:
+        pass
+
+def get_viu_path() -> Optional[str]:
+    """
+        Gets the path of viu, or None if it is not installed.
+    """
+
+    cargo_viu_path = os.path.join(os.path.expanduser('~'), '.cargo', 'bin', 'viu')
+
+    return shutil.which('viu') or (cargo_viu_path if os.access(cargo_viu_path, os.X_OK) else None)
+
+##############################################################################################################################################
+
+# PAGER FUNCTIONS
+
+ANSI_REVERSE = '\x1b[7m'
+
+def find_screen_line_starts(text: str, screen_line_starts: list, width: int, minimum_count: int) -> None:
+    """
+        Adds the offsets of the lines text takes up on the screen to screen_line_starts until it has minimum_count of them or the text ends.
+        Lines longer than width are split into several screen lines.
+    """
+
+    while len(screen_line_starts) < minimum_count:
+        line_start = screen_line_starts[-1]
+        # a line that fills the screen exactly still ends with its own line break
+        line_end = text.find('\n', line_start, line_start + width + 1)
+
+        next_line_start = line_end + 1 if line_end != -1 else line_start + width
+
+        if next_line_start >= len(text):
+            return
+
+        screen_line_starts.append(next_line_start)
+
+def get_screen_line_index(text: str, screen_line_starts: list, width: int, offset: int) -> int:
+    """
+        Gets the index of the screen line that the character at offset is on.
+    """
+
+    while screen_line_starts[-1] <= offset:
+        line_count = len(screen_line_starts)
+        find_screen_line_starts(text, screen_line_starts, width, line_count * 2)
+
+        if len(screen_line_starts) == line_count:
+            break
+
+    return bisect.bisect_right(screen_line_starts, offset) - 1
+
+def page_text(text: str, title: str = '') -> None:
+    """
+        Shows long text one screen at a time with forward and backward search.
+        Only the lines up to the screen being shown are ever split, so long text opens straight away.
+    """
+
+    columns, rows = shutil.get_terminal_size()
+    width = max(columns, 1)
+    page_height = max(rows - 3, 1)
+
+    screen_line_starts = [0]
+    top_line_index = 0
+    search_regex = None
+
+    while True:
+        find_screen_line_starts(text, screen_line_starts, width, top_line_index + page_height + 1)
+
+        top_line_index = min(top_line_index, len(screen_line_starts) - 1)
+        bottom_line_index = min(top_line_index + page_height, len(screen_line_starts))
+        is_at_end = bottom_line_index == len(screen_line_starts)
+
+        screen_lines = []
+
+        for line_index in range(top_line_index, bottom_line_index):
+            line_end = screen_line_starts[line_index + 1] if line_index + 1 < len(screen_line_starts) else len(text)
+            screen_line = text[screen_line_starts[line_index]: line_end].rstrip('\r\n')
+
+            if search_regex:
+                screen_line = search_regex.sub(lambda match: f'{ANSI_REVERSE}{match.group()}{ANSI_RESET}', screen_line)
+
+            screen_lines.append(screen_line + '\n')
+
+        write_output(''.join(screen_lines))
+
+        position = 'END' if is_at_end else f'{screen_line_starts[bottom_line_index] * 100 // max(len(text), 1)}%'
+
+        print(f'{title} lines {top_line_index + 1}-{bottom_line_index} ({position}) (Enter) next, (B)ack, (T)op, /search forward, ?search back, (Q)uit:'.strip())
+
+        user_input = input().strip()
+
+        if user_input.upper() == 'Q':
+            return
+
+        if user_input.upper() == 'B':
+            top_line_index = max(top_line_index - page_height, 0)
+        elif user_input.upper() == 'T':
+            top_line_index = 0
+        elif user_input[:1] in ('/', '?'):
+            # an empty search repeats the last one
+            if user_input[1:]:
+                search_regex = re.compile(re.escape(user_input[1:]), re.IGNORECASE)
+
+            if not search_regex:
+                continue
+
+            top_offset = screen_line_starts[top_line_index]
+
+            if user_input[0] == '/':
+                match = search_regex.search(text, screen_line_starts[top_line_index + 1] if top_line_index + 1 < len(screen_line_starts) else len(text))
+            else:
+                match = None
+
+                for match in search_regex.finditer(text, 0, top_offset):
+                    pass
+
+            if match:
+                top_line_index = get_screen_line_index(text, screen_line_starts, width, match.start())
+            else:
+                print('Not found')
+        elif not user_input or user_input.upper() == 'N':
+            if is_at_end:
+                return
+
+            top_line_index += page_height
+        else:
+            print('Invalid input')
+
+##############################################################################################################################################
+
+# EMAIL READING / WRITING FUNCTIONS
+
+# number of bytes at the start of a file used to tell what kind of file it is
+CONTENT_SNIFF_BYTES = 64 * 1024
+
+textchars = bytearray({7,8,9,10,12,13,27} | set(range(0x20, 0x100)) - {0x7f})
+is_binary_string = lambda bytes: bool(bytes[:CONTENT_SNIFF_BYTES].translate(None, textchars))
+sniffed_attachments = weakref.WeakKeyDictionary()
+# [image: FILENAME] and [image: cid:FILENAME@hash] from GMail, [cid:CONTENT_ID] from Outlook
+inline_image_tag_regex = re.compile(r'\[image: (?P<gmail>[^\]\n]+)\]|\[cid:(?P<outlook>[^\]\n]+)\]')
+attachment_indexes = weakref.WeakKeyDictionary()
+html_img_tag_regex = re.compile(r'<img[^>]*src="([^"]+)"[^>]*>')
+
+def iter_text_and_inline_images(message_content: str) -> Iterable[tuple]:
+    """
+        Splits email text into the text between inline image tags and the images the tags point to in a single pass.
+        Yields (text, image identifier, whether the identifier is a content id), the identifier is None after the last tag.
+    """
+
+    text_start = 0
+
+    for image_tag_match in inline_image_tag_regex.finditer(message_content):
+        text = message_content[text_start: image_tag_match.start()]
+        text_start = image_tag_match.end()
+
+        if image_tag_match.group('outlook'):
+            yield text, image_tag_match.group('outlook').strip(), True
+            continue
+
+        attachment_filename = image_tag_match.group('gmail').strip()
+
+        # [image: cid:FILENAME@hash] points to the attachment by its filename
+        if attachment_filename.startswith('cid:'):
+            attachment_filename = attachment_filename[4:].rsplit('@', 1)[0]
+
+        yield text, attachment_filename, False
+
+    yield message_content[text_start:], None, False
+
+def get_attachment_index(message) -> dict:
+    """
+        Gets the attachments of a message by (whether the identifier is a content id, identifier), built once per message.
+        The first attachment with a filename or content id wins, like a search through the attachments would.
+    """
+
+    if message not in attachment_indexes:
+        attachment_index = {}
+
+        for attachment in message.attachments:
+            attachment_index.setdefault((False, attachment.filename), attachment)
+
+            if attachment.content_id:
+                attachment_index.setdefault((True, str(attachment.content_id).strip().strip('<>')), attachment)
+
+        attachment_indexes[message] = attachment_index
+
+    return attachment_indexes[message]
+
+def download_images_in_parallel(indices_and_image_urls, images):
+    futures_to_indices = {submit_io(download_remote_file, img_url): index for index, img_url in indices_and_image_urls}
+
+    try:
+        for future in concurrent.futures.as_completed(futures_to_indices):
+            try:
+                images[futures_to_indices[future]] = future.result()
+            except (requests.exceptions.RequestException, urllib3.exceptions.MaxRetryError, urllib3.exceptions.NameResolutionError):
+                images[futures_to_indices[future]] = None
+    except BaseException:
+        cancel_io(futures_to_indices)
+        raise
+
+def decode_data_uri(data_uri: str) -> Optional[bytes]:
+    """
+        Returns the data in a data: URI, which is base64 encoded or percent encoded, or None if it cannot be decoded.
+    """
+
+    header, has_data, data = data_uri.partition(',')
+
+    if not has_data:
+        return None
+
+    if header.lower().endswith(';base64'):
+        try:
+            return base64.b64decode(data.strip())
+        except binascii.Error:
+            return None
+
+    return unquote_to_bytes(data)
+
+def display_html_email(message, downloaded_attachment_location_map, shown_text_hashes: Optional[set] = None) -> None:
+    """
+        Prints HTML email and optionally downloads inline images.
+        The HTML is scanned for image tags once and the text around them is rendered in one go.
+        With shown_text_hashes, quoted history that was already shown is collapsed first.
+    """
+    
+    html = message.html
+
+    if shown_text_hashes is not None:
+        html = collapse_shown_quoted_html(html, shown_text_hashes)
+
+    html_segments = []
+    images = []
+    image_indexes_by_source = {}
+    image_occurrences = []
+    segment_start = 0
+    cid_indexes = []
+    indices_and_image_urls = []
+    attachment_filepaths = set()
+    ask_to_save_inline_images = False
+    last_domain_accessed = ''
+
+    # split the HTML into the text between image tags and the sources of the images in a single pass
+    for image_tag_match in html_img_tag_regex.finditer(html):
+        html_segments.append(html[segment_start: image_tag_match.start()])
+        segment_start = image_tag_match.end()
+
+        img_src = unescape(image_tag_match.group(1)).strip()
+
+        if img_src not in image_indexes_by_source:
+            image_indexes_by_source[img_src] = len(images)
+            images.append(img_src)
+
+        image_occurrences.append(image_indexes_by_source[img_src])
+
+    html_segments.append(html[segment_start:])
+
+    for index, img_src in enumerate(images):
+        if img_src.startswith('cid'):
+            cid = ':'.join(img_src.split(':')[1:]).strip()
+            filename, filepath = download_attachment(cid, message, use_cid=True)
+
+            if filename and filepath:
+                downloaded_attachment_location_map[filename] = filepath
+                attachment_filepaths.add(filepath)
+            
+            images[index] = filepath
+            cid_indexes.append(index)
+                
+        elif img_src.startswith('data:'):
+            # embedded in the HTML: decode and save as file, skipping images that are not encoded properly
+
+            decoded_img_data = decode_data_uri(img_src)
+
+            images[index] = cache_payload(decoded_img_data) if decoded_img_data else None
+        else:
+            # probably points to URL
+
+            domain = urlparse(img_src).netloc
+
+            if domain:
+                last_domain_accessed = domain
+            else:
+                img_src = f'https://{last_domain_accessed}{img_src}'
+
+            indices_and_image_urls.append(
+                   (index, img_src)
+            )
+   
+    download_images_in_parallel(indices_and_image_urls, images)
+
+    # every segment of text is followed by an image, except for the last one
+    for rendered_segment, image_index in itertools.zip_longest(render_html_segments(html_segments), image_occurrences):
+        write_output(rendered_segment)
+
+        if image_index is None:
+            continue
+
+        image_to_display = images[image_index]
+        
+        if not image_to_display:
+            continue
+
+        is_image = display_if_image(image_to_display)
+
+        if is_image and (image_index not in cid_indexes):
+            ask_to_save_inline_images = True
+
+    inline_images = [image for image in (set(images) - attachment_filepaths) if image]
+
+    if ask_to_save_inline_images:
+        should_download_inline_images = ask_for_user_input('Do you want to download inline images? (Y or N)', ('Y', 'N'))
+
+        if should_download_inline_images == 'Y':
+            for index, image in enumerate(inline_images):
+                if not display_if_image(image):
+                    continue
+
+                should_download = ask_for_user_input(f'Do you want to (D)ownload or (S)kip the above image?', ('D', 'S'))
+
+                default_download_location = f'inline-image-{index}'
+
+                # download attachment
+                if should_download == 'D':
+                    requested_filepath = get_valid_filepath(f'Please enter the path you want to download this file to. Press Enter for {default_download_location}')
+
+                    requested_filepath = requested_filepath if requested_filepath else default_download_location
+
+                    shutil.copyfile(image, requested_filepath)
+
+def get_jpeg_size(head: bytes) -> Optional[tuple]:
+    """
+        Gets the width and height of a JPEG from its first bytes, or None if the frame header is not in them.
+    """
+
+    index = 2
+
+    while index + 9 <= len(head):
+        if head[index] != 0xFF:
+            return None
+
+        marker = head[index + 1]
+
+        # padding between segments
+        if marker == 0xFF:
+            index += 1
+            continue
+
+        # start of frame markers, except the ones for huffman and arithmetic coding tables
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', head[index + 5: index + 9])
+            return width, height
+
+        index += 2 + struct.unpack('>H', head[index + 2: index + 4])[0]
+
+    return None
+
+def get_webp_size(head: bytes) -> Optional[tuple]:
+    """
+        Gets the width and height of a WEBP from its first bytes.
+    """
+
+    chunk_type = head[12:16]
+
+    if chunk_type == b'VP8 ' and len(head) >= 30:
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+
+    if chunk_type == b'VP8L' and len(head) >= 25:
+        bits = int.from_bytes(head[21:25], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+
+    if chunk_type == b'VP8X' and len(head) >= 30:
+        return int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1
+
+    return None
+
+def sniff_image(head: bytes) -> Optional[tuple]:
+    """
+        Gets the format and size of an image from the first bytes of the file, or None if it is not an image.
+        The size is None when it is not in the first bytes.
+    """
+
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG', struct.unpack('>II', head[16:24]) if len(head) >= 24 else None
+
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'GIF', struct.unpack('<HH', head[6:10]) if len(head) >= 10 else None
+
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'JPEG', get_jpeg_size(head)
+
+    if head.startswith(b'BM') and len(head) >= 26:
+        width, height = struct.unpack('<ii', head[18:26])
+        return 'BMP', (abs(width), abs(height))
+
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return 'WEBP', get_webp_size(head)
+
+    # other formats Pillow knows, like TIFF and ICO, only need their header to be identified
+    try:
+        with Image.open(io.BytesIO(head)) as image:
+            return image.format, image.size
+    except (Image.UnidentifiedImageError, OSError, SyntaxError, ValueError, struct.error):
+        return None
+
+def is_sniffed_image(sniffed_image: Optional[tuple]) -> bool:
+    """
+        Checks if the result of sniff_image is an image worth showing, tracking pixels are not.
+    """
+
+    return bool(sniffed_image) and sniffed_image[1] != (1, 1)
+
+def get_attachment_head(attachment, size: int = CONTENT_SNIFF_BYTES) -> bytes:
+    """
+        Decodes only the first bytes of an attachment instead of its whole payload.
+        Attachments that are not part of the cached message are never downloaded to look at them, no bytes are returned for them until they are cached.
+    """
+
+    if is_gmail_attachment(attachment):
+        cached_filepath = get_cached_attachment_filepath(attachment.cache_key)
+
+        if not cached_filepath:
+            return b''
+
+        with open(cached_filepath, 'rb') as f:
+            return f.read(size)
+
+    head = b''
+
+    # base64 is 4 characters for every 3 bytes, with some room for line breaks
+    for chunk in iter_attachment_chunks(attachment, size * 2):
+        head += chunk
+
+        if len(head) >= size:
+            break
+
+    return head[:size]
+
+def get_declared_content_type(attachment) -> str:
+    """
+        Gets the content type an attachment says it is, guessed from its filename when it only says it is some binary data.
+    """
+
+    content_type = attachment._part.get_content_type()
+
+    if content_type == 'application/octet-stream':
+        content_type = mimetypes.guess_type(attachment.filename or '')[0] or content_type
+
+    return content_type
+
+def sniff_attachment(attachment) -> Optional[tuple]:
+    """
+        Gets the format and size of an attachment that is an image, only decoding its first bytes once per attachment.
+        Attachments that have not been downloaded yet are trusted to be the type they say they are, with an unknown size.
+    """
+
+    if attachment not in sniffed_attachments:
+        head = get_attachment_head(attachment)
+
+        if not head and is_gmail_attachment(attachment):
+            maintype, _, subtype = get_declared_content_type(attachment).partition('/')
+            return (subtype.upper(), None) if maintype == 'image' else None
+
+        sniffed_attachments[attachment] = sniff_image(head)
+
+    return sniffed_attachments[attachment]
+
+def is_filename_an_image(attachment_file_path) -> bool:
+    """
+        Checks if a filepath points to an image.
+    """
+
+    try:
+        with open(attachment_file_path, 'rb') as f:
+            head = f.read(CONTENT_SNIFF_BYTES)
+    except OSError:
+        return False
+
+    return is_sniffed_image(sniff_image(head))
+
+def is_attachment_binary(attachment) -> bool:
+    """
+        Checks if an attachment is a binary file that can not be printed.
+    """
+
+    head = get_attachment_head(attachment)
+
+    # attachments that were not downloaded to look at them are trusted to be the type they say they are
+    if not head and is_gmail_attachment(attachment):
+        return not get_declared_content_type(attachment).startswith('text/')
+
+    return is_binary_string(head)
+
+def is_attachment_an_image(attachment) -> bool:
+    """
+        Checks if an attachment file is an image.
+    """
+
+    return is_sniffed_image(sniff_attachment(attachment))
+
+def display_if_image(image_file_path) -> bool:
+    """
+        Prints a file to the terminal if it is an image.
+    """
+
+    if IMAGE_RENDERER == 'viu' and get_viu_path():
+        if not is_filename_an_image(image_file_path):
+            return False
+
+        try:
+            flush_output()
+            subprocess.call([get_viu_path(), image_file_path])
+        except KeyboardInterrupt:
+            pass
+
+        return True
+
+    rendered_image = get_rendered_image(image_file_path)
+
+    if not rendered_image:
+        return False
+
+    print_rendered_image(rendered_image)
+
+    return True
+        
+def display_first_image_attachment_you_can_find(attachments) -> tuple:
+    """
+        Displays the first image found in the attachments.
+        This is used when a malformed image tag is found in the message text.
+    """
+    
+    for attachment in attachments:
+        if is_attachment_an_image(attachment):
+            return display_attachment(attachment)
+            
+    return None, None
+        
+def display_inline_image(attachment_identifier, message, use_cid=False) -> tuple:
+    """
+        Prints an image to the terminal identified by an inline image tag in the email.
+    """
+    
+    matched_attachment = get_attachment_index(message).get((use_cid, attachment_identifier))
+
+    if matched_attachment:
+        return display_attachment(matched_attachment)
+                
+    return display_first_image_attachment_you_can_find(message.attachments)
+
+def download_attachment(attachment_identifier, message, use_cid=False) -> tuple:
+    """
+        Download an attachment and return the filepath
+    """
+
+    matched_attachment = get_attachment_index(message).get((use_cid, attachment_identifier))
+
+    if matched_attachment:
+        filepath = cache_attachment(matched_attachment)
+
+        return matched_attachment.filename, filepath
+    else:
+        return None, None
+
+def display_attachment(attachment, downloaded_attachment_location_map=None) -> tuple:
+    """
+        Prints an image to the terminal identified by an inline image tag in the email.
+    """
+    
+    if downloaded_attachment_location_map and attachment.filename in downloaded_attachment_location_map:
+        filepath = downloaded_attachment_location_map[attachment.filename]
+    else:
+        filepath = cache_attachment(attachment)
+
+    return filepath, display_if_image(filepath)
+    
+def ask_where_to_download_attachment(attachment, index: int) -> Optional[str]:
+    """
+        Asks if an attachment should be downloaded and where to, returns None if it should not be.
+    """
+
+    filename = attachment.filename
+
+    should_download = ask_for_user_input(f'\nDo you want to (D)ownload or (S)kip attachment #{index + 1} with filename "{filename}"', ('D', 'S'))
+
+    if should_download != 'D':
+        return None
+
+    default_download_location = filename if filename else f'attachment-{index}'
+
+    requested_filepath = get_valid_filepath(f'\nPlease enter the path you want to download this file to. Press Enter for {default_download_location}')
+
+    return requested_filepath if requested_filepath else default_download_location
+
+def save_attachment(attachment, filepath: str, downloaded_attachment_location_map: dict) -> int:
+    """
+        Saves an attachment to a file, copying it if it was already downloaded, and returns the number of bytes written.
+    """
+
+    cache_key = getattr(attachment, 'cache_key', None)
+
+    if attachment.filename in downloaded_attachment_location_map:
+        shutil.copyfile(downloaded_attachment_location_map[attachment.filename], filepath)
+    elif cache_key and (cached_filepath := get_cached_attachment_filepath(cache_key)):
+        shutil.copyfile(cached_filepath, filepath)
+    else:
+        write_attachment_to_file(attachment, filepath)
+
+    return os.path.getsize(filepath)
+
+def get_attachment_save_errors() -> tuple:
+    """
+        Gets the errors that only fail saving one attachment, which is downloaded while it is saved:
+        errors from the disk, from GMail, from signing in, and from the network, whose requests exceptions and timeouts are OSErrors.
+    """
+
+    return OSError, ValueError, googleapiclient.errors.HttpError, google_auth_exceptions.GoogleAuthError
+
+def save_attachments_in_parallel(attachments_and_filepaths: list, downloaded_attachment_location_map: dict) -> None:
+    """
+        Saves attachments to files in the background, several at a time.
+        Prints the throughput of every file as it finishes and of all of them together.
+    """
+
+    if not attachments_and_filepaths:
+        return
+
+    def timed_save_attachment(attachment, filepath):
+        started_at = time.monotonic()
+        bytes_written = save_attachment(attachment, filepath, downloaded_attachment_location_map)
+
+        return bytes_written, time.monotonic() - started_at
+
+    attachments_saved = 0
+    total_bytes_written = 0
+    started_at = time.monotonic()
+
+    futures_to_filepaths = {
+        submit_io(timed_save_attachment, attachment, filepath): filepath
+        for attachment, filepath in attachments_and_filepaths
+    }
+
+    try:
+        for future in concurrent.futures.as_completed(futures_to_filepaths):
+            filepath = futures_to_filepaths[future]
+
+            try:
+                bytes_written, seconds_taken = future.result()
+            except get_attachment_save_errors() as e:
+                print(f'Could not save "{filepath}": {e}')
+                continue
+
+            attachments_saved += 1
+            total_bytes_written += bytes_written
+            total_seconds_taken = max(time.monotonic() - started_at, 0.001)
+
+            print(f'Saved "{filepath}" ({bytes_written / 1024 / 1024:.1f} MB at {bytes_written / 1024 / 1024 / max(seconds_taken, 0.001):.1f} MB/sec)')
+            print(f'{attachments_saved} of {len(attachments_and_filepaths)} attachments saved ({total_bytes_written / 1024 / 1024:.1f} MB at {total_bytes_written / 1024 / 1024 / total_seconds_taken:.1f} MB/sec)')
+    except BaseException:
+        cancel_io(futures_to_filepaths)
+        raise
+
+def read_new_messages() -> None:
+    """
+        Read messages that have not been read yet.
+    """
+   
+    message_ids_encountered = set()
+
+    while True:
+        if USE_INCREMENTAL_SYNC:
+            sync_unread_messages(get_gmail_client())
+            messages = get_unread_messages_from_cache(get_gmail_client(), message_ids_encountered, limit=MAXIMUM_RETURNED_EMAILS_FROM_SEARCH)
+        else:
+            messages = get_cached_messages(get_gmail_client(), seen=False, limit=MAXIMUM_RETURNED_EMAILS_FROM_SEARCH)
+
+        message_ids_encountered_this_batch = read_emails(messages, message_ids_encountered)
+
+        if not message_ids_encountered_this_batch:
+            return
+
+        message_ids_encountered = message_ids_encountered.union(set(message_ids_encountered_this_batch))
+
+def empty_trash() -> None:
+    """
+        Deletes all messages from the trash
+    """
+   
+    # list every id before deleting anything so deletions can not shift the pages of the listing
+    trash_gmail_ids = []
+
+    for page in list_message_ids(get_gmail_client(), google_workspace.gmail.utils.gmail_query_maker(label_name='trash'), include_spam_and_trash=True):
+        trash_gmail_ids += page
+
+    run_bulk_operation(trash_gmail_ids, functools.partial(delete_messages, get_gmail_client()), 'deleted')
+
+    print('trash emptied')
+
+def submit_label_change(modify: Callable, description: str) -> None:
+    """
+        Changes the labels of a message in the background, so the next prompt does not wait for GMail.
+        The local cache is updated once GMail answers.
+    """
+
+    def finish_label_change(future):
+        if future.cancelled():
+            return
+
+        try:
+            modify_response = future.result()
+
+            # changing the labels of a thread returns every message in it
+            for message_modify_response in (modify_response or {}).get('messages', [modify_response]):
+                update_cached_label_ids(message_modify_response)
+        except Exception as e:
+            print(f'Could not {description}: {e}')
+
+    submit_io(modify).add_done_callback(finish_label_change)
+
+def mark_read(message: google_workspace.gmail.message.Message) -> None:
+    """
+        Marks message as read if it is currently marked as unread.
+        The labels of messages are refreshed before they are shown, so they are not stale.
     """
     
     if not message.is_seen:
-        message.mark_read()
+        submit_label_change(message.mark_read, 'mark the email as read')
         
 def mark_unread(message: google_workspace.gmail.message.Message) -> None:
     """
@@ -799,35 +4244,242 @@ def mark_unread(message: google_workspace.gmail.message.Message) -> None:
     """
     
     if message.is_seen:
-        message.mark_unread()
+        submit_label_change(message.mark_unread, 'mark the email as unread')
         
 def mark_as_spam(message: google_workspace.gmail.message.Message) -> None:
     if 'SPAM' not in message.label_ids:
-        message.add_labels('spam')
+        submit_label_change(functools.partial(message.add_labels, 'spam'), 'mark the email as spam')
         
 def mark_as_not_spam(message: google_workspace.gmail.message.Message) -> None:
     if 'SPAM' in message.label_ids:
-        message.remove_labels('spam')
+        submit_label_change(functools.partial(message.remove_labels, 'spam'), 'mark the email as not spam')
 
-def delete_messages(messages, message_ids_encountered: Iterable = tuple()) -> list:
+def mark_thread_read(thread_messages: list) -> None:
     """
-        Deletes all messages passed to it
+        Marks every message in a conversation as read with one request, if any of them is unread.
     """
 
-    message_ids_processed = []
+    if all(message.is_seen for message in thread_messages):
+        return
 
-    for message in messages:
-        message_gmail_id = message.gmail_id
+    message = thread_messages[-1]
+    submit_label_change(functools.partial(message.gmail_client.remove_labels_from_thread, message.thread_id, 'unread'), 'mark the conversation as read')
 
-        if message_gmail_id in message_ids_encountered:
-            continue
+def mark_thread_unread(thread_messages: list) -> None:
+    """
+        Marks every message in a conversation as unread with one request, if any of them is read.
+    """
 
-        message.delete()
+    if not any(message.is_seen for message in thread_messages):
+        return
 
-        message_ids_processed.append(message_gmail_id)
+    message = thread_messages[-1]
+    submit_label_change(functools.partial(message.gmail_client.add_labels_to_thread, message.thread_id, 'unread'), 'mark the conversation as unread')
 
-    return message_ids_processed
+def mark_thread_as_spam(thread_messages: list) -> None:
+    if all('SPAM' in message.label_ids for message in thread_messages):
+        return
+
+    message = thread_messages[-1]
+    submit_label_change(functools.partial(message.gmail_client.add_labels_to_thread, message.thread_id, 'spam'), 'mark the conversation as spam')
+
+def mark_thread_as_not_spam(thread_messages: list) -> None:
+    if not any('SPAM' in message.label_ids for message in thread_messages):
+        return
+
+    message = thread_messages[-1]
+    submit_label_change(functools.partial(message.gmail_client.remove_labels_from_thread, message.thread_id, 'spam'), 'mark the conversation as not spam')
+
+def print_email_header(message) -> None:
+    print(message.date.strftime('%x %-H:%-M UTC'))
+    print(f'From: {message.from_}')
+    print(f"To: {', '.join(message.to)}")
+    print(f"CC: {', '.join(message.cc)}")
+    print(f"BCC: {', '.join(message.bcc)}")
+    print(f'Subject: {message.subject}\n')
+
+def print_email(message, shown_text_hashes: Optional[set] = None) -> None:
+    """
+        Prints the content of an email and lets the user download and print its attachments.
+        With shown_text_hashes, quoted history that was already shown is collapsed, and the text printed is added to it.
+    """
+
+    downloaded_attachment_location_map = {}
+
+    if message.html:
+        display_html_email(message, downloaded_attachment_location_map, shown_text_hashes)
+    else:
+        # get email text
+        message_text = message.text
+
+        if shown_text_hashes is not None:
+            message_text = collapse_shown_quoted_text(message_text, shown_text_hashes)
+
+        # long emails, like reply chains, are shown one screen at a time
+        if len(message_text) >= LONG_PRINTED_STRING_MINIMUM_LENGTH:
+            page_text(message_text, 'Email')
+
+            # the pager only shows text, so the inline images are shown after it, once each in the order of their tags
+            inline_images = dict.fromkeys(
+                (attachment_identifier, use_cid)
+                for _, attachment_identifier, use_cid in iter_text_and_inline_images(message_text)
+                if attachment_identifier is not None
+            )
+
+            if inline_images:
+                print('\n---- Inline images ----')
+
+            for attachment_identifier, use_cid in inline_images:
+                print(f'\n[cid:{attachment_identifier}]' if use_cid else f'\n[image: {attachment_identifier}]')
+
+                temp_filename, is_image = display_inline_image(attachment_identifier, message, use_cid=use_cid)
+
+                if temp_filename:
+                    downloaded_attachment_location_map[attachment_identifier] = temp_filename
+        else:
+            # print the email to the terminal, with the inline images where their tags are
+            for text, attachment_identifier, use_cid in iter_text_and_inline_images(message_text):
+                if text:
+                    for line in text.split('\n'):
+                        print(line)
+
+                if attachment_identifier is None:
+                    continue
+
+                temp_filename, is_image = display_inline_image(attachment_identifier, message, use_cid=use_cid)
+
+                if temp_filename:
+                    downloaded_attachment_location_map[attachment_identifier] = temp_filename
+            
+    # react to email attachments
+    if len(message.attachments):
+        print('\n---- Attachments ----')
+
+        # choose every download first so they can be saved at the same time
+        should_download_up_front = DOWNLOAD_ATTACHMENTS_IN_PARALLEL and len(message.attachments) > 1
 
+        if should_download_up_front:
+            attachments_and_filepaths = []
+
+            for index, attachment in enumerate(message.attachments):
+                requested_filepath = ask_where_to_download_attachment(attachment, index)
+
+                if requested_filepath:
+                    attachments_and_filepaths.append((attachment, requested_filepath))
+
+            save_attachments_in_parallel(attachments_and_filepaths, downloaded_attachment_location_map)
+
+        for index, attachment in enumerate(message.attachments):
+            filename = attachment.filename
+            
+            one_index = index + 1
+
+            # download attachment
+            if not should_download_up_front:
+                requested_filepath = ask_where_to_download_attachment(attachment, index)
+
+                if requested_filepath:
+                    try:
+                        save_attachment(attachment, requested_filepath, downloaded_attachment_location_map)
+                    except get_attachment_save_errors() as e:
+                        print(f'Could not save "{requested_filepath}": {e}')
+
+            attachment_is_image = is_attachment_an_image(attachment)
+
+            if is_attachment_binary(attachment) and not attachment_is_image:
+                print(f'\nCan\'t print attachment #{one_index} with filename "{filename}" because it is a binary file')
+                continue
+                
+            should_display = ask_for_user_input(f'\nDo you want to (P)rint or (S)kip attachment #{one_index} with filename "{filename}"', ('P', 'S'))
+                
+            # print attachment
+            if should_display == 'P':
+                if attachment_is_image:
+                    downloaded_attachment_location_map[filename], _ = display_attachment(attachment, downloaded_attachment_location_map)
+                else:
+                    # only printed attachments are read into memory as a whole
+                    with open(cache_attachment(attachment), 'rb') as f:
+                        attachment_content = f.read().decode('utf8')
+
+                    print(f'\n--- Printing Attachment #{one_index} with filename "{filename}" ---\n')
+
+                    if len(attachment_content) >= LONG_PRINTED_STRING_MINIMUM_LENGTH:
+                        page_text(attachment_content, f'Attachment #{one_index}')
+                    else:
+                        for line in attachment_content.split('\n'):
+                            print(line)
+
+def reply_to_email(message) -> None:
+    """
+        Lets the user choose the recipients of a reply to an email, write it, and add attachments, then adds it to the outbox.
+    """
+
+    possible_recipients = list(dict.fromkeys(
+        [message.from_]
+        + message.to
+        + message.cc
+        + message.bcc
+    ))
+
+    actual_recipients = []
+    actual_cc = []
+    actual_bcc = []
+
+    # choose which emails to reply to
+    for possible_recipient in possible_recipients:
+        user_input_validated = None
+
+        user_input_validated = ask_for_user_input(
+            f'For {possible_recipient}: R(e)ply to, (C)c, (B)cc, (S)kip',
+            ('E', 'C', 'B', 'S')
+        )
+
+        if user_input_validated == 'E':
+            actual_recipients.append(possible_recipient)
+        elif user_input_validated == 'C':
+            actual_cc.append(possible_recipient)
+        elif user_input_validated == 'B':
+            actual_bcc.append(possible_recipient)
+            
+    # ask if the user wants to add any recipients who weren't on the original email
+    gather_to_cc_bcc_email_recipients(
+        actual_recipients,
+        actual_cc,
+        actual_bcc,
+        True
+    )
+     
+    # make sure there is at least one recipient
+    while not (actual_recipients or actual_cc or actual_bcc):
+        gather_to_cc_bcc_email_recipients(
+            actual_recipients,
+            actual_cc,
+            actual_bcc,
+            True
+        )
+        
+    # write reply email body
+    reply_body = ask_for_non_blank_user_input('Type your reply:', True)
+
+    # add thread history to reply_body
+    reply_body, _ = google_workspace.gmail.utils.create_replied_message(message, reply_body, None)
+
+    # add attachments to reply email
+    attachments = add_attachments()            
+
+    # send reply email in the background
+    queue_email(
+        compose_email(
+            to=actual_recipients,
+            cc=actual_cc,
+            bcc=actual_bcc,
+            subject=f"Re: {message.subject}",
+            text=reply_body,
+            in_reply_to=message.message_id,
+        ),
+        attachments,
+        thread_id=message.thread_id,
+    )
 
 def read_messages(messages, message_ids_encountered: Iterable = tuple()) -> list:
     """
@@ -836,7 +4488,10 @@ def read_messages(messages, message_ids_encountered: Iterable = tuple()) -> list
 
     message_ids_processed = []
 
-    for message in messages:
+    # quoted history is collapsed when it was shown by an email printed before
+    shown_text_hashes = set() if COLLAPSE_SHOWN_QUOTED_HISTORY else None
+
+    for message in read_ahead(messages):
         message_gmail_id = message.gmail_id
 
         if message_gmail_id in message_ids_encountered:
@@ -847,12 +4502,7 @@ def read_messages(messages, message_ids_encountered: Iterable = tuple()) -> list
         # print email header
         
         print(print_line_seperator)
-        print(message.date.strftime('%x %-H:%-M UTC'))
-        print(f'From: {message.from_}')
-        print(f"To: {', '.join(message.to)}")
-        print(f"CC: {', '.join(message.cc)}")
-        print(f"BCC: {', '.join(message.bcc)}")
-        print(f'Subject: {message.subject}\n') 
+        print_email_header(message)
 
         # ask user how to react to email
         user_input_validated = ask_for_user_input(
@@ -860,123 +4510,11 @@ def read_messages(messages, message_ids_encountered: Iterable = tuple()) -> list
             ('P', 'R', 'U', 'M', 'N', 'S')
         )
 
-        downloaded_attachment_location_map = {}
-
         # read the email
         if user_input_validated == 'P':
             print(print_line_seperator)
             
-            if message.html:
-                display_html_email(message, downloaded_attachment_location_map)
-            else:
-                # get email text
-                message_text = message.text
-                
-                message_length = len(message_text)
-                
-                # if email is long, ask user how many characters they want to see
-                if message_length >= LONG_PRINTED_STRING_MINIMUM_LENGTH:
-                    length_to_print = ask_for_integer_input(
-                        f'This message is long at {message_length} characters. It might be a long reply chain. How many characters do you want to see (taken from the beginning)? Press enter to see them all.',
-                        message_length
-                    )
-                else:
-                    length_to_print = message_length
-
-                # print the email to the terminal
-                text_to_print = make_sure_images_are_on_seperate_lines(message_text[:length_to_print])
-
-                for line in text_to_print.split('\n'):
-                    if inline_image_regex_gmail.findall(line):
-                        if 'cid:' in line:
-                            # [image: cid:FILENAME@hash]
-                        
-                            last_at_sign = line.rfind('@')
-                            attachment_filename = line[12: last_at_sign]
-                        else:
-                            # [image: FILENAME]
-                            attachment_filename = line[8:-1]
-                            
-                        temp_filename, is_image = display_inline_image(attachment_filename, message.attachments)
-                        
-                        if temp_filename:
-                            downloaded_attachment_location_map[attachment_filename] = temp_filename
-                            
-                    elif inline_image_regex_outlook.findall(line):
-                        # [cid:FILENAME]
-                        attachment_filename = line[5:-1]
-                        temp_filename, is_image = display_inline_image(attachment_filename, message.attachments, use_cid=True)
-                        
-                        if temp_filename:
-                            downloaded_attachment_location_map[attachment_filename] = temp_filename
-                    else:
-                        print(line)
-                    
-            # react to email attachments
-            if len(message.attachments):
-                print('\n---- Attachments ----')
-                
-                files_to_keep = []
-
-                for index, attachment in enumerate(message.attachments):
-                    content = attachment.payload
-                    filename = attachment.filename
-                    
-                    one_index = index + 1
-                    
-                    should_download = ask_for_user_input(f'\nDo you want to (D)ownload or (S)kip attachment #{one_index} with filename "{filename}"', ('D', 'S'))
-
-                    default_download_location = filename if filename else f'attachment-{index}'
-                    
-                    # download attachment
-                    if should_download == 'D':
-                        requested_filepath = get_valid_filepath(f'\nPlease enter the path you want to download this file to. Press Enter for {default_download_location}')
-
-                        requested_filepath = requested_filepath if requested_filepath else default_download_location
-
-                        if filename in downloaded_attachment_location_map:
-                            original_file_location = downloaded_attachment_location_map[filename]
-                            shutil.move(original_file_location, requested_filepath)
-                            downloaded_attachment_location_map[filename] = requested_filepath
-                        else:
-                            attachment.download(requested_filepath)
-                            
-                        files_to_keep.append(requested_filepath)
-
-                    attachment_is_image = is_attachment_an_image(attachment)
-
-                    if is_binary_string(content) and not attachment_is_image:
-                        print(f'\nCan\'t print attachment #{one_index} with filename "{filename}" because it is a binary file')
-                        continue
-                        
-                    should_display = ask_for_user_input(f'\nDo you want to (P)rint or (S)kip attachment #{one_index} with filename "{filename}"', ('P', 'S'))
-                        
-                    # print attachment
-                    if should_display == 'P':
-                        if attachment_is_image:
-                            downloaded_attachment_location_map[filename], _ = display_attachment(attachment, downloaded_attachment_location_map)
-                        else:
-                            attachment_content = content.decode('utf8')
-
-                            attachment_length = len(attachment_content)
-
-                            if attachment_length >= LONG_PRINTED_STRING_MINIMUM_LENGTH:
-                                length_to_print = ask_for_integer_input(
-                                    f'This attachment is long at {attachment_length} characters. It might be a long reply chain. How many characters do you want to see (taken from the beginning)? Press enter to see them all.',
-                                    attachment_length
-                                )
-                            else:
-                                length_to_print = attachment_length
-
-                            print(f'\n--- Printing Attachment #{one_index} with filename "{filename}" ---\n')
-
-                            for line in attachment_content[:length_to_print].split('\n'):
-                                print(line)
-                                
-                # cllean up attachment temp files
-                for filepath in downloaded_attachment_location_map.values():
-                    if filepath not in files_to_keep:
-                        os.remove(filepath)
+            print_email(message, shown_text_hashes)
 
         # mark the email as read
         elif user_input_validated == 'R':
@@ -1030,76 +4568,140 @@ def read_messages(messages, message_ids_encountered: Iterable = tuple()) -> list
 
         # reply to email
         elif user_input_validated == 'E':
-            possible_recipients = list(dict.fromkeys(
-                [message.from_]
-                + message.to
-                + message.cc
-                + message.bcc
-            ))
-
-            actual_recipients = []
-            actual_cc = []
-            actual_bcc = []
-
-            # choose which emails to reply to
-            for possible_recipient in possible_recipients:
-                user_input_validated = None
-
-                user_input_validated = ask_for_user_input(
-                    f'For {possible_recipient}: R(e)ply to, (C)c, (B)cc, (S)kip',
-                    ('E', 'C', 'B', 'S')
-                )
+            reply_to_email(message)
 
-                if user_input_validated == 'E':
-                    actual_recipients.append(possible_recipient)
-                elif user_input_validated == 'C':
-                    actual_cc.append(possible_recipient)
-                elif user_input_validated == 'B':
-                    actual_bcc.append(possible_recipient)
-                    
-            # ask if the user wants to add any recipients who weren't on the original email
-            gather_to_cc_bcc_email_recipients(
-                actual_recipients,
-                actual_cc,
-                actual_bcc,
-                True
-            )
-             
-            # make sure there is at least one recipient
-            while not (actual_recipients or actual_cc or actual_bcc):
-                gather_to_cc_bcc_email_recipients(
-                    actual_recipients,
-                    actual_cc,
-                    actual_bcc,
-                    True
-                )
-                
-            # write reply email body
-            reply_body = ask_for_non_blank_user_input('Type your reply:', True)
-
-            # add thread history to reply_body
-            reply_body, _ = google_workspace.gmail.utils.create_replied_message(message, reply_body, None)
-
-            # add attachments to reply email
-            attachments = add_attachments()            
-
-            # send reply email
-            gmail_client.send_message(
-                to=actual_recipients,
-                cc=actual_cc,
-                bcc=actual_bcc,
-                subject=f"Re: {message.subject}",
-                text=reply_body,
-                in_reply_to=message.message_id,
-                thread_id=message.thread_id,
-                attachments=attachments,
-            )             
-   
             # mark email as read after you reply to it
             mark_read(message)
     
     return message_ids_processed
 
+def read_conversation(thread_messages: list) -> None:
+    """
+        Lists the emails in a conversation and allows the user to read them oldest first, mark the whole conversation, and reply to the newest email.
+    """
+
+    print(print_line_seperator)
+    print(f'Subject: {thread_messages[0].subject}')
+    print(f'{len(thread_messages)} emails in this conversation:')
+
+    for message in thread_messages:
+        print(f"  {message.date.strftime('%x %-H:%-M UTC')}  {message.from_}{'' if message.is_seen else '  (unread)'}")
+
+    # ask user how to react to the conversation
+    user_input_validated = ask_for_user_input(
+        '(P)rint, Mark (R)ead, (U)nread, Spa(m), or (N)ot Spam, (S)kip:',
+        ('P', 'R', 'U', 'M', 'N', 'S')
+    )
+
+    # read the conversation, the history quoted in replies is usually shown by the emails before them
+    if user_input_validated == 'P':
+        shown_text_hashes = set() if COLLAPSE_SHOWN_QUOTED_HISTORY else None
+
+        # fetch_threads already downloaded every email of the conversation
+        for message in thread_messages:
+            print(print_line_seperator)
+            print_email_header(message)
+            print_email(message, shown_text_hashes)
+
+    # mark the conversation as read
+    elif user_input_validated == 'R':
+        mark_thread_read(thread_messages)
+        return
+
+    # mark the conversation as unread
+    elif user_input_validated == 'U':
+        mark_thread_unread(thread_messages)
+        return
+
+    # mark the conversation as spam
+    elif user_input_validated == 'M':
+        mark_thread_as_spam(thread_messages)
+        return
+
+    # mark the conversation as not spam
+    elif user_input_validated == 'N':
+        mark_thread_as_not_spam(thread_messages)
+        return
+
+    # skip the conversation
+    elif user_input_validated == 'S':
+        return
+
+    # react to the conversation after reading it
+
+    print('------------------------------------------------------------\n')
+
+    user_input_validated = ask_for_user_input(
+        'Mark (R)ead or (U)nread, Spa(m) or (N)ot Spam, R(e)ply, (S)kip:',
+        ('R', 'U', 'M', 'N', 'E', 'S')
+    )
+
+    if user_input_validated == 'R':
+        mark_thread_read(thread_messages)
+
+    elif user_input_validated == 'U':
+        mark_thread_unread(thread_messages)
+
+    elif user_input_validated == 'M':
+        mark_thread_as_spam(thread_messages)
+
+    elif user_input_validated == 'N':
+        mark_thread_as_not_spam(thread_messages)
+
+    # reply to the newest email, and mark the conversation as read after you reply to it
+    elif user_input_validated == 'E':
+        reply_to_email(thread_messages[-1])
+        mark_thread_read(thread_messages)
+
+def read_conversations(messages, message_ids_encountered: Iterable = tuple()) -> list:
+    """
+        Groups messages into conversations by thread, and allows the user to read and mark a whole conversation at a time.
+        The conversations on a page of MESSAGE_BATCH_SIZE messages are downloaded whole with one batch request.
+    """
+
+    message_ids_processed = []
+    thread_ids_shown = set()
+    messages = iter(messages)
+
+    while page := list(itertools.islice(messages, MESSAGE_BATCH_SIZE)):
+        page = [message for message in page if message.gmail_id not in message_ids_encountered]
+        thread_ids = list(dict.fromkeys(message.thread_id for message in page if message.thread_id not in thread_ids_shown))
+
+        if not thread_ids:
+            continue
+
+        client = page[0].gmail_client
+        threads = fetch_threads(client, thread_ids)
+        gmail_ids_listed = {message.gmail_id for message in page}
+
+        for thread_id in thread_ids:
+            # like in GMail, deleted and spam emails are left out of a conversation unless they were searched for
+            thread_messages = [
+                message
+                for message in threads.get(thread_id, [])
+                if message.gmail_id in gmail_ids_listed or not {'TRASH', 'SPAM'} & set(message.label_ids)
+            ]
+
+            if not thread_messages:
+                continue
+
+            thread_ids_shown.add(thread_id)
+            message_ids_processed += [message.gmail_id for message in thread_messages]
+
+            read_conversation(thread_messages)
+
+    return message_ids_processed
+
+def read_emails(messages, message_ids_encountered: Iterable = tuple()) -> list:
+    """
+        Reads messages a conversation at a time if SHOW_EMAILS_AS_CONVERSATIONS is set, otherwise one at a time.
+    """
+
+    if SHOW_EMAILS_AS_CONVERSATIONS:
+        return read_conversations(messages, message_ids_encountered)
+
+    return read_messages(messages, message_ids_encountered)
+
 def write_email() -> None:
     """
         Allow the user to write an email.
@@ -1128,19 +4730,21 @@ def write_email() -> None:
     # get attachments for email from user
     attachments = add_attachments()
 
-    # send email (new thread, not a reply)
-    gmail_client.send_message(
-        to=actual_recipients,
-        cc=actual_cc,
-        bcc=actual_bcc,
-        subject=subject,
-        text=body,
-        attachments=attachments,
+    # send email in the background (new thread, not a reply)
+    queue_email(
+        compose_email(
+            to=actual_recipients,
+            cc=actual_cc,
+            bcc=actual_bcc,
+            subject=subject,
+            text=body,
+        ),
+        attachments
     )
     
-def search_for_emails() -> None:
+def ask_for_search_criteria() -> dict:
     """
-        Searches for messages based on user criteria.
+        Asks the user what to search for and returns the answers as keyword arguments for get_cached_messages.
     """
     
     from_ = accept_any_input_blank_is_none('From:')
@@ -1166,27 +4770,123 @@ def search_for_emails() -> None:
     label_name = accept_any_input_blank_is_none('Label name:')
     
     include_spam_and_trash = True if ask_for_user_input('Include spam and trash (Y or N)', ('Y', 'N')) == 'Y' else False
+
+    return {
+        'seen': seen,
+        'from_': from_,
+        'to': to,
+        'subject': subject,
+        'after': after,
+        'before': before,
+        'label_name': label_name,
+        'include_spam_and_trash': include_spam_and_trash,
+    }
+
+def search_for_emails() -> None:
+    """
+        Searches for messages based on user criteria.
+    """
+
+    search_criteria = ask_for_search_criteria()
     
     limit = ask_for_integer_input(
-        'Maximum returned emails?', 
-        maximum=MAXIMUM_RETURNED_EMAILS_FROM_SEARCH,
+        'Maximum returned emails? Press Enter for no limit.', 
+        maximum=None,
         minimum=1, 
         maximum_on_blank=True
     )
-     
-    messages = gmail_client.get_messages(
-        seen=seen, 
-        from_=from_, 
-        to=to, 
-        subject=subject, 
-        after=after, 
-        before=before, 
-        label_name=label_name, 
-        include_spam_and_trash=include_spam_and_trash, 
-        limit=limit
+
+    # pages of results are downloaded as the user reads through them
+    messages = get_cached_messages(
+        get_gmail_client(),
+        limit=limit,
+        **search_criteria
+    )
+
+    return read_emails(messages)
+
+def search_local_emails() -> None:
+    """
+        Searches the headers and text of the emails in the local cache, including emails that were read before.
+    """
+
+    if not is_search_index_available:
+        print('Searching locally needs SQLite with FTS5 support')
+        return
+
+    query = ask_for_non_blank_user_input('Search for:')
+
+    started_at = time.monotonic()
+    results = search_local_index(query)
+    search_milliseconds = (time.monotonic() - started_at) * 1000
+
+    print(f'{len(results)} results in {search_milliseconds:.1f} ms')
+
+    if not results:
+        return
+
+    for index, (gmail_id, sender, subject, snippet) in enumerate(results):
+        snippet = ' '.join(snippet.split())
+
+        print(f'\n#{index + 1} From: {sender}\nSubject: {subject}\n{snippet}')
+
+    if ask_for_user_input('\nDo you want to read these emails? (Y or N)', ('Y', 'N')) == 'Y':
+        read_emails(get_messages_by_id(get_gmail_client(), [result[0] for result in results]))
+
+def bulk_mark_emails() -> None:
+    """
+        Marks every message matching the user's search criteria as read, unread, spam, or not spam without reading them one by one.
+    """
+
+    search_criteria = ask_for_search_criteria()
+
+    # a search without any criteria matches the whole mailbox
+    if all(search_criteria[name] is None for name in ('seen', 'from_', 'to', 'subject', 'after', 'before', 'label_name')):
+        if ask_for_user_input('No search criteria were given, so every email in your mailbox will match. Continue anyway? (Y or N)', ('Y', 'N')) == 'N':
+            return
+
+    add_label_ids, remove_label_ids, seen = map_user_input(
+        'Mark all matching emails (R)ead, (U)nread, Spa(m), or (N)ot Spam?',
+
+        {
+            'R': ([], ['UNREAD'], False),
+            'U': (['UNREAD'], [], True),
+            'M': (['SPAM'], [], None),
+            'N': ([], ['SPAM'], None),
+        }
+    )
+
+    # skip messages that already have the requested seen state, unless the user asked for something else
+    if search_criteria['seen'] is None:
+        search_criteria['seen'] = seen
+
+    query = google_workspace.gmail.utils.gmail_query_maker(
+        search_criteria['seen'],
+        search_criteria['from_'],
+        search_criteria['to'],
+        search_criteria['subject'],
+        search_criteria['after'],
+        search_criteria['before'],
+        search_criteria['label_name']
     )
 
-    return read_messages(messages)
+    matching_gmail_ids = []
+
+    for page in list_message_ids(get_gmail_client(), query, include_spam_and_trash=search_criteria['include_spam_and_trash']):
+        matching_gmail_ids += page
+
+    if not matching_gmail_ids:
+        print('No emails match your search')
+        return
+
+    if ask_for_user_input(f'{len(matching_gmail_ids)} emails match your search. Do you want to mark them all? (Y or N)', ('Y', 'N')) == 'N':
+        return
+
+    run_bulk_operation(
+        matching_gmail_ids,
+        functools.partial(modify_messages, get_gmail_client(), add_label_ids, remove_label_ids),
+        'marked'
+    )
 
 ##############################################################################################################################################
 
@@ -1194,25 +4894,58 @@ def search_for_emails() -> None:
 
 if __name__ == "__main__":
 
-    # ask user what action they want to take
-    operation = ask_for_user_input(
-        '\nDo you want to:\n (R)ead your new emails\n (S)earch for emails\n (W)rite an email?\n or (E)mpty trash?\n',
-        ('R', 'S', 'W', 'E')
-    )
+    try:
+        # the first sign in happens in the browser, so it is done before the menu is shown
+        if is_gmail_session_saved():
+            start_connecting()
+        else:
+            get_gmail_client()
 
-    # read emails
-    if operation == 'R':
-        read_new_messages()
-        
-    # search emails
-    if operation == 'S':
-        search_for_emails()
+        record_startup_timing('get to the menu', startup_started_at)
+
+        if '--profile-startup' in sys.argv:
+            print_startup_profile()
+            sys.exit()
+
+        # send emails that were left in the outbox the last time
+        clean_outbox()
+        drain_outbox()
+
+        # ask user what action they want to take
+        operation = ask_for_user_input(
+            '\nDo you want to:\n (R)ead your new emails\n (S)earch for emails\n Search emails (L)ocally\n (B)ulk mark emails from a search\n (W)rite an email?\n (O)pen the outbox\n or (E)mpty trash?\n',
+            ('R', 'S', 'L', 'B', 'W', 'O', 'E')
+        )
+
+        # read emails
+        if operation == 'R':
+            read_new_messages()
         
-    # write email
-    elif operation == 'W':
-        write_email()
+        # search emails
+        if operation == 'S':
+            search_for_emails()
 
-    # empty trash
-    elif operation == 'E':
-        empty_trash()
+        # search emails in the local cache
+        elif operation == 'L':
+            search_local_emails()
 
+        # mark all emails from a search
+        elif operation == 'B':
+            bulk_mark_emails()
+        
+        # write email
+        elif operation == 'W':
+            write_email()
+
+        # see the emails waiting to be sent
+        elif operation == 'O':
+            show_outbox()
+
+        # empty trash
+        elif operation == 'E':
+            empty_trash()
+    finally:
+        # let operations still running in the background, like marking emails as read or sending emails, finish
+        shutdown_io()
+        print_outbox_summary()
+        exit_abandoning_io()
@@ -0,0 +1,331 @@
+"""
+    Tests that reopened attachments come from the attachment cache, and that the cache is only measured when it has to be.
+"""
+
+import base64
+import email.message
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import types
+import unittest
+from unittest import mock
+
+import google.auth.credentials
+import google.auth.exceptions
+import googleapiclient.errors
+import httplib2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+def make_message_data(gmail_id: str, attachment: bytes) -> dict:
+    message = email.message.EmailMessage()
+    message['From'] = 'sender@example.com'
+    message['Subject'] = 'An attachment'
+    message.set_content('See the attachment')
+    message.add_attachment(attachment, maintype='application', subtype='octet-stream', filename='data.bin')
+
+    return {
+        'id': gmail_id,
+        'threadId': gmail_id,
+        'labelIds': ['INBOX'],
+        'raw': base64.urlsafe_b64encode(message.as_bytes()).decode(),
+    }
+
+def encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode()
+
+def make_full_format_message_data(gmail_id: str, attachments: dict) -> dict:
+    """
+        Makes a message in the "full" format, with the bodies of its attachments left out like GMail does.
+    """
+
+    return {
+        'id': gmail_id,
+        'threadId': gmail_id,
+        'labelIds': ['INBOX'],
+        'payload': {
+            'mimeType': 'multipart/mixed',
+            'headers': [
+                {'name': 'From', 'value': 'sender@example.com'},
+                {'name': 'Subject', 'value': 'Attachments'},
+                {'name': 'Content-Type', 'value': 'multipart/mixed; boundary="outer"'},
+            ],
+            'parts': [
+                {
+                    'mimeType': 'multipart/alternative',
+                    'headers': [{'name': 'Content-Type', 'value': 'multipart/alternative; boundary="inner"'}],
+                    'parts': [
+                        {
+                            'mimeType': 'text/plain',
+                            'headers': [{'name': 'Content-Type', 'value': 'text/plain; charset="UTF-8"'}],
+                            'body': {'data': encode('Hello ☃'.encode('utf8'))},
+                        },
+                        {
+                            'mimeType': 'text/html',
+                            'headers': [{'name': 'Content-Type', 'value': 'text/html; charset="UTF-8"'}],
+                            'body': {'data': encode(b'<p>Hello</p>')},
+                        },
+                    ],
+                },
+            ] + [
+                {
+                    'mimeType': content_type,
+                    'filename': filename,
+                    'headers': [
+                        {'name': 'Content-Type', 'value': f'{content_type}; name="{filename}"'},
+                        {'name': 'Content-Disposition', 'value': f'attachment; filename="{filename}"'},
+                        {'name': 'Content-Transfer-Encoding', 'value': 'base64'},
+                    ],
+                    'body': {'attachmentId': f'attachment-{filename}', 'size': len(payload)},
+                }
+                for filename, (content_type, payload) in attachments.items()
+            ],
+        },
+    }
+
+class AttachmentHandler(http.server.BaseHTTPRequestHandler):
+    """
+        Answers attachments.get like GMail, in JSON with the attachment in URL safe base64.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        attachment_id = self.path.split('?')[0].rsplit('/', 1)[-1]
+        self.server.service.attachments_downloaded.append(attachment_id)
+
+        if attachment_id in self.server.service.failing_attachment_ids:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = json.dumps({'size': 0, 'data': self.server.service.attachments_data[attachment_id]}, indent=2).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class FakeGmailService:
+    """
+        Answers messages.get and attachments.get for one message in the "full" format, counting the attachments downloaded.
+        Attachments are downloaded from a local HTTP server, since they are streamed instead of being executed like other requests.
+    """
+
+    def __init__(self, message_data: dict, attachments: dict):
+        self.message_data = message_data
+        self.attachments_data = {f'attachment-{filename}': encode(payload) for filename, (_, payload) in attachments.items()}
+        self.attachments_downloaded = []
+        self.failing_attachment_ids = set()
+        self.attachment_errors = {}
+
+        self.credentials = google.auth.credentials.AnonymousCredentials()
+        self.messages_service = types.SimpleNamespace(get=self.get_message)
+        self.attachments_service = types.SimpleNamespace(get=self.get_attachment)
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), AttachmentHandler)
+        self.server.service = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_message(self, userId, id, format):
+        return types.SimpleNamespace(execute=lambda: dict(self.message_data))
+
+    def get_attachment(self, userId, messageId, id):
+        if id in self.attachment_errors:
+            raise self.attachment_errors[id]
+
+        def execute():
+            self.attachments_downloaded.append(id)
+            return {'data': self.attachments_data[id]}
+
+        return types.SimpleNamespace(
+            uri=f'http://127.0.0.1:{self.server.server_address[1]}/gmail/v1/users/{userId}/messages/{messageId}/attachments/{id}?alt=json',
+            execute=execute,
+        )
+
+class AttachmentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        self.original_settings = (
+            terminal_gmail_client.CACHE_DIRECTORY,
+            terminal_gmail_client.message_cache_connection,
+            terminal_gmail_client.attachment_cache_bytes,
+            terminal_gmail_client.ATTACHMENT_CACHE_MAXIMUM_BYTES,
+        )
+
+        terminal_gmail_client.CACHE_DIRECTORY = self.directory.name
+        terminal_gmail_client.message_cache_connection = None
+        terminal_gmail_client.attachment_cache_bytes = None
+
+        self.client = types.SimpleNamespace()
+
+    def tearDown(self):
+        if terminal_gmail_client.message_cache_connection:
+            terminal_gmail_client.message_cache_connection.close()
+
+        (
+            terminal_gmail_client.CACHE_DIRECTORY,
+            terminal_gmail_client.message_cache_connection,
+            terminal_gmail_client.attachment_cache_bytes,
+            terminal_gmail_client.ATTACHMENT_CACHE_MAXIMUM_BYTES,
+        ) = self.original_settings
+
+    def test_reopened_attachment_is_not_decoded_or_written_again(self):
+        payload = os.urandom(100000)
+        message_data = make_message_data('message', payload)
+
+        filepath = terminal_gmail_client.cache_attachment(terminal_gmail_client.make_full_message(self.client, message_data).attachments[0])
+
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), payload)
+
+        # opening the email again makes new attachment objects
+        reopened_attachment = terminal_gmail_client.make_full_message(self.client, message_data).attachments[0]
+
+        with mock.patch.object(terminal_gmail_client, 'iter_attachment_chunks') as iter_attachment_chunks, \
+                mock.patch.object(terminal_gmail_client.tempfile, 'mkstemp') as mkstemp:
+            self.assertEqual(terminal_gmail_client.cache_attachment(reopened_attachment), filepath)
+
+        iter_attachment_chunks.assert_not_called()
+        mkstemp.assert_not_called()
+
+    def test_evicted_attachment_is_cached_again(self):
+        message_data = make_message_data('message', b'attachment')
+
+        filepath = terminal_gmail_client.cache_attachment(terminal_gmail_client.make_full_message(self.client, message_data).attachments[0])
+        os.remove(filepath)
+
+        self.assertEqual(terminal_gmail_client.cache_attachment(terminal_gmail_client.make_full_message(self.client, message_data).attachments[0]), filepath)
+        self.assertTrue(os.path.exists(filepath))
+
+    def test_cache_is_only_measured_when_it_grows_past_the_limit(self):
+        terminal_gmail_client.ATTACHMENT_CACHE_MAXIMUM_BYTES = 10000
+
+        with mock.patch.object(terminal_gmail_client.os, 'scandir', wraps=os.scandir) as scandir:
+            for _ in range(9):
+                terminal_gmail_client.cache_payload(os.urandom(1000))
+
+            # measured once for the first write only
+            self.assertEqual(scandir.call_count, 1)
+
+            terminal_gmail_client.cache_payload(os.urandom(1000))
+            terminal_gmail_client.cache_payload(os.urandom(1000))
+
+            self.assertEqual(scandir.call_count, 2)
+
+        cached_bytes = sum(entry.stat().st_size for entry in os.scandir(terminal_gmail_client.get_attachment_cache_directory()))
+
+        self.assertLessEqual(cached_bytes, 9000)
+        self.assertEqual(terminal_gmail_client.attachment_cache_bytes, cached_bytes)
+
+    def test_attachments_are_left_out_of_the_cached_message(self):
+        attachments = {
+            'photo.png': ('image/png', os.urandom(300000)),
+            'archive.zip': ('application/zip', os.urandom(300000)),
+        }
+
+        service = FakeGmailService(make_full_format_message_data('message', attachments), attachments)
+        self.addCleanup(service.close)
+        client = types.SimpleNamespace(service=service)
+
+        message = terminal_gmail_client.get_full_message(client, 'message')
+
+        self.assertEqual(message.text, 'Hello ☃')
+        self.assertEqual(message.html, '<p>Hello</p>')
+        self.assertEqual([attachment.filename for attachment in message.attachments], ['photo.png', 'archive.zip'])
+        self.assertEqual(service.attachments_downloaded, [])
+
+        with terminal_gmail_client.message_cache_lock:
+            cached_json = terminal_gmail_client.get_message_cache().execute('SELECT message_data FROM messages').fetchone()[0]
+
+        self.assertLess(len(cached_json), 10000)
+
+        # a binary file is not downloaded just to see if it can be printed
+        self.assertTrue(terminal_gmail_client.is_attachment_binary(message.attachments[1]))
+        self.assertEqual(service.attachments_downloaded, [])
+
+        with open(terminal_gmail_client.cache_attachment(message.attachments[1]), 'rb') as f:
+            self.assertEqual(f.read(), attachments['archive.zip'][1])
+
+        # reopened from the cache without downloading anything again
+        reopened_message = terminal_gmail_client.get_full_message(client, 'message')
+        terminal_gmail_client.cache_attachment(reopened_message.attachments[1])
+
+        self.assertEqual(service.attachments_downloaded, ['attachment-archive.zip'])
+
+    def test_attachments_are_classified_without_downloading_them(self):
+        attachments = {
+            'scan.tiff': ('image/tiff', os.urandom(300000)),
+            'log.txt': ('text/plain', b'line\n' * 60000),
+            'notes.md': ('application/octet-stream', b'# notes\n'),
+            'photo.jpg': ('application/octet-stream', os.urandom(1000)),
+            'archive.zip': ('application/zip', os.urandom(1000)),
+        }
+
+        service = FakeGmailService(make_full_format_message_data('message', attachments), attachments)
+        self.addCleanup(service.close)
+        message = terminal_gmail_client.get_full_message(types.SimpleNamespace(service=service), 'message')
+        scan, log, notes, photo, archive = message.attachments
+
+        self.assertEqual(
+            [terminal_gmail_client.is_attachment_an_image(attachment) for attachment in message.attachments],
+            [True, False, False, True, False]
+        )
+        self.assertEqual(
+            [terminal_gmail_client.is_attachment_binary(attachment) for attachment in message.attachments],
+            [True, False, False, True, True]
+        )
+        self.assertEqual(service.attachments_downloaded, [])
+
+        # once it is downloaded to be shown, what it really is counts
+        terminal_gmail_client.cache_attachment(photo)
+
+        self.assertFalse(terminal_gmail_client.is_attachment_an_image(photo))
+        self.assertEqual(service.attachments_downloaded, ['attachment-photo.jpg'])
+
+    def test_failed_downloads_do_not_stop_the_other_attachments_from_being_saved(self):
+        attachments = {f'file-{index}.bin': ('application/octet-stream', os.urandom(200000)) for index in range(5)}
+
+        service = FakeGmailService(make_full_format_message_data('message', attachments), attachments)
+        self.addCleanup(service.close)
+
+        service.failing_attachment_ids.add('attachment-file-1.bin')
+        service.attachment_errors['attachment-file-2.bin'] = googleapiclient.errors.HttpError(httplib2.Response({'status': 500}), b'')
+        service.attachment_errors['attachment-file-3.bin'] = google.auth.exceptions.RefreshError('Could not sign in')
+
+        message = terminal_gmail_client.get_full_message(types.SimpleNamespace(service=service), 'message')
+        filepaths = [os.path.join(self.directory.name, attachment.filename) for attachment in message.attachments]
+
+        with mock.patch.object(terminal_gmail_client, 'print') as print_:
+            terminal_gmail_client.save_attachments_in_parallel(list(zip(message.attachments, filepaths)), {})
+
+        failures = sorted(call.args[0] for call in print_.call_args_list if call.args[0].startswith('Could not save'))
+
+        self.assertEqual(len(failures), 3)
+
+        for failure, filepath in zip(failures, filepaths[1:4]):
+            self.assertTrue(failure.startswith(f'Could not save "{filepath}"'))
+            self.assertFalse(os.path.exists(filepath))
+
+        for filepath, (_, payload) in zip(filepaths[::4], list(attachments.values())[::4]):
+            with open(filepath, 'rb') as f:
+                self.assertEqual(f.read(), payload)
+
+if __name__ == '__main__':
+    unittest.main()
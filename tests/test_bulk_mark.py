@@ -0,0 +1,66 @@
+"""
+    Tests that bulk marking asks before changing the emails that match a search.
+"""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+BLANK_SEARCH_CRITERIA = {
+    'seen': None,
+    'from_': None,
+    'to': None,
+    'subject': None,
+    'after': None,
+    'before': None,
+    'label_name': None,
+    'include_spam_and_trash': False,
+}
+
+class BulkMarkTest(unittest.TestCase):
+
+    def bulk_mark(self, search_criteria: dict, answers: list, matching_gmail_ids: list) -> tuple:
+        """
+            Runs bulk_mark_emails with the given answers to its prompts.
+            Returns the mocks for listing and marking the emails.
+        """
+
+        with mock.patch.object(terminal_gmail_client, 'ask_for_search_criteria', return_value=dict(search_criteria)), \
+                mock.patch.object(terminal_gmail_client, 'get_gmail_client'), \
+                mock.patch.object(terminal_gmail_client, 'input', side_effect=answers), \
+                mock.patch.object(terminal_gmail_client, 'list_message_ids', return_value=[matching_gmail_ids]) as list_message_ids, \
+                mock.patch.object(terminal_gmail_client, 'run_bulk_operation') as run_bulk_operation, \
+                mock.patch.object(terminal_gmail_client, 'print'):
+            terminal_gmail_client.bulk_mark_emails()
+
+        return list_message_ids, run_bulk_operation
+
+    def test_blank_search_is_refused_without_confirmation(self):
+        list_message_ids, run_bulk_operation = self.bulk_mark(BLANK_SEARCH_CRITERIA, ['N'], ['a', 'b'])
+
+        list_message_ids.assert_not_called()
+        run_bulk_operation.assert_not_called()
+
+    def test_blank_search_runs_after_confirming_twice(self):
+        list_message_ids, run_bulk_operation = self.bulk_mark(BLANK_SEARCH_CRITERIA, ['Y', 'R', 'Y'], ['a', 'b'])
+
+        self.assertEqual(run_bulk_operation.call_args[0][0], ['a', 'b'])
+
+    def test_matching_emails_are_not_marked_when_declined(self):
+        list_message_ids, run_bulk_operation = self.bulk_mark(dict(BLANK_SEARCH_CRITERIA, from_='me@example.com'), ['R', 'N'], ['a', 'b'])
+
+        list_message_ids.assert_called_once()
+        run_bulk_operation.assert_not_called()
+
+    def test_matching_emails_are_marked_when_confirmed(self):
+        list_message_ids, run_bulk_operation = self.bulk_mark(dict(BLANK_SEARCH_CRITERIA, from_='me@example.com'), ['R', 'Y'], ['a', 'b'])
+
+        self.assertEqual(run_bulk_operation.call_args[0][0], ['a', 'b'])
+
+if __name__ == '__main__':
+    unittest.main()
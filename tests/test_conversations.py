@@ -0,0 +1,122 @@
+"""
+    Tests that the emails of the conversations on a page are downloaded with one batch of thread requests and nothing else.
+"""
+
+import base64
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+def make_full_message_data(gmail_id: str, thread_id: str, label_ids: list, text: str) -> dict:
+    return {
+        'id': gmail_id,
+        'threadId': thread_id,
+        'labelIds': label_ids,
+        'internalDate': '0',
+        'payload': {
+            'mimeType': 'text/plain',
+            'headers': [
+                {'name': 'From', 'value': 'someone@example.com'},
+                {'name': 'Date', 'value': 'Mon, 01 Jan 2024 00:00:00 +0000'},
+                {'name': 'Subject', 'value': f'Subject of {thread_id}'},
+                {'name': 'Content-Type', 'value': 'text/plain; charset="utf-8"'},
+            ],
+            'body': {'data': base64.urlsafe_b64encode(text.encode()).decode('ascii')},
+        },
+    }
+
+class FakeBatch:
+    """
+        Answers every thread request added to it from the threads of the service, counting how many times it is sent.
+    """
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append(request)
+
+    def execute(self, http=None):
+        self.service.batches_sent += 1
+
+        for request in self.requests:
+            self.callback(None, {'id': request['id'], 'messages': self.service.threads[request['id']]}, None)
+
+class FakeGmailService:
+
+    def __init__(self, threads: dict):
+        self.threads = threads
+        self.batches_sent = 0
+        self.thread_requests = []
+
+        self.threads_service = types.SimpleNamespace(get=self.get_thread)
+        self.messages_service = types.SimpleNamespace(get=mock.Mock(side_effect=AssertionError('messages.get should not be called')))
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+    def get_thread(self, **kwargs) -> dict:
+        self.thread_requests.append(kwargs)
+        return kwargs
+
+class ConversationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        self.original_settings = (terminal_gmail_client.CACHE_DIRECTORY, terminal_gmail_client.message_cache_connection)
+
+        terminal_gmail_client.CACHE_DIRECTORY = self.directory.name
+        terminal_gmail_client.message_cache_connection = None
+
+    def tearDown(self):
+        if terminal_gmail_client.message_cache_connection:
+            terminal_gmail_client.message_cache_connection.close()
+
+        terminal_gmail_client.CACHE_DIRECTORY, terminal_gmail_client.message_cache_connection = self.original_settings
+
+    def test_conversations_are_read_from_one_batch_of_threads(self):
+        service = FakeGmailService({
+            'first-thread': [
+                make_full_message_data('first', 'first-thread', ['INBOX'], 'Hello'),
+                make_full_message_data('trashed', 'first-thread', ['TRASH'], 'Deleted'),
+                make_full_message_data('reply', 'first-thread', ['INBOX', 'UNREAD'], 'Hello back'),
+            ],
+            'second-thread': [
+                make_full_message_data('second', 'second-thread', ['INBOX', 'UNREAD'], 'Another conversation'),
+            ],
+        })
+
+        client = types.SimpleNamespace(service=service)
+        page = [types.SimpleNamespace(gmail_id=gmail_id, thread_id=thread_id, gmail_client=client) for gmail_id, thread_id in (('reply', 'first-thread'), ('second', 'second-thread'))]
+        texts_printed = []
+
+        with mock.patch.object(terminal_gmail_client, 'new_authorized_http'), \
+                mock.patch.object(terminal_gmail_client, 'ask_for_user_input', side_effect=['P', 'S'] * 2), \
+                mock.patch.object(terminal_gmail_client, 'print'), \
+                mock.patch.object(terminal_gmail_client, 'print_email_header'), \
+                mock.patch.object(terminal_gmail_client, 'print_email', side_effect=lambda message, shown_text_hashes: texts_printed.append(message.text.strip())):
+            message_ids_processed = terminal_gmail_client.read_conversations(page)
+
+        self.assertEqual(service.batches_sent, 1)
+        self.assertEqual([request['format'] for request in service.thread_requests], ['full', 'full'])
+        service.messages_service.get.assert_not_called()
+
+        self.assertEqual(message_ids_processed, ['first', 'reply', 'second'])
+        self.assertEqual(texts_printed, ['Hello', 'Hello back', 'Another conversation'])
+
+        # reopening the emails later does not download them again
+        self.assertEqual(set(terminal_gmail_client.get_cached_messages_data(['first', 'reply', 'second'])), {'first', 'reply', 'second'})
+
+if __name__ == '__main__':
+    unittest.main()
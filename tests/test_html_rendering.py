@@ -0,0 +1,96 @@
+"""
+    Tests the built in HTML renderer on emails that are unusual enough to break it.
+"""
+
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+DEEPLY_NESTED_HTML = '<div>' * 2000 + '<p>Deep <b>inside</b></p>' + '</div>' * 2000 + '<p>After</p>'
+
+class HTMLRenderingTest(unittest.TestCase):
+
+    def test_deeply_nested_html_keeps_its_formatting(self):
+        html = (
+            '<div>' * 2000 + '<span>' * 2000 + 'Deep <b>inside</b> <a href="https://example.com">a link</a>' + '</span>' * 2000 + '</div>' * 2000
+            + '<table><tr><td>' * 500 + '<ul><li>item</li></ul>' + '</td></tr></table>' * 500
+        )
+
+        rendered_segment, = terminal_gmail_client.render_html_segments_builtin([html], width=40)
+
+        self.assertIn(f'Deep {terminal_gmail_client.ANSI_BOLD}inside{terminal_gmail_client.ANSI_RESET}', rendered_segment)
+        self.assertIn('[1]', rendered_segment)
+        self.assertIn('[1] https://example.com', rendered_segment)
+        self.assertIn('• item', rendered_segment)
+
+    def test_nested_blocks_are_rendered_in_order(self):
+        html = (
+            '<p>Intro <a href="https://one.example.com">one</a></p>'
+            '<ul><li>First<ol><li>Nested <a href="https://two.example.com">two</a></li></ol></li><li>Second</li></ul>'
+            '<blockquote>Quoted <a href="https://three.example.com">three</a></blockquote>'
+            '<table><tr><td>Cell</td><td>Other <a href="https://four.example.com">four</a></td></tr></table>'
+        )
+
+        rendered_segment, = terminal_gmail_client.render_html_segments_builtin([html], width=60)
+        rendered_text = terminal_gmail_client.ansi_escape_regex.sub('', rendered_segment)
+
+        self.assertEqual(
+            rendered_text,
+            'Intro one[1]\n\n• First\n  \n  1. Nested two[2]\n  \n• Second\n\n│ Quoted three[3]\n\nCell │ Other four[4]\n\n'
+            'Links:\n[1] https://one.example.com\n[2] https://two.example.com\n[3] https://three.example.com\n[4] https://four.example.com\n'
+        )
+
+    def test_text_of_deeply_nested_html(self):
+        html_tree = terminal_gmail_client.parse_html_tree(DEEPLY_NESTED_HTML)
+
+        self.assertEqual(terminal_gmail_client.get_node_text(html_tree), 'Deep insideAfter')
+        self.assertEqual(terminal_gmail_client.get_html_shown_text(html_tree).split(), ['Deep', 'inside', 'After'])
+
+    def test_shown_text_keeps_blocks_and_line_breaks(self):
+        html_tree = terminal_gmail_client.parse_html_tree('<p>One<br>Two</p><div>Three <span>four</span></div><script>hidden</script>')
+
+        self.assertEqual(terminal_gmail_client.get_html_shown_text(html_tree), '\n\nOne\nTwo\n\n\n\nThree four\n\n')
+
+class DataURITest(unittest.TestCase):
+
+    def test_base64_and_percent_encoded_data_uris(self):
+        self.assertEqual(terminal_gmail_client.decode_data_uri('data:image/png;base64,aGVsbG8='), b'hello')
+        self.assertEqual(terminal_gmail_client.decode_data_uri('data:image/svg+xml,%3Csvg%2F%3E'), b'<svg/>')
+        self.assertEqual(terminal_gmail_client.decode_data_uri('data:image/svg+xml;charset=utf-8,<svg/>'), b'<svg/>')
+
+    def test_data_uris_that_cannot_be_decoded(self):
+        self.assertIsNone(terminal_gmail_client.decode_data_uri('data:image/png;base64,aGVsbG8'))
+        self.assertIsNone(terminal_gmail_client.decode_data_uri('data:image/png;base64'))
+
+    def test_email_with_broken_data_uri_images_is_shown(self):
+        html = (
+            '<p>Before</p><img src="data:image/png;base64,aGVsbG8"><img src="data:image/svg+xml,%3Csvg%2F%3E">'
+            '<img src="data:nothing"><p>After</p>'
+        )
+        shown_images = []
+        output = []
+
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(terminal_gmail_client, 'CACHE_DIRECTORY', directory), \
+                mock.patch.object(terminal_gmail_client, 'HTML_RENDERER', 'builtin'), \
+                mock.patch.object(terminal_gmail_client, 'display_if_image', lambda filepath: shown_images.append(filepath) and False), \
+                mock.patch.object(terminal_gmail_client, 'write_output', output.append):
+            terminal_gmail_client.display_html_email(types.SimpleNamespace(html=html, attachments=[]), {})
+
+            self.assertEqual(len(shown_images), 1)
+
+            with open(shown_images[0], 'rb') as f:
+                self.assertEqual(f.read(), b'<svg/>')
+
+        self.assertIn('Before', ''.join(output))
+        self.assertIn('After', ''.join(output))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+    Tests the HTTP cache of remote images against a local HTTP server that counts the requests it gets.
+"""
+
+import collections
+import http.server
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+ETAG = '"v1"'
+LAST_MODIFIED = 'Mon, 01 Jan 2024 00:00:00 GMT'
+
+# the response headers of every path, the server answers 304 when a validator matches
+RESPONSE_HEADERS = {
+    '/fresh.png': {'Cache-Control': 'max-age=3600'},
+    '/etag.png': {'Cache-Control': 'no-cache', 'ETag': ETAG},
+    '/last-modified.png': {'Cache-Control': 'max-age=0', 'Last-Modified': LAST_MODIFIED},
+    '/no-store.png': {'Cache-Control': 'no-store', 'ETag': ETAG},
+}
+
+class CountingHandler(http.server.BaseHTTPRequestHandler):
+    """
+        Serves the path as the body, and remembers the status of every request for each path.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        headers = RESPONSE_HEADERS.get(self.path)
+
+        if headers is None:
+            status, headers, body = 404, {}, b'not found'
+        elif self.headers.get('If-None-Match') == headers.get('ETag', object()) or self.headers.get('If-Modified-Since') == headers.get('Last-Modified', object()):
+            status, body = 304, b''
+        else:
+            status, body = 200, self.path.encode()
+
+        self.server.statuses[self.path].append(status)
+
+        self.send_response(status)
+
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class HTTPCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.original_settings = (terminal_gmail_client.CACHE_DIRECTORY, terminal_gmail_client.message_cache_connection)
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        terminal_gmail_client.CACHE_DIRECTORY = self.directory.name
+        terminal_gmail_client.message_cache_connection = None
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+        self.server.statuses = collections.defaultdict(list)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+        if terminal_gmail_client.message_cache_connection:
+            terminal_gmail_client.message_cache_connection.close()
+
+        terminal_gmail_client.CACHE_DIRECTORY, terminal_gmail_client.message_cache_connection = self.original_settings
+
+    def download(self, path: str):
+        return terminal_gmail_client.download_remote_file(f'http://127.0.0.1:{self.server.server_address[1]}{path}')
+
+    def read(self, filepath: str) -> bytes:
+        with open(filepath, 'rb') as f:
+            return f.read()
+
+    def test_fresh_response_is_served_without_a_request(self):
+        first_filepath = self.download('/fresh.png')
+
+        self.assertEqual(self.download('/fresh.png'), first_filepath)
+        self.assertEqual(self.read(first_filepath), b'/fresh.png')
+        self.assertEqual(self.server.statuses['/fresh.png'], [200])
+
+    def test_stale_response_is_revalidated_with_its_etag(self):
+        first_filepath = self.download('/etag.png')
+
+        self.assertEqual(self.download('/etag.png'), first_filepath)
+        self.assertEqual(self.download('/etag.png'), first_filepath)
+        self.assertEqual(self.read(first_filepath), b'/etag.png')
+        self.assertEqual(self.server.statuses['/etag.png'], [200, 304, 304])
+
+    def test_stale_response_is_revalidated_with_its_last_modified_date(self):
+        first_filepath = self.download('/last-modified.png')
+
+        self.assertEqual(self.download('/last-modified.png'), first_filepath)
+        self.assertEqual(self.server.statuses['/last-modified.png'], [200, 304])
+
+    def test_evicted_file_is_downloaded_again_without_validators(self):
+        os.remove(self.download('/etag.png'))
+
+        self.assertEqual(self.read(self.download('/etag.png')), b'/etag.png')
+        self.assertEqual(self.server.statuses['/etag.png'], [200, 200])
+
+    def test_no_store_response_is_not_cached(self):
+        self.assertEqual(self.read(self.download('/no-store.png')), b'/no-store.png')
+        self.download('/no-store.png')
+
+        self.assertEqual(self.server.statuses['/no-store.png'], [200, 200])
+
+    def test_error_response_is_not_cached(self):
+        self.assertIsNone(self.download('/missing.png'))
+        self.assertIsNone(self.download('/missing.png'))
+
+        self.assertEqual(self.server.statuses['/missing.png'], [404, 404])
+        self.assertEqual(terminal_gmail_client.get_message_cache().execute('SELECT COUNT(*) FROM http_cache').fetchone(), (0,))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+    Tests that the inline images of plain text emails are shown, whether the email is printed or shown in the pager.
+"""
+
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+class InlineImagesTest(unittest.TestCase):
+
+    def print_email(self, text: str) -> tuple:
+        """
+            Prints a plain text email, returning the inline images shown, what was printed, and what was paged.
+        """
+
+        message = types.SimpleNamespace(html=None, text=text, attachments=[])
+
+        with mock.patch.object(terminal_gmail_client, 'display_inline_image', return_value=(None, False)) as display_inline_image, \
+                mock.patch.object(terminal_gmail_client, 'page_text') as page_text, \
+                mock.patch.object(terminal_gmail_client, 'print') as print_:
+            terminal_gmail_client.print_email(message)
+
+        shown_images = [(call.args[0], call.kwargs['use_cid']) for call in display_inline_image.call_args_list]
+        printed_lines = [call.args[0] for call in print_.call_args_list]
+        paged_texts = [call.args[0] for call in page_text.call_args_list]
+
+        return shown_images, printed_lines, paged_texts
+
+    def test_short_email_shows_images_where_their_tags_are(self):
+        shown_images, printed_lines, paged_texts = self.print_email('Hello\n[image: a.png]\nand\n[cid:b@example.com]\nbye')
+
+        self.assertEqual(shown_images, [('a.png', False), ('b@example.com', True)])
+        self.assertEqual(printed_lines, ['Hello', '', '', 'and', '', '', 'bye'])
+        self.assertEqual(paged_texts, [])
+
+    def test_long_email_shows_images_after_the_pager(self):
+        text = 'Hello\n[image: a.png]\n' + 'long line\n' * 1000 + '[cid:b@example.com]\n[image: a.png]\nbye'
+
+        shown_images, printed_lines, paged_texts = self.print_email(text)
+
+        self.assertEqual(paged_texts, [text])
+        self.assertEqual(shown_images, [('a.png', False), ('b@example.com', True)])
+        self.assertEqual(printed_lines, ['\n---- Inline images ----', '\n[image: a.png]', '\n[cid:b@example.com]'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+    Tests that the program exits right away when the user stops waiting for background operations,
+    and that label changes are only sent when they change something.
+"""
+
+import os
+import subprocess
+import sys
+import textwrap
+import time
+import types
+import unittest
+from unittest import mock
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_DIRECTORY)
+
+import terminal_gmail_client
+
+class IOShutdownTest(unittest.TestCase):
+
+    def test_control_c_at_exit_does_not_wait_for_a_blocked_request(self):
+        # the request stands in for one blocked on the network or sleeping before a retry
+        script = textwrap.dedent('''
+            import os, signal, sys, threading, time
+            sys.path.insert(0, sys.argv[1])
+            import terminal_gmail_client
+
+            terminal_gmail_client.submit_io(time.sleep, 60)
+            threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGINT)).start()
+
+            try:
+                terminal_gmail_client.shutdown_io()
+            finally:
+                terminal_gmail_client.exit_abandoning_io()
+        ''')
+
+        started_at = time.monotonic()
+        completed_process = subprocess.run([sys.executable, '-c', script, REPOSITORY_DIRECTORY], env={**os.environ, 'HOME': os.environ.get('HOME', '/tmp')}, timeout=30)
+
+        self.assertEqual(completed_process.returncode, 130)
+        self.assertLess(time.monotonic() - started_at, 10)
+
+class LabelChangeTest(unittest.TestCase):
+
+    def make_message(self, label_ids: list):
+        return types.SimpleNamespace(
+            is_seen='UNREAD' not in label_ids,
+            label_ids=label_ids,
+            mark_read=mock.Mock(),
+            mark_unread=mock.Mock(),
+            add_labels=mock.Mock(),
+            remove_labels=mock.Mock(),
+            thread_id='thread',
+            gmail_client=mock.Mock(),
+        )
+
+    def get_label_changes(self, mark, *messages) -> list:
+        with mock.patch.object(terminal_gmail_client, 'submit_label_change') as submit_label_change:
+            mark(*messages)
+
+        return [description for _, description in (call.args for call in submit_label_change.call_args_list)]
+
+    def test_changes_that_change_nothing_are_not_sent(self):
+        read_message = self.make_message(['INBOX'])
+        unread_message = self.make_message(['INBOX', 'UNREAD'])
+        spam_message = self.make_message(['SPAM'])
+
+        self.assertEqual(self.get_label_changes(terminal_gmail_client.mark_read, read_message), [])
+        self.assertEqual(self.get_label_changes(terminal_gmail_client.mark_unread, unread_message), [])
+        self.assertEqual(self.get_label_changes(terminal_gmail_client.mark_as_spam, spam_message), [])
+        self.assertEqual(self.get_label_changes(terminal_gmail_client.mark_as_not_spam, read_message), [])
+        self.assertEqual(self.get_label_changes(terminal_gmail_client.mark_thread_read, [read_message, read_message]), [])
+
+    def test_changes_are_sent(self):
+        read_message = self.make_message(['INBOX'])
+        unread_message = self.make_message(['INBOX', 'UNREAD'])
+
+        self.assertEqual(self.get_label_changes(terminal_gmail_client.mark_read, unread_message), ['mark the email as read'])
+        self.assertEqual(self.get_label_changes(terminal_gmail_client.mark_unread, read_message), ['mark the email as unread'])
+        self.assertEqual(self.get_label_changes(terminal_gmail_client.mark_thread_read, [read_message, unread_message]), ['mark the conversation as read'])
+        self.assertEqual(self.get_label_changes(terminal_gmail_client.mark_thread_as_spam, [read_message]), ['mark the conversation as spam'])
+
+if __name__ == '__main__':
+    unittest.main()
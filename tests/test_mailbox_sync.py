@@ -0,0 +1,157 @@
+"""
+    Tests that syncing with a checkpoint asks GMail for as much as changed since it, however big the mailbox is,
+    against a stand-in for the history and messages APIs that counts the requests it gets and the bytes it answers with.
+"""
+
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+import types
+import unittest
+
+import google_workspace.gmail.histories
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+MAILBOX_SIZE = 5000
+HISTORY_PAGE_SIZE = 500
+
+class FakeRequest:
+
+    def __init__(self, service, response: dict):
+        self.service = service
+        self.response = response
+
+    def execute(self):
+        self.service.requests_made_off_the_main_thread.append(threading.current_thread() is not threading.main_thread())
+
+        # the cache must not be locked while waiting for GMail
+        is_cache_unlocked = terminal_gmail_client.message_cache_lock.acquire(blocking=False)
+
+        if is_cache_unlocked:
+            terminal_gmail_client.message_cache_lock.release()
+
+        self.service.requests_made_with_the_cache_unlocked.append(is_cache_unlocked)
+        self.service.response_bytes += len(json.dumps(self.response))
+
+        return self.response
+
+class FakeGmailService:
+    """
+        A mailbox where message number N was added with history id N, and which pages its history like GMail does.
+    """
+
+    def __init__(self, mailbox_size: int):
+        self.mailbox_size = mailbox_size
+        self.history_list_calls = 0
+        self.message_list_calls = 0
+        self.response_bytes = 0
+        self.requests_made_off_the_main_thread = []
+        self.requests_made_with_the_cache_unlocked = []
+
+        self.history_service = types.SimpleNamespace(list=self.list_history)
+        self.messages_service = types.SimpleNamespace(list=self.list_messages)
+
+    def list_history(self, userId, startHistoryId, pageToken=None, maxResults=None, **kwargs) -> FakeRequest:
+        self.history_list_calls += 1
+
+        first_history_id = int(pageToken or startHistoryId) + 1
+        last_history_id = min(first_history_id + HISTORY_PAGE_SIZE - 1, self.mailbox_size)
+
+        response = {
+            'history': [
+                {
+                    'id': str(history_id),
+                    'messages': [{'id': f'message-{history_id}', 'threadId': f'thread-{history_id}'}],
+                    'messagesAdded': [{'message': {'id': f'message-{history_id}', 'threadId': f'thread-{history_id}', 'labelIds': ['INBOX', 'UNREAD']}}],
+                }
+                for history_id in range(first_history_id, last_history_id + 1)
+            ],
+            'historyId': str(self.mailbox_size),
+        }
+
+        if last_history_id < self.mailbox_size:
+            response['nextPageToken'] = str(last_history_id)
+
+        return FakeRequest(self, response)
+
+    def list_messages(self, **kwargs) -> FakeRequest:
+        self.message_list_calls += 1
+
+        return FakeRequest(self, {'messages': [{'id': f'message-{index}'} for index in range(1, self.mailbox_size + 1)]})
+
+class MailboxSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        self.original_settings = (terminal_gmail_client.CACHE_DIRECTORY, terminal_gmail_client.message_cache_connection)
+
+        terminal_gmail_client.CACHE_DIRECTORY = self.directory.name
+        terminal_gmail_client.message_cache_connection = None
+
+    def tearDown(self):
+        if terminal_gmail_client.message_cache_connection:
+            terminal_gmail_client.message_cache_connection.close()
+
+        terminal_gmail_client.CACHE_DIRECTORY, terminal_gmail_client.message_cache_connection = self.original_settings
+
+    def sync(self, new_message_count: int) -> FakeGmailService:
+        """
+            Syncs from a checkpoint taken before the last new_message_count messages were added, in a fresh cache.
+        """
+
+        service = FakeGmailService(MAILBOX_SIZE)
+        client = types.SimpleNamespace(service=service)
+        client.get_history = functools.partial(google_workspace.gmail.histories.ListHistoryResponse, client)
+
+        if terminal_gmail_client.message_cache_connection:
+            terminal_gmail_client.message_cache_connection.close()
+
+        terminal_gmail_client.message_cache_connection = None
+        terminal_gmail_client.set_sync_checkpoint(str(MAILBOX_SIZE - new_message_count))
+
+        terminal_gmail_client.sync_unread_messages(client)
+
+        with terminal_gmail_client.message_cache_lock:
+            unread_count, = terminal_gmail_client.get_message_cache().execute("SELECT COUNT(*) FROM messages WHERE label_ids LIKE '%\"UNREAD\"%'").fetchone()
+
+        self.assertEqual(unread_count, new_message_count)
+        self.assertEqual(terminal_gmail_client.get_sync_checkpoint(), str(MAILBOX_SIZE))
+
+        return service
+
+    def test_small_delta_takes_one_request_whatever_the_mailbox_size(self):
+        service = self.sync(new_message_count=20)
+
+        self.assertEqual(service.history_list_calls, 1)
+        self.assertEqual(service.message_list_calls, 0)
+
+    def test_requests_and_bytes_grow_with_the_new_mail(self):
+        small_delta_service = self.sync(new_message_count=20)
+        large_backlog_service = self.sync(new_message_count=1200)
+
+        self.assertEqual(large_backlog_service.history_list_calls, 3)
+        self.assertEqual(large_backlog_service.message_list_calls, 0)
+
+        # the bytes per new message stay about the same, so the payload is proportional to the new mail
+        small_delta_bytes_per_message = small_delta_service.response_bytes / 20
+        large_backlog_bytes_per_message = large_backlog_service.response_bytes / 1200
+
+        self.assertLess(small_delta_service.response_bytes * 20, large_backlog_service.response_bytes)
+        self.assertAlmostEqual(small_delta_bytes_per_message / large_backlog_bytes_per_message, 1, delta=0.2)
+
+    def test_history_pages_are_downloaded_in_the_background_with_the_cache_unlocked(self):
+        service = self.sync(new_message_count=1200)
+
+        self.assertEqual(service.requests_made_off_the_main_thread, [True] * 3)
+        self.assertEqual(service.requests_made_with_the_cache_unlocked, [True] * 3)
+
+if __name__ == '__main__':
+    unittest.main()
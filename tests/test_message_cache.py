@@ -0,0 +1,125 @@
+"""
+    Tests that messages served from the local cache show their current labels.
+"""
+
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import googleapiclient.errors
+import httplib2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+def make_message_metadata(gmail_id: str, label_ids: list) -> dict:
+    return {
+        'id': gmail_id,
+        'threadId': gmail_id,
+        'labelIds': label_ids,
+        'internalDate': '0',
+        'payload': {'headers': [{'name': 'Subject', 'value': f'Subject of {gmail_id}'}]},
+    }
+
+class FakeBatch:
+    """
+        Answers every request added to it with the response for its id, or a 404 for ids without one.
+    """
+
+    def __init__(self, responses: dict, callback):
+        self.responses = responses
+        self.callback = callback
+        self.request_ids = []
+
+    def add(self, request, request_id):
+        self.request_ids.append(request_id)
+
+    def execute(self, http=None):
+        for request_id in self.request_ids:
+            if request_id in self.responses:
+                self.callback(request_id, self.responses[request_id], None)
+            else:
+                self.callback(request_id, None, googleapiclient.errors.HttpError(httplib2.Response({'status': 404}), b''))
+
+class MessageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        self.original_settings = (terminal_gmail_client.CACHE_DIRECTORY, terminal_gmail_client.message_cache_connection)
+
+        terminal_gmail_client.CACHE_DIRECTORY = self.directory.name
+        terminal_gmail_client.message_cache_connection = None
+
+        # cached while unread, then read on another device
+        terminal_gmail_client.cache_messages_data([make_message_metadata('cached', ['INBOX', 'UNREAD'])], 'metadata')
+
+        self.client = types.SimpleNamespace()
+
+    def tearDown(self):
+        terminal_gmail_client.message_cache_connection.close()
+
+        terminal_gmail_client.CACHE_DIRECTORY, terminal_gmail_client.message_cache_connection = self.original_settings
+
+    def test_labels_are_refreshed_in_one_batch_without_a_checkpoint(self):
+        with mock.patch.object(terminal_gmail_client, 'fetch_messages_data', return_value=[{'id': 'cached', 'labelIds': ['INBOX']}]) as fetch_messages_data:
+            messages = terminal_gmail_client.get_messages_by_id(self.client, ['cached'])
+
+        fetch_messages_data.assert_called_once_with(self.client, ['cached'], format='minimal')
+        self.assertTrue(messages[0].is_seen)
+        self.assertEqual(terminal_gmail_client.get_cached_label_ids(['cached']), {'cached': ['INBOX']})
+
+    def test_labels_are_refreshed_from_the_history_since_the_checkpoint(self):
+        terminal_gmail_client.set_sync_checkpoint('100')
+
+        def apply_history(client, checkpoint):
+            terminal_gmail_client.update_cached_label_ids({'id': 'cached', 'labelIds': ['INBOX']})
+
+        with mock.patch.object(terminal_gmail_client, 'apply_history_since_checkpoint', side_effect=apply_history) as apply_history_since_checkpoint, \
+                mock.patch.object(terminal_gmail_client, 'fetch_messages_data') as fetch_messages_data:
+            messages = terminal_gmail_client.get_messages_by_id(self.client, ['cached'])
+
+        apply_history_since_checkpoint.assert_called_once_with(self.client, '100')
+        fetch_messages_data.assert_not_called()
+        self.assertTrue(messages[0].is_seen)
+
+    def test_messages_deleted_elsewhere_are_not_shown(self):
+        terminal_gmail_client.set_sync_checkpoint('100')
+
+        def apply_history(client, checkpoint):
+            terminal_gmail_client.forget_cached_messages(['cached'])
+
+        with mock.patch.object(terminal_gmail_client, 'apply_history_since_checkpoint', side_effect=apply_history), \
+                mock.patch.object(terminal_gmail_client, 'fetch_messages_data', return_value=[]):
+            messages = terminal_gmail_client.get_messages_by_id(self.client, ['cached'])
+
+        self.assertEqual(messages, [])
+
+    def test_labels_are_not_refreshed_right_after_a_sync(self):
+        with mock.patch.object(terminal_gmail_client, 'refresh_cached_label_ids') as refresh_cached_label_ids:
+            messages = terminal_gmail_client.get_messages_by_id(self.client, ['cached'], are_labels_current=True)
+
+        refresh_cached_label_ids.assert_not_called()
+        self.assertFalse(messages[0].is_seen)
+
+    def test_messages_deleted_since_they_were_listed_are_skipped(self):
+        responses = {'kept': make_message_metadata('kept', ['INBOX'])}
+
+        client = types.SimpleNamespace(service=types.SimpleNamespace(
+            new_batch_http_request=lambda callback: FakeBatch(responses, callback),
+            messages_service=types.SimpleNamespace(get=lambda **kwargs: kwargs),
+        ))
+
+        with mock.patch.object(terminal_gmail_client, 'new_authorized_http'):
+            messages_data = terminal_gmail_client.fetch_messages_data(client, ['cached', 'kept'], format='minimal')
+
+        self.assertEqual([message_data['id'] for message_data in messages_data], ['kept'])
+        self.assertEqual(terminal_gmail_client.get_cached_messages_data(['cached'], allow_metadata=True), {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+    Tests that every email file in the outbox belongs to an outbox row, even when the program stops while adding one.
+"""
+
+import email.message
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+class OutboxQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.original_settings = (terminal_gmail_client.CACHE_DIRECTORY, terminal_gmail_client.message_cache_connection)
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        terminal_gmail_client.CACHE_DIRECTORY = self.directory.name
+        terminal_gmail_client.message_cache_connection = None
+
+        patchers = (
+            mock.patch.object(terminal_gmail_client, 'drain_outbox'),
+            mock.patch.object(terminal_gmail_client, 'print'),
+        )
+
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        if terminal_gmail_client.message_cache_connection:
+            terminal_gmail_client.message_cache_connection.close()
+
+        terminal_gmail_client.CACHE_DIRECTORY, terminal_gmail_client.message_cache_connection = self.original_settings
+
+    def make_message(self, subject: str) -> email.message.EmailMessage:
+        message = email.message.EmailMessage()
+        message['To'] = 'someone@example.com'
+        message['Subject'] = subject
+        message.set_content('Hello')
+
+        return message
+
+    def get_outbox_state(self) -> tuple:
+        rows = terminal_gmail_client.get_message_cache().execute('SELECT filepath, status FROM outbox ORDER BY outbox_id').fetchall()
+        filepaths = sorted(os.path.join(terminal_gmail_client.get_outbox_directory(), filename) for filename in os.listdir(terminal_gmail_client.get_outbox_directory()))
+
+        return rows, filepaths
+
+    def test_queued_email_has_a_row_and_a_file(self):
+        terminal_gmail_client.queue_email(self.make_message('Queued'))
+
+        rows, filepaths = self.get_outbox_state()
+
+        self.assertEqual(rows, [(filepaths[0], 'queued')])
+        self.assertEqual(len(filepaths), 1)
+
+    def test_email_that_cannot_be_written_leaves_nothing_behind(self):
+        with mock.patch.object(terminal_gmail_client, 'write_email_file', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                terminal_gmail_client.queue_email(self.make_message('Not written'))
+
+        self.assertEqual(self.get_outbox_state(), ([], []))
+
+    def test_clean_outbox_removes_what_a_stopped_program_left_behind(self):
+        terminal_gmail_client.queue_email(self.make_message('Queued'))
+        (queued_filepath, _), = self.get_outbox_state()[0]
+
+        # the program stopped while writing an email, and after sending another one but before removing its file
+        connection = terminal_gmail_client.get_message_cache()
+        connection.execute(
+            'INSERT INTO outbox (filepath, subject, status, attempts, next_attempt_at, uploaded_bytes) VALUES (?, ?, ?, ?, ?, ?)',
+            (os.path.join(terminal_gmail_client.get_outbox_directory(), 'unfinished.eml'), 'Unfinished', 'writing', 0, 0, 0)
+        )
+        connection.commit()
+
+        for filename in ('unfinished.partial', 'sent.eml'):
+            with open(os.path.join(terminal_gmail_client.get_outbox_directory(), filename), 'w') as f:
+                f.write('left behind')
+
+        self.assertEqual([outbox_email[3] for outbox_email in terminal_gmail_client.get_outbox_emails()], ['Queued'])
+
+        terminal_gmail_client.clean_outbox()
+
+        self.assertEqual(self.get_outbox_state(), ([(queued_filepath, 'queued')], [queued_filepath]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+"""
+    Tests resumable outbox uploads against a local mock of the GMail upload endpoint that drops connections mid-stream.
+"""
+
+import http.server
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import types
+import unittest
+
+import google.auth.credentials
+import googleapiclient.http
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+CHUNK_SIZE = 256 * 1024
+content_range_regex = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+class MockUploadHandler(http.server.BaseHTTPRequestHandler):
+    """
+        Implements the parts of the resumable upload protocol GMail uses.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_status(self, status: int, headers: dict = None, body: bytes = b'') -> None:
+        self.send_response(status)
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_progress(self, session: dict) -> None:
+        if len(session['data']) == session['size']:
+            self.send_status(200, {'Content-Type': 'application/json'}, json.dumps({'id': 'sent-message'}).encode())
+        elif session['data']:
+            self.send_status(308, {'Range': f'bytes=0-{len(session["data"]) - 1}'})
+        else:
+            self.send_status(308)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        session_id = str(len(self.server.sessions))
+        self.server.sessions[session_id] = {'data': bytearray(), 'size': int(self.headers['X-Upload-Content-Length'])}
+
+        self.send_status(200, {'Location': f'{self.server.base_url}/session/{session_id}'})
+
+    def do_PUT(self):
+        session = self.server.sessions.get(self.path.rsplit('/', 1)[-1])
+        content_length = int(self.headers.get('Content-Length', 0))
+
+        if session is None:
+            self.rfile.read(content_length)
+            self.send_status(404)
+            return
+
+        # a status query
+        if self.headers['Content-Range'].startswith('bytes */'):
+            self.send_progress(session)
+            return
+
+        start = int(content_range_regex.match(self.headers['Content-Range']).group(1))
+
+        if start == self.server.drop_at_offset:
+            # hang up while the chunk is being sent, without waiting for it, since a retried request can send less than it says
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+
+        chunk = self.rfile.read(content_length)
+        assert start == len(session['data']), 'chunks must continue where the last one stopped'
+
+        session['data'] += chunk
+        self.server.bytes_received += len(chunk)
+
+        self.send_progress(session)
+
+class OutboxUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MockUploadHandler)
+        self.server.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.server.sessions = {}
+        self.server.drop_at_offset = None
+        self.server.bytes_received = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        self.original_settings = (
+            terminal_gmail_client.CACHE_DIRECTORY,
+            terminal_gmail_client.message_cache_connection,
+            terminal_gmail_client.OUTBOX_UPLOAD_CHUNK_BYTES,
+            terminal_gmail_client.BULK_OPERATION_MAXIMUM_RETRIES,
+        )
+
+        terminal_gmail_client.CACHE_DIRECTORY = self.directory.name
+        terminal_gmail_client.message_cache_connection = None
+        terminal_gmail_client.OUTBOX_UPLOAD_CHUNK_BYTES = CHUNK_SIZE
+        terminal_gmail_client.BULK_OPERATION_MAXIMUM_RETRIES = 0
+
+        self.payload = os.urandom(4 * CHUNK_SIZE + 1000)
+        self.filepath = os.path.join(self.directory.name, 'big.eml')
+
+        with open(self.filepath, 'wb') as f:
+            f.write(self.payload)
+
+        connection = terminal_gmail_client.get_message_cache()
+        self.outbox_id = connection.execute(
+            'INSERT INTO outbox (filepath, subject, status, attempts, next_attempt_at, uploaded_bytes) VALUES (?, ?, ?, ?, ?, ?)',
+            (self.filepath, 'big', 'queued', 0, 0, 0)
+        ).lastrowid
+        connection.commit()
+
+        self.client = types.SimpleNamespace(service=types.SimpleNamespace(
+            credentials=google.auth.credentials.AnonymousCredentials(),
+            messages_service=types.SimpleNamespace(send=self.send),
+        ))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+        terminal_gmail_client.message_cache_connection.close()
+
+        (
+            terminal_gmail_client.CACHE_DIRECTORY,
+            terminal_gmail_client.message_cache_connection,
+            terminal_gmail_client.OUTBOX_UPLOAD_CHUNK_BYTES,
+            terminal_gmail_client.BULK_OPERATION_MAXIMUM_RETRIES,
+        ) = self.original_settings
+
+    def send(self, userId, body, media_body):
+        return googleapiclient.http.HttpRequest(
+            googleapiclient.http.build_http(),
+            lambda response, content: json.loads(content),
+            f'{self.server.base_url}/upload?uploadType=resumable',
+            method='POST',
+            body=json.dumps(body),
+            headers={'content-type': 'application/json'},
+            methodId='gmail.users.messages.send',
+            resumable=media_body,
+        )
+
+    def get_saved_progress(self) -> tuple:
+        return terminal_gmail_client.get_message_cache().execute(
+            'SELECT upload_uri, uploaded_bytes FROM outbox WHERE outbox_id = ?',
+            (self.outbox_id,)
+        ).fetchone()
+
+    def upload(self, upload_uri=None) -> dict:
+        return terminal_gmail_client.upload_outbox_email(self.client, self.outbox_id, self.filepath, None, upload_uri)
+
+    def test_upload_sends_every_chunk(self):
+        self.assertEqual(self.upload(), {'id': 'sent-message'})
+        self.assertEqual(bytes(self.server.sessions['0']['data']), self.payload)
+
+    def test_interrupted_upload_resumes_from_the_last_chunk_received(self):
+        self.server.drop_at_offset = 2 * CHUNK_SIZE
+
+        with self.assertRaises(Exception):
+            self.upload()
+
+        upload_uri, uploaded_bytes = self.get_saved_progress()
+        self.assertEqual(uploaded_bytes, 2 * CHUNK_SIZE)
+
+        self.server.drop_at_offset = None
+        self.server.bytes_received = 0
+
+        self.assertEqual(self.upload(upload_uri), {'id': 'sent-message'})
+        self.assertEqual(bytes(self.server.sessions['0']['data']), self.payload)
+
+        # only the chunks GMail did not have yet were sent again
+        self.assertEqual(self.server.bytes_received, len(self.payload) - 2 * CHUNK_SIZE)
+        self.assertEqual(len(self.server.sessions), 1)
+
+    def test_expired_upload_starts_over(self):
+        self.assertEqual(self.upload(f'{self.server.base_url}/session/expired'), {'id': 'sent-message'})
+        self.assertEqual(bytes(self.server.sessions['0']['data']), self.payload)
+
+    def test_finished_upload_is_not_sent_again(self):
+        self.upload()
+        self.server.bytes_received = 0
+
+        self.assertEqual(self.upload(f'{self.server.base_url}/session/0'), {'id': 'sent-message'})
+        self.assertEqual(self.server.bytes_received, 0)
+
+if __name__ == '__main__':
+    unittest.main()
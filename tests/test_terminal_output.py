@@ -0,0 +1,40 @@
+"""
+    Tests that buffered output writes the same bytes print used to write a line at a time.
+"""
+
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import terminal_gmail_client
+
+class TerminalOutputTest(unittest.TestCase):
+
+    def print_lines(self, lines: list, should_color_output: bool) -> str:
+        stdout = io.StringIO()
+
+        with mock.patch.object(terminal_gmail_client, 'should_color_output', should_color_output), \
+                mock.patch.object(terminal_gmail_client.sys, 'stdout', stdout):
+            for line in lines:
+                terminal_gmail_client.pprint(line)
+
+            terminal_gmail_client.flush_output()
+
+        return stdout.getvalue()
+
+    def test_lines_are_colored_like_termcolor_black_on_white(self):
+        # termcolor.cprint(text, 'black', 'on_white') wrote the background, then the foreground, then a reset
+        self.assertEqual(
+            self.print_lines(['Inbox', '\x1b[1mbold\x1b[0m'], should_color_output=True),
+            '\x1b[47m\x1b[30mInbox\x1b[0m\n\x1b[47m\x1b[30m\x1b[1mbold\x1b[0m\x1b[0m\n'
+        )
+
+    def test_colors_are_left_out_when_not_a_terminal(self):
+        self.assertEqual(self.print_lines(['Inbox', '\x1b[1mbold\x1b[0m'], should_color_output=False), 'Inbox\nbold\n')
+
+if __name__ == '__main__':
+    unittest.main()